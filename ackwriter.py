@@ -0,0 +1,121 @@
+""" Direct to bytes ACK datagram writer
+
+ACK is the most frequent outgoing datagram. AckWriter writes it
+straight into a reusable buffer without building SDP instances:
+"id", "in" of every received multipart piece, register values from the
+send queue and the signature. Register lines are encoded once (see
+register()) and can be reused for every ACK until the register is
+removed from the send queue.
+
+Datagrams are laid out by SDPPacker (same size limits, follow-up
+datagrams and multipart "in" rules), so output is byte for byte the
+same as SDPPacker.encode() would produce for the same ACK.
+"""
+from sdpitem import _encode_rank
+from signedsdp import SignedSDP
+from sdppacker import SDPPacker, line_size
+from sdpexception import SDPException, SDPDecodeException
+from udpcomm import MAX_SDP_SIZE
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'AckWriter',
+]
+
+class AckWriter(object):
+    """ Write ACK datagrams for one controller """
+    def __init__(self, controllerid, max_size=MAX_SDP_SIZE):
+        """ Create ACK writer
+
+        :param controllerid: controller id
+        :param max_size: max size of one datagram in bytes
+        """
+        self._id = controllerid
+        self._max_size = max_size
+        self._id_line = ('id:' + str(controllerid) + '\n').encode('UTF-8')
+        self._buf = bytearray()
+
+    @staticmethod
+    def register(reg, val):
+        """ Encode one register line
+
+        Value is validated and converted the same way as
+        SDP.add_keyvalue() does it.
+
+        :param reg: register (data key)
+        :param val: register value
+
+        :returns: (slot, rank, size, line) tuple, slot is the key
+            table slot, rank is the encode order, size is the size
+            counted by SDPPacker and line is the encoded line (bytes)
+
+        :raises SDPException: if value is not valid for the register
+        """
+        item = SignedSDP()
+        item.add_keyvalue(reg, val)
+        if len(item._table) != 1:
+            raise SDPException('register "%s" can not be sent' % reg)
+        entry = next(iter(item._table.items()))
+        return (entry[0], _encode_rank(entry), line_size(reg, val), \
+            item._encode_data().encode('UTF-8'))
+
+    def write(self, ins, registers, secret_key=None, nonce=None):
+        """ Write ACK datagrams
+
+        :param ins: list of "in" values of the received pieces
+        :param registers: list of register() tuples
+        :param secret_key: optional secret key for signed datagrams
+        :param nonce: nonce for signed datagrams
+
+        :returns: list of datagrams (bytes)
+
+        :raises SDPException: if there are several "in" values in one
+            datagram and some of them have no timestamp
+        """
+        if secret_key and nonce == None:
+            raise SDPDecodeException("nonce is required for HMAC")
+        packer = SDPPacker(self._id, self._max_size, secret_key, nonce)
+        for inn in ins:
+            packer.add_piece(inn)
+        for register in registers:
+            packer.add_item(register, register[2], register[0])
+        return [self._write_datagram(pieces, secret_key, nonce)
+                for pieces in packer.get_layout()]
+
+    def _write_datagram(self, pieces, secret_key, nonce):
+        """ Write one datagram into the buffer
+
+        :param pieces: datagram layout from SDPPacker.get_layout()
+        :param secret_key: optional secret key
+        :param nonce: nonce for the signature
+
+        :returns: datagram (bytes)
+        """
+        buf = self._buf
+        del buf[:]
+        buf += self._id_line
+        for (inn, registers) in pieces:
+            if inn is not None:
+                buf += ('in:' + inn + '\n').encode('UTF-8')
+            if len(registers) == 1:
+                buf += registers[0][3]
+                continue
+            # same slot (e.g. "V" and "W"), last value at first position
+            regs = {}
+            for register in registers:
+                if register[0] in regs:
+                    regs[register[0]] = (regs[register[0]][0], register)
+                else:
+                    regs[register[0]] = (len(regs), register)
+            for (_pos, register) in sorted(regs.values(), \
+                    key=lambda x: (x[1][1], x[0])):
+                buf += register[3]
+        if secret_key:
+            csum = SignedSDP._calculate_checksum(buf)
+            buf += b'sha256:'
+            buf += SignedSDP._calculate_signature(csum, secret_key, nonce).encode()
+            buf += b'\n'
+        return bytes(buf)
@@ -10,6 +10,7 @@ from api_hostgroups import APIhostgroups
 from api_hosts import APIhosts
 from api_servicegroups import APIservicegroups
 from api_services import APIservices
+from api_system import APIsystem
 from api_usersessions import APIusersessions
 
 class API(object):
@@ -21,6 +22,7 @@ class API(object):
         'hosts': APIhosts,
         'servicegroups': APIservicegroups,
         'services': APIservices,
+        'system': APIsystem,
         'usersessions': APIusersessions
     }
 
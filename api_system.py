@@ -0,0 +1,75 @@
+from apibase import APIBase
+
+from schema import Schema
+
+import tornado.ioloop
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+class APIsystem(APIBase):
+
+    API_PATH = APIBase.API_BASE_PATH + '/system/'
+
+    _schema_GET = Schema(None)
+    _schema_PUT = Schema({
+        'active': bool,
+        })
+
+    def _request_get(self, **kwargs):
+        """ Return status of all system resources """
+        log.debug('_request_get(%s)', str(kwargs))
+        self._error_if_not_systemuser(**kwargs)
+        r = {}
+        for resource in self._get_resources():
+            r[resource] = self._get_resource_data(resource)
+        return {'status': 200, 'bodydata': r}
+
+    def _request_get_with_filter(self, **kwargs):
+        """ Return status of one system resource """
+        log.debug('_request_get_with_filter(%s)', str(kwargs))
+        self._error_if_not_systemuser(**kwargs)
+        fltr = kwargs.get('filter', '')
+        if not fltr in self._get_resources():
+            raise UserWarning('unknown system resource')
+        return {'status': 200, 'bodydata': self._get_resource_data(fltr)}
+
+    def _request_put(self, **kwargs):
+        """ Start or stop datagram capture """
+        log.debug('_request_put(%s)', str(kwargs))
+        self._error_if_not_systemuser(**kwargs)
+        data = self._get_data_or_error(**kwargs)
+        fltr = self._get_filter_or_error('system resource expected', \
+            **kwargs)
+        if fltr != 'capture' or not 'capture' in self._get_resources():
+            raise UserWarning('unknown system resource')
+        capture = self._core.udpcomm().get_capture()
+        # API requests are served outside of the IOLoop thread
+        if data['active']:
+            tornado.ioloop.IOLoop.instance().add_callback(capture.start)
+        else:
+            tornado.ioloop.IOLoop.instance().add_callback(capture.stop)
+        return {'status': 200}
+
+    def _get_resources(self):
+        """ Return list of available system resources """
+        resources = ['latency']
+        udpcomm = self._core.udpcomm()
+        if udpcomm:
+            resources.append('udpcomm')
+            resources.append('socket')
+            if udpcomm.get_capture():
+                resources.append('capture')
+        return resources
+
+    def _get_resource_data(self, resource):
+        """ Return status of system resource """
+        if resource == 'latency':
+            return self._hosts.get_latency().get()
+        udpcomm = self._core.udpcomm()
+        if resource == 'capture':
+            return udpcomm.get_capture().get_stats()
+        if resource == 'socket':
+            return udpcomm.get_socket_stats()
+        return udpcomm.get_stats()
@@ -18,6 +18,10 @@ GOOD
     http://api.uniscada.eu/api/v1/hosts/00204AA95C56
     http://api.uniscada.eu/api/v1/controllers/
     http://api.uniscada.eu/api/v1/controllers/00204AA95C56
+    http://api.uniscada.eu/api/v1/system
+    http://api.uniscada.eu/api/v1/system/capture
+    http://api.uniscada.eu/api/v1/system/latency
+    http://api.uniscada.eu/api/v1/system/socket
 
     https://api.uniscada.eu/api/v1/hostgroups
     https://api.uniscada.eu/api/v1/hostgroups/
@@ -86,6 +90,8 @@ import re
 
 from core import Core
 from udpcomm import *
+from asyncudpcomm import AsyncUDPComm
+from udpcapture import UDPCapture
 from sdpreceiver import SDPReceiver
 
 from api import API
@@ -118,12 +124,20 @@ class TimerTasks(object):
         self.ioloop.add_timeout(datetime.timedelta(seconds=self._interval), self._timer_tasks)
 
 class UDPReader(object):
-    def __init__(self, addr, port, core):
+    def __init__(self, addr, port, core, recv_budget=RECV_BUDGET, reuseport=False, send_queue_size=SEND_QUEUE_SIZE,
+                 addr_rate=0, addr_burst=None, controller_rate=0, controller_burst=None, capture=None,
+                 rcvbuf=0, sndbuf=0, engine='tornado'):
         import socket
 
         self._core = core
-        self.b = SDPReceiver(self._core)
-        self.u = UDPComm(addr, port, self.b.datagram_from_controller, self._core)
+        self.b = SDPReceiver(self._core, rate_limit=controller_rate, rate_burst=controller_burst)
+        if engine == 'asyncio':
+            udpcomm_class = AsyncUDPComm
+        else:
+            udpcomm_class = UDPComm
+        self.u = udpcomm_class(addr, port, self.b.datagram_from_controller, self._core, recv_budget=recv_budget, reuseport=reuseport, send_queue_size=send_queue_size, rate_limit=addr_rate, rate_burst=addr_burst, capture=capture,
+            rcvbuf=rcvbuf, sndbuf=sndbuf)
+        self._core.set_udpcomm(self.u)
 
         TimerTasks(10, self._core, self.u)
 
@@ -147,6 +161,13 @@ def signal_handler(signum, frame):
     elif signum == signal.SIGUSR1:
         log.info('dump status...')
         _statdump(core)
+    elif signum == signal.SIGUSR2:
+        capture = core.udpcomm().get_capture()
+        if capture:
+            log.info('toggle datagram capture...')
+            tornado.ioloop.IOLoop.instance().add_callback_from_signal(capture.toggle)
+        else:
+            log.warning('datagram capture is not configured')
     elif signum == signal.SIGTERM:
         log.info('exiting...')
         is_closing = True
@@ -160,6 +181,7 @@ def _statdump(core):
     status.info('WSClients: %s', str(core.wsclients()))
     status.info('MsgBus: %s', str(core.msgbus()))
     status.info('UDPComm: %s', str(udpcomm.u))
+    status.info('UDP socket: %s', str(udpcomm.u.get_socket_stats()))
 
 def try_exit():
     global is_closing
@@ -193,13 +215,51 @@ if __name__ == '__main__':
     tornado.options.define("ca_certs", default = srvconfig.get('https', 'ca_certs', fallback="cacert.pem"), help = "CA PEM certificate", type = str)
     tornado.options.define("listen_address", default = "0.0.0.0", help = "Listen this address only", type = str)
     tornado.options.define("udp_port", default = srvconfig.get('sdp', 'udp_port', fallback=44444), help = "UDP listen port", type = int)
+    tornado.options.define("udp_recv_budget", default = srvconfig.get('sdp', 'recv_budget', fallback=RECV_BUDGET), help = "max UDP datagrams read per IOLoop wakeup", type = int)
+    tornado.options.define("udp_send_queue", default = srvconfig.get('sdp', 'send_queue', fallback=SEND_QUEUE_SIZE), help = "max UDP datagrams waiting for writable socket", type = int)
+    tornado.options.define("udp_addr_rate", default = srvconfig.get('sdp', 'addr_rate', fallback=0), help = "max UDP datagrams per second from one address (0 for unlimited)", type = float)
+    tornado.options.define("udp_addr_burst", default = srvconfig.get('sdp', 'addr_burst', fallback=None), help = "max burst of UDP datagrams from one address", type = float)
+    tornado.options.define("udp_controller_rate", default = srvconfig.get('sdp', 'controller_rate', fallback=0), help = "max SDP datagrams per second from one controller (0 for unlimited)", type = float)
+    tornado.options.define("udp_controller_burst", default = srvconfig.get('sdp', 'controller_burst', fallback=None), help = "max burst of SDP datagrams from one controller", type = float)
+    tornado.options.define("capture_file", default = srvconfig.get('capture', 'file', fallback=""), help = "UDP datagram capture file (toggle with SIGUSR2)", type = str)
+    tornado.options.define("capture_maxbytes", default = srvconfig.get('capture', 'maxbytes', fallback=64*1024*1024), help = "rotate capture file when it grows over this size", type = int)
+    tornado.options.define("capture_backups", default = srvconfig.get('capture', 'backups', fallback=5), help = "number of rotated capture files to keep", type = int)
+    tornado.options.define("capture_start", default = srvconfig.getboolean('capture', 'start', fallback=False), help = "start datagram capture at startup", type = bool)
+    tornado.options.define("udp_rcvbuf", default = srvconfig.get('sdp', 'rcvbuf', fallback=0), help = "UDP socket receive buffer size (0 for system default)", type = int)
+    tornado.options.define("udp_sndbuf", default = srvconfig.get('sdp', 'sndbuf', fallback=0), help = "UDP socket send buffer size (0 for system default)", type = int)
+    tornado.options.define("udp_engine", default = srvconfig.get('sdp', 'engine', fallback='tornado'), help = "UDP ingest engine: tornado (IOLoop fd handler) or asyncio (datagram endpoint)", type = str)
+    tornado.options.define("uvloop", default = srvconfig.getboolean('sdp', 'uvloop', fallback=False), help = "use uvloop event loop if installed", type = bool)
+    tornado.options.define("udp_workers", default = srvconfig.get('sdp', 'workers', fallback=1), help = "number of SDP ingest processes sharing UDP port (SO_REUSEPORT)", type = int)
     tornado.options.define("configfile", default = "./apiserver.ini", help = "Configuration file", type = str)
 
     args = sys.argv
     args.append("--logging=debug")
     tornado.options.parse_command_line(args)
 
-    core = Core(configfile=options.configfile)
+    if options.uvloop:
+        try:
+            import asyncio
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            log.info("using uvloop event loop")
+        except ImportError:
+            log.warning("uvloop is not installed, using default event loop")
+
+    # Every worker process binds the UDP port with SO_REUSEPORT and
+    # runs its own SDPReceiver. Controller state is shared via Storage:
+    # nonce, registers and seq (checked and set atomically), so any
+    # worker can process the next datagram of a controller after its
+    # NAT port changes. HTTP(S) API is served by the first worker only,
+    # controller list is read from Storage, but statistics, remembered
+    # ACKs (duplicates) and send queues are kept per worker.
+    worker = None
+    if options.udp_workers > 1:
+        import tornado.process
+        log.info("forking %d SDP ingest workers", options.udp_workers)
+        worker = tornado.process.fork_processes(options.udp_workers)
+        log.info("SDP ingest worker %d started", worker)
+
+    core = Core(configfile=options.configfile, worker=worker)
 
     controllers = core.controllers()
     servicegroups = core.servicegroups()
@@ -214,13 +274,13 @@ if __name__ == '__main__':
 
     app = tornado.web.Application([
         (r'/files/([A-Za-z0-9\.\-_\/]+)', tornado.web.StaticFileHandler, {"path": "./static/"}),
-        (r'/api/v1/(servicegroups|hostgroups|services|hosts|controllers|usersessions)(/(.*))?', RestHandler, handler_settings),
+        (r'/api/v1/(servicegroups|hostgroups|services|hosts|controllers|usersessions|system)(/(.*))?', RestHandler, handler_settings),
         (r'/api/v1/ws', WebSocketHandler, handler_settings),
         (r'/api/v1/', RootHandler),
         (r'/.*', UnknownHandler)
     ], **app_settings)
 
-    if options.https_port != 0:
+    if options.https_port != 0 and not worker:
         log.info("HTTPS server listening on port %s", options.https_port)
         import tornado.httpserver
         httpsserver = tornado.httpserver.HTTPServer(app, ssl_options={
@@ -235,12 +295,25 @@ if __name__ == '__main__':
             })
         httpsserver.listen(options.https_port, address = options.listen_address)
 
-    if options.http_port != 0:
+    if options.http_port != 0 and not worker:
         log.info("HTTP server listening on port %s", options.http_port)
         app.listen(options.http_port, address = options.listen_address)
 
+    capture = None
+    if options.capture_file:
+        capture_file = options.capture_file
+        if worker != None:
+            capture_file += '.' + str(worker)
+        capture = UDPCapture(capture_file, maxbytes=options.capture_maxbytes, backups=options.capture_backups)
+        if options.capture_start:
+            capture.start()
+
     log.info("SDP listening on UDP port %s", options.udp_port)
-    udpcomm = UDPReader("0.0.0.0", int(options.udp_port), core)
+    udpcomm = UDPReader("0.0.0.0", int(options.udp_port), core, recv_budget=options.udp_recv_budget, reuseport=worker != None, send_queue_size=options.udp_send_queue,
+        addr_rate=options.udp_addr_rate, addr_burst=options.udp_addr_burst,
+        controller_rate=options.udp_controller_rate, controller_burst=options.udp_controller_burst,
+        capture=capture, rcvbuf=options.udp_rcvbuf, sndbuf=options.udp_sndbuf,
+        engine=options.udp_engine)
 
     import tornado.ioloop
 
@@ -248,6 +321,7 @@ if __name__ == '__main__':
     signal.signal(signal.SIGTERM, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGUSR1, signal_handler)
+    signal.signal(signal.SIGUSR2, signal_handler)
     signal.signal(signal.SIGALRM, signal_handler)
     tornado.ioloop.PeriodicCallback(try_exit, 100).start()
     tornado.ioloop.IOLoop.instance().start()
@@ -0,0 +1,164 @@
+""" UDP socket listener on asyncio datagram transport
+
+Alternative to UDPComm which registers the socket file descriptor
+directly in tornado IOLoop. Here the socket is served by the asyncio
+event loop (the same loop Tornado runs on) via
+loop.create_datagram_endpoint(), so a faster asyncio compatible event
+loop (uvloop) can be used as well.
+"""
+import time
+import asyncio
+
+from udpcomm import UDPComm, RECV_BUDGET, SEND_QUEUE_SIZE
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'AsyncUDPComm',
+]
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    """ Forward transport events to AsyncUDPComm """
+    def __init__(self, udpcomm):
+        self._udpcomm = udpcomm
+
+    def connection_made(self, transport):
+        self._udpcomm._connection_made(transport)
+
+    def datagram_received(self, data, addr):
+        self._udpcomm._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        self._udpcomm._error_received(exc)
+
+    def pause_writing(self):
+        self._udpcomm._pause_writing()
+
+    def resume_writing(self):
+        self._udpcomm._resume_writing()
+
+class AsyncUDPComm(UDPComm):
+    """ UDP socket listener on asyncio datagram transport """
+    def __init__(self, addr, port, handler, core, recv_budget=RECV_BUDGET,
+                 reuseport=False, send_queue_size=SEND_QUEUE_SIZE,
+                 rate_limit=0, rate_burst=None, capture=None,
+                 rcvbuf=0, sndbuf=0):
+        """ Listen UDP socket and forward all incoming datagrams to
+        the handler(host, data)
+
+        Parameters are the same as for UDPComm.
+
+        Datagrams received during one event loop iteration are
+        processed as one batch (up to recv_budget datagrams). Note that
+        the default asyncio selector transport reads only one datagram
+        per iteration, uvloop reads all pending datagrams.
+        """
+        self._transport = None
+        self._loop = None
+        self._paused = False
+        self._batch = []
+        self._batch_ts = None
+        super(AsyncUDPComm, self).__init__(addr, port, handler, core,
+            recv_budget=recv_budget, reuseport=reuseport,
+            send_queue_size=send_queue_size, rate_limit=rate_limit,
+            rate_burst=rate_burst, capture=capture,
+            rcvbuf=rcvbuf, sndbuf=sndbuf)
+        # transport uses recvfrom(), kernel drops are read from /proc
+        self._ancbufsize = 0
+
+    def _start(self):
+        """ Create datagram endpoint when the event loop is running """
+        self._io_loop.add_callback(self._create_endpoint)
+
+    async def _create_endpoint(self):
+        self._loop = asyncio.get_event_loop()
+        await self._loop.create_datagram_endpoint( \
+            lambda: _DatagramProtocol(self), sock=self._sock)
+
+    def close(self):
+        """ Stop listening and close the socket """
+        if self._transport:
+            self._transport.close()
+            self._transport = None
+        else:
+            self._sock.close()
+
+    def _connection_made(self, transport):
+        log.info('datagram endpoint ready: %s', str(transport))
+        self._transport = transport
+        self._flush_send_queue()
+
+    def _datagram_received(self, data, addr):
+        """ Collect datagram to the batch
+
+        Batch is processed after all datagrams of the current event
+        loop iteration are received or recv_budget is reached.
+        """
+        if not self._batch:
+            self._batch_ts = time.perf_counter()
+            self._loop.call_soon(self._process_pending)
+        self._batch.append((data, addr))
+        if len(self._batch) >= self._recv_budget:
+            self._stats.add('rx/budget_exhausted', 1)
+            self._process_pending()
+
+    def _process_pending(self):
+        """ Process collected batch of datagrams """
+        if not self._batch:
+            return
+        (batch, self._batch) = (self._batch, [])
+        self._stats.add('rx/wakeups', 1)
+        self._process_batch(batch, self._batch_ts)
+
+    def _error_received(self, exc):
+        log.warning('datagram endpoint error: %s', str(exc))
+        self._stats.add('rx/errors', 1)
+
+    def _pause_writing(self):
+        log.debug('transport buffer is full, pause sending')
+        self._paused = True
+        self._stats.add('tx/paused', 1)
+
+    def _resume_writing(self):
+        self._paused = False
+        self._flush_send_queue()
+
+    def _send(self, host, addr, sendstring, coalesce=None):
+        """ Send UDP datagramm to the host
+
+        Datagram is queued (see UDPComm._send()) if the transport is
+        not ready or it has asked to pause writing.
+
+        :param host: Host instance of controller
+        :param addr: host (addr, port) tuple
+        :param sendstring: string data to send
+        :param coalesce: optional key for replacing queued datagram
+
+        :returns: number of bytes sent or None if datagram was queued
+            or dropped
+        """
+        if isinstance(sendstring, str):
+            sendstring = sendstring.encode(encoding='UTF-8')
+        log.info('send(%s, "%s")', str(host), sendstring)
+        if self._transport is None or self._paused or self._send_queue:
+            self._enqueue(addr, sendstring, coalesce)
+            return None
+        self._transport.sendto(sendstring, addr)
+        return len(sendstring)
+
+    def _start_writing(self):
+        """ Queue is flushed by resume_writing() """
+        pass
+
+    def _flush_send_queue(self):
+        """ Send queued datagrams until the transport asks to pause """
+        while self._send_queue and self._transport and not self._paused:
+            (addr, data, coalesce) = self._send_queue[0]
+            self._forget(self._send_queue.popleft())
+            self._transport.sendto(data, addr)
+        self._stats.set('tx/queue/depth', len(self._send_queue))
+
+    def __str__(self):
+        return('AsyncUDPComm(' + str(self.addr) + ':' + str(self.port) + '), stats: ' + str(self._stats) + ', known hosts:' + str(self._hosts))
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+"""
+Benchmark ACK building: SDPPacker against AckWriter
+
+SDPPacker builds the ACK from SDP instances (one per received piece),
+encodes it to str and the sender encodes it to UTF-8. AckWriter writes
+the same bytes directly, register lines of the send queue are encoded
+once. Both outputs are compared before timing.
+
+Example:
+
+    bench/ackbench.py --number=20000
+"""
+
+import os
+import sys
+import json
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tornado.options import define, options, parse_command_line
+
+from sdp import SDP
+from sdppacker import SDPPacker
+from ackwriter import AckWriter
+
+SECRET = 'bench-secret'
+NONCE = '12345'
+
+CASES = {
+    'plain': (['17,1440871960'], []),
+    'queue': (['17,1440871960'], [('R%02dV' % i, 1000 + i) for i in range(10)] + \
+        [('SFW', [1, 0, 1, 0]), ('SFS', 1)]),
+    'multipart': (['%d,%d' % (i, 1440871960 + i) for i in range(10)], \
+        [('R%02dV' % i, 1000 + i) for i in range(5)]),
+}
+
+def packer_ack(ins, registers, secret_key, nonce):
+    """ ACK built by SDPPacker (UTF-8 encoded as UDPComm would do) """
+    packer = SDPPacker('abc123', secret_key=secret_key, nonce=nonce)
+    for inn in ins:
+        part = SDP()
+        part.add_keyvalue('in', inn)
+        packer.add_part(part)
+    for (reg, val) in registers:
+        packer.add_keyvalue(reg, val)
+    return [datagram.encode('UTF-8') for datagram in packer.encode()]
+
+if __name__ == '__main__':
+    define("number", default=10000, help="ACKs per case", type=int)
+    parse_command_line()
+
+    results = {}
+    writer = AckWriter('abc123')
+    for (name, (ins, registers)) in CASES.items():
+        lines = [AckWriter.register(reg, val) for (reg, val) in registers]
+        for (suffix, secret_key, nonce) in [('', None, None), ('_signed', SECRET, NONCE)]:
+            expected = packer_ack(ins, registers, secret_key, nonce)
+            if writer.write(ins, lines, secret_key, nonce) != expected:
+                raise AssertionError('ACKs differ for %s%s' % (name, suffix))
+            old = timeit.timeit(lambda: packer_ack(ins, registers, secret_key, nonce), \
+                number=options.number)
+            new = timeit.timeit(lambda: writer.write(ins, lines, secret_key, nonce), \
+                number=options.number)
+            results[name + suffix] = {
+                'size': sum([len(datagram) for datagram in expected]),
+                'packer_us': old / options.number * 1000000,
+                'writer_us': new / options.number * 1000000,
+                'speedup': old / new,
+            }
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,374 @@
+#!/usr/bin/python3
+
+"""
+SDP codec micro-benchmark suite
+
+Corpus is generated with a fixed seed and modeled on the simulator
+(test_controller.py SensorSimulator.read_sensors()): small status
+updates, full sensor readings, multipart datagrams as SDPQueue sends
+them, zlib/gzip/preset dictionary compressed and signed datagrams.
+Every case holds several different datagrams, one operation processes
+all of them once.
+
+For every case and operation the number of datagrams per second (best
+of --repeat runs) and allocations per datagram are reported:
+
+    blocks      memory blocks allocated and still alive when the result
+                is kept (sys.getallocatedblocks(), includes the result)
+    peak_bytes  peak traced memory during the operation (tracemalloc),
+                includes temporary allocations
+
+Operations missing from the benchmarked tree (e.g. binary format in
+older revisions) are reported as errors, not as failures of the run.
+
+With --compare the suite is run in a separate process for both git
+revisions (checked out into temporary git worktrees, HEAD working tree
+is used when --head is empty) and the results are shown side by side.
+
+Examples:
+
+    bench/sdpbench.py
+    bench/sdpbench.py --only=multipart --repeat=10
+    bench/sdpbench.py --compare=HEAD~5
+    bench/sdpbench.py --compare=v1.0 --head=v1.1
+"""
+
+import os
+import sys
+import gc
+import gzip
+import json
+import zlib
+import random
+import shutil
+import timeit
+import tempfile
+import tracemalloc
+import subprocess
+
+from tornado.options import define, options, parse_command_line
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+CONTROLLER_ID = '000000000001'
+SECRET = 'secret'
+NONCE = '12345'
+SEED = 1
+VARIANTS = 8
+MULTIPART_PIECES = 3
+TIMESTAMP = 1440871960
+
+def reading(rnd, seq):
+    """ Return one simulated sensor reading as (key, value) list
+
+    Same keys and value ranges as SensorSimulator.read_sensors()
+
+    :param rnd: random.Random instance
+    :param seq: reading number
+    """
+    xxx = seq % 4
+    total = 8254226432
+    available = rnd.randint(total // 4, total // 2)
+    data = [
+        ('id', CONTROLLER_ID),
+        ('psversion', '5.9.0'),
+        ('emx', ''),
+        ('CUV', rnd.randint(100000, 10000000)), ('CUS', xxx),
+        ('CSV', rnd.randint(10000, 1000000)), ('CSS', xxx),
+        ('CIV', rnd.randint(1000000, 100000000)), ('CIS', xxx),
+        ('MTV', total),
+        ('MAV', available),
+        ('MPV', round(100.0 * (total - available) / total, 1)),
+        ('MUV', total - available),
+        ('MFV', rnd.randint(100000000, available)),
+        ('MBV', rnd.randint(1000000, 500000000)),
+        ('MCV', rnd.randint(100000000, 2000000000)),
+        ('DRW', [rnd.randint(10000, 1000000), rnd.randint(10 ** 8, 10 ** 10), rnd.randint(1000, 100000)]),
+        ('DRS', 0),
+        ('DWW', [rnd.randint(10000, 1000000), rnd.randint(10 ** 8, 10 ** 10), rnd.randint(1000, 100000)]),
+        ('TTS', rnd.randint(0, 3)),
+    ]
+    if xxx == 1:
+        data += [('SFW', '?'), ('SRW', '?'), ('SWW', '?')]
+    else:
+        data += [
+            ('SFW', [rnd.randint(0, 1) for _ in range(4)]), ('SFS', 0),
+            ('SRW', [rnd.randint(0, 1) for _ in range(4)]), ('SRS', 1),
+            ('SWW', [rnd.randint(0, 300) for _ in range(4)]), ('SWS', 2),
+        ]
+    data.append(('in', '%d,%d' % (seq, TIMESTAMP + seq * 2)))
+    return data
+
+def small(rnd, seq):
+    """ Return short status update as (key, value) list """
+    return [('id', CONTROLLER_ID), ('in', '%d,%d' % (seq, TIMESTAMP + seq * 2)),
+            ('CUV', rnd.randint(100000, 10000000)), ('CUS', seq % 4),
+            ('TTS', rnd.randint(0, 3))]
+
+class Bench(object):
+    """ Benchmark cases for SDP modules of one tree """
+    def __init__(self):
+        from sdp import SDP
+        from sdpitem import SDPItem
+        self.SDP = SDP
+        self.SDPItem = SDPItem
+        rnd = random.Random(SEED)
+        self.small = [small(rnd, seq) for seq in range(VARIANTS)]
+        self.large = [reading(rnd, seq) for seq in range(VARIANTS)]
+        self.multipart = [[reading(rnd, seq * MULTIPART_PIECES + i) for i in range(MULTIPART_PIECES)]
+                          for seq in range(VARIANTS)]
+
+    def build(self, pairs, secret_key=None, nonce=None):
+        """ Build SDP from (key, value) list """
+        sdp = self.SDP(secret_key, nonce)
+        for (key, val) in pairs:
+            sdp.add_keyvalue(key, val)
+        return sdp
+
+    def build_multipart(self, pieces, secret_key=None, nonce=None):
+        """ Build multipart SDP as SDPQueue sends it """
+        parent = self.SDP(secret_key, nonce)
+        parent.add_keyvalue('id', CONTROLLER_ID)
+        for pairs in pieces:
+            parent.add_sdp_multipart(self.build(pairs))
+        return parent
+
+    def verify(self, datagram):
+        """ Decode signed datagram and check the signature """
+        sdp = self.SDP.decode(datagram, SECRET, NONCE)
+        if not sdp.check_signature():
+            raise AssertionError('invalid signature')
+        return sdp
+
+    def cases(self):
+        """ Return {case: {operation: callable}} """
+        SDP = self.SDP
+        SDPItem = self.SDPItem
+        texts = {
+            'small': [self.build(pairs).encode() for pairs in self.small],
+            'large': [self.build(pairs).encode() for pairs in self.large],
+            'multipart': [self.build_multipart(pieces).encode() for pieces in self.multipart],
+        }
+        cases = {}
+        for name in ['small', 'large']:
+            corpus = getattr(self, name)
+            datagrams = texts[name]
+            cases[name] = {
+                'encode': (len(corpus), lambda corpus=corpus: [self.build(pairs).encode() for pairs in corpus]),
+                'decode': (len(datagrams), lambda datagrams=datagrams: [SDP.decode(x) for x in datagrams]),
+                'decode_read': (len(datagrams), lambda datagrams=datagrams:
+                                [list(SDP.decode(x).get_data_list()) for x in datagrams]),
+                'item_decode': (len(datagrams), lambda datagrams=datagrams:
+                                [SDPItem.decode(x) for x in datagrams]),
+            }
+        datagrams = texts['multipart']
+        cases['multipart'] = {
+            'encode': (len(self.multipart), lambda: [self.build_multipart(pieces).encode()
+                                                     for pieces in self.multipart]),
+            'decode': (len(datagrams), lambda: [SDP.decode(x) for x in datagrams]),
+            'decode_read': (len(datagrams), lambda: [[list(piece.get_data_list())
+                                                      for piece in SDP.decode(x).gen_get()]
+                                                     for x in datagrams]),
+        }
+        for name in ['large', 'multipart']:
+            cases[name + '_compressed'] = self.compressed_cases(texts[name])
+        signed = {
+            'large': [self.build(pairs, SECRET, NONCE).encode() for pairs in self.large],
+            'multipart': [self.build_multipart(pieces, SECRET, NONCE).encode()
+                          for pieces in self.multipart],
+        }
+        cases['large_signed'] = {
+            'sign': (len(self.large), lambda: [self.build(pairs, SECRET, NONCE).encode()
+                                               for pairs in self.large]),
+            'verify': (len(signed['large']), lambda: [self.verify(x) for x in signed['large']]),
+        }
+        cases['multipart_signed'] = {
+            'sign': (len(self.multipart), lambda: [self.build_multipart(pieces, SECRET, NONCE).encode()
+                                                   for pieces in self.multipart]),
+            'verify': (len(signed['multipart']), lambda: [self.verify(x) for x in signed['multipart']]),
+        }
+        try:
+            binary = [self.build(pairs).encode_binary() for pairs in self.large]
+        except AttributeError:
+            binary = None
+
+        def binary_decode():
+            """ Decode binary datagrams """
+            if binary is None:
+                raise AttributeError('no binary format in this tree')
+            return [SDP.decode(x) for x in binary]
+
+        cases['large_binary'] = {
+            'encode': (len(self.large), lambda: [self.build(pairs).encode_binary() for pairs in self.large]),
+            'decode': (len(self.large), binary_decode),
+        }
+        return cases
+
+    def compressed_cases(self, datagrams):
+        """ Return compression operations for text datagrams """
+        SDP = self.SDP
+        encoded = [x.encode('UTF-8') for x in datagrams]
+        zlibs = [zlib.compress(x, zlib.Z_BEST_COMPRESSION) for x in encoded]
+        gzips = [gzip.compress(x) for x in encoded]
+        try:
+            import sdpzdict
+            zdicts = [sdpzdict.compress(x) for x in encoded]
+        except ImportError:
+            sdpzdict = None
+            zdicts = []
+
+        def zdict_decode():
+            """ Decompress and decode preset dictionary datagrams """
+            if not sdpzdict:
+                raise ImportError('no sdpzdict in this tree')
+            return [SDP.decode(sdpzdict.decompress(x, sdpzdict.get_dictid(x)).decode('UTF-8'))
+                    for x in zdicts]
+
+        return {
+            'zlib_decode': (len(zlibs), lambda: [SDP.decode(zlib.decompress(x).decode('UTF-8'))
+                                                 for x in zlibs]),
+            'gzip_decode': (len(gzips), lambda: [SDP.decode(gzip.decompress(x).decode('UTF-8'))
+                                                 for x in gzips]),
+            'zdict_decode': (len(encoded), zdict_decode),
+        }
+
+    def sizes(self):
+        """ Return average datagram size per corpus """
+        def avg(datagrams):
+            return sum([len(x) for x in datagrams]) // len(datagrams)
+        large = [self.build(pairs).encode().encode('UTF-8') for pairs in self.large]
+        multipart = [self.build_multipart(pieces).encode().encode('UTF-8') for pieces in self.multipart]
+        sizes = {
+            'small': avg([self.build(pairs).encode().encode('UTF-8') for pairs in self.small]),
+            'large': avg(large),
+            'large_zlib': avg([zlib.compress(x, zlib.Z_BEST_COMPRESSION) for x in large]),
+            'multipart': avg(multipart),
+            'multipart_zlib': avg([zlib.compress(x, zlib.Z_BEST_COMPRESSION) for x in multipart]),
+        }
+        return sizes
+
+def allocations(operation, count, number=20):
+    """ Return (blocks, peak_bytes) per datagram
+
+    :param operation: callable processing count datagrams
+    :param count: number of datagrams processed by one call
+    :param number: calls for block counting
+    """
+    gc.collect()
+    results = []
+    before = sys.getallocatedblocks()
+    for _ in range(number):
+        results.append(operation())
+    after = sys.getallocatedblocks()
+    del results
+    gc.collect()
+    tracemalloc.start()
+    try:
+        current = tracemalloc.get_traced_memory()[0]
+        operation()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return ((after - before) / number / count, (peak - current) // count)
+
+def run(only='', repeat=5, number=0):
+    """ Run benchmark cases of the tree found in sys.path
+
+    :param only: run only cases/operations containing this string
+    :param repeat: timing runs, best one is used
+    :param number: operation calls per timing run, 0 for automatic
+
+    :returns: results dict
+    """
+    bench = Bench()
+    results = {}
+    for (case, operations) in sorted(bench.cases().items()):
+        for (name, (count, operation)) in sorted(operations.items()):
+            if only and not only in case + '/' + name:
+                continue
+            try:
+                operation()
+            except Exception as ex:     # pylint: disable=broad-except
+                results.setdefault(case, {})[name] = {
+                    'error': '%s: %s' % (ex.__class__.__name__, ex)}
+                continue
+            timer = timeit.Timer(operation)
+            calls = number or timer.autorange()[0]
+            best = min(timer.repeat(repeat, calls))
+            (blocks, peak) = allocations(operation, count)
+            results.setdefault(case, {})[name] = {
+                'ops': int(calls * count / best),
+                'us': best / calls / count * 1000000,
+                'blocks': round(blocks, 1),
+                'peak_bytes': peak,
+            }
+    return {'sizes': bench.sizes(), 'results': results}
+
+def git(*args):
+    """ Run git in the repository and return its output """
+    return subprocess.check_output(['git', '-C', ROOT] + list(args)).decode().strip()
+
+def run_revision(rev):
+    """ Run the suite in a subprocess for git revision
+
+    :param rev: git revision or '' for the working tree
+
+    :returns: results dict
+    """
+    path = None
+    tree = ROOT
+    if rev:
+        path = tempfile.mkdtemp(prefix='sdpbench-')
+        git('worktree', 'add', '--detach', path, rev)
+        tree = path
+    try:
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--tree=' + tree,
+            '--only=' + options.only, '--repeat=%d' % options.repeat,
+            '--number=%d' % options.number, '--logging=none'])
+    finally:
+        if path:
+            git('worktree', 'remove', '--force', path)
+            shutil.rmtree(path, ignore_errors=True)
+    results = json.loads(output.decode())
+    results['revision'] = rev or 'working tree'
+    return results
+
+def compare(base, head):
+    """ Return side by side results of two runs """
+    results = {}
+    for (case, operations) in sorted(head['results'].items()):
+        for (name, new) in sorted(operations.items()):
+            old = base['results'].get(case, {}).get(name, {'error': 'missing'})
+            if 'error' in old or 'error' in new:
+                entry = {'base': old.get('error', old.get('ops')),
+                         'head': new.get('error', new.get('ops'))}
+            else:
+                entry = {
+                    'base_ops': old['ops'],
+                    'head_ops': new['ops'],
+                    'speedup': round(new['ops'] / old['ops'], 2),
+                    'base_blocks': old['blocks'],
+                    'head_blocks': new['blocks'],
+                    'base_peak_bytes': old['peak_bytes'],
+                    'head_peak_bytes': new['peak_bytes'],
+                }
+            results.setdefault(case, {})[name] = entry
+    return {'base': base['revision'], 'head': head['revision'], 'results': results}
+
+if __name__ == '__main__':
+    define("only", default='', help="run only cases/operations containing this string")
+    define("repeat", default=5, help="timing runs, best one is reported", type=int)
+    define("number", default=0, help="operation calls per timing run, 0 for automatic", type=int)
+    define("compare", default='', help="git revision to compare with")
+    define("head", default='', help="git revision to compare, working tree if empty")
+    define("tree", default=ROOT, help="source tree to benchmark")
+    parse_command_line()
+
+    if options.compare:
+        print(json.dumps(compare(run_revision(options.compare), run_revision(options.head)), indent=4))
+    else:
+        sys.path.insert(0, options.tree)
+        results = run(options.only, options.repeat, options.number)
+        results['python'] = sys.version.split()[0]
+        print(json.dumps(results, indent=4))
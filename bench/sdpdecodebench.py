@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+
+"""
+Benchmark SDP.decode() against the reference (line by line) decoder
+
+The reference decoder is the original UnsecureSDP.decode()
+implementation which splits every line with SDPItem._decode_line(),
+checks duplicates with get_data() and stores values with
+add_keyvalue(). Signed datagrams are compared with the line by line
+SignedSDP._decode_lines(). Before timing, both decoders are run over a
+set of valid, multipart and randomly mutated datagrams and the results
+(decoded data, signature or exception) must be identical. Batch decoder
+SDP.decode_many() is verified against SDP.decode() and timed against a
+loop of SDP.decode() calls. Every successfully decoded datagram must
+survive the binary format round trip (see binarysdp) with the same
+data, binary datagram size and decode time are reported as well.
+
+Example:
+
+    bench/sdpdecodebench.py --number=20000 --fuzz=20000
+"""
+
+import os
+import sys
+import json
+import random
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tornado.options import define, options, parse_command_line
+
+from sdp import SDP
+from sdpitem import SDPItem
+from signedsdp import SignedSDP
+from unsecuresdp import UnsecureSDP
+from sdpexception import SDPException, SDPDecodeException
+
+DATAGRAMS = {
+    'small': 'id:abc123\nin:1,1440871960\nAAS:1\nABV:2\n',
+    'typical': (
+        'id:abc123\nin:17,1440871960\n'
+        'AAS:1\nABV:2\nACV:3.5\nADW:3 4 null 5\nAEW:5 6 75\n'
+        'BAS:0\nBBS:3\nBCV:abc\nip:10.0.0.10\nuptime:12345\n'
+        'ALF:4000D3349FEBBEAE\nTOV:4000D3349FEBBEAE\nAIS:?\niq:?\n'
+        'D1W:1 0 1 0 1 0 1 0\nD2W:0 0 0 0 0 0 0 1\nD3V:12\nD4V:-5\n'
+    ),
+    'multipart': ''.join(['id:abc123\n'] + [
+        'in:%d,%d\nAAS:%d\nABV:%d\nACW:1 2 3\n' % (i, 1440871960 + i, i % 4, i)
+        for i in range(1, 11)]),
+}
+
+def reference_decode(datagram, sdp=None):
+    """ Original UnsecureSDP.decode() """
+    controllerid = None
+    multipart_parent = None
+    if not sdp:
+        sdp = UnsecureSDP()
+    for line in datagram.splitlines():
+        if line == '':
+            continue
+        (key, val) = SDPItem._decode_line(line)
+        if key == 'id':
+            if controllerid:
+                raise SDPDecodeException('ONLY ONE "id" is allowed')
+            controllerid = val
+        if sdp.get_data(key):
+            if key == "in":
+                if not multipart_parent:
+                    if not controllerid:
+                        raise SDPDecodeException('in multipart SDP the "id" MUST BE before first "in"')
+                    multipart_parent = sdp.__class__()
+                    multipart_parent.add_keyvalue("id", controllerid)
+                multipart_parent.add_sdp_multipart(sdp)
+                sdp = sdp.__class__()
+            else:
+                raise SDPDecodeException('multiple "%s" fields' % key)
+        try:
+            sdp.add_keyvalue(key, val)
+        except SDPException as ex:
+            raise SDPDecodeException(ex)
+    if not controllerid:
+        raise SDPDecodeException('"id:" _MUST_ exists in datagram')
+    if multipart_parent:
+        multipart_parent.add_sdp_multipart(sdp)
+        return multipart_parent
+    return sdp
+
+SECRET = 'bench-secret'
+NONCE = '12345'
+
+def sign(datagram):
+    """ Return signed datagram """
+    sdp = SDP.decode(datagram)
+    sdp.set_secret_key(SECRET)
+    sdp.set_nonce(NONCE)
+    return sdp.encode()
+
+def signed_result(decoder, datagram):
+    """ Return comparable result of the signed decoder
+
+    Line by line decoder checks all line formats before decoding, so
+    with several errors in the datagram the first raised SDPException
+    may be a different one.
+    """
+    try:
+        sdp = decoder(datagram, SECRET, NONCE)
+    except SDPException:
+        return ('error', 'SDPException')
+    except Exception as ex:
+        return ('error', ex.__class__.__name__)
+    return ('ok', str(sdp.data), sdp.is_signed(), sdp._csum, sdp._sha256,
+            sdp.check_signature())
+
+def result(decoder, datagram):
+    """ Return comparable result of the decoder """
+    try:
+        sdp = decoder(datagram, SignedSDP())
+    except IndexError:
+        # reference decoder fails with empty key
+        return ('error', 'SDPDecodeException')
+    except Exception as ex:
+        return ('error', ex.__class__.__name__)
+    return ('ok', sdp.__class__.__name__, str(sdp.data),
+            [str(piece.data) for piece in sdp._multipart_pieces])
+
+def mutate(rnd, datagram):
+    """ Return randomly changed datagram """
+    lines = datagram.splitlines()
+    for _ in range(rnd.randint(1, 3)):
+        op = rnd.randint(0, 5)
+        i = rnd.randrange(len(lines))
+        if op == 0:
+            lines.insert(i, lines[rnd.randrange(len(lines))])
+        elif op == 1:
+            del lines[i]
+            if not lines:
+                lines = ['']
+        elif op == 2:
+            (key, _sep, _val) = lines[i].partition(':')
+            lines[i] = key + ':' + rnd.choice(['', '?', '0', '1', '4', 'null', 'x', '1 2', '1 x', '1:2', '1,2'])
+        elif op == 3:
+            (_key, _sep, val) = lines[i].partition(':')
+            lines[i] = rnd.choice(['', 'id', 'in', 'AAS', 'ABV', 'ABW', 'ABF', 'TOV', 'sha256', 'x']) + ':' + val
+        elif op == 4:
+            lines[i] = lines[i].replace(':', '', 1)
+        else:
+            lines.insert(i, '')
+    return rnd.choice(['\n', '\n', '\n', '\r\n', '\x0b']).join(lines) + \
+        rnd.choice(['\n', '\n', '', '\n\n', '\r\n'])
+
+VALUE_TOKENS = ['0', '1', '-1', '12', '-0', '01', '+1', '1.0', '', 'null',
+                'NULL', '1_0', '\u0661', 'x', '123456789012345678901234567890']
+
+def reference_values(val):
+    """ Original List of Values validation and parsing """
+    if val.count(' ') < 1:
+        raise SDPException('More than one list item expected')
+    lst = [SDPItem._list_str_to_value(x) for x in val.split(' ')]
+    if val != ' '.join([SDPItem._list_value_to_str(x) for x in lst]):
+        raise SDPException('Only integers allowed in List of Values')
+    return lst
+
+def verify_values(rnd, count):
+    """ Compare List of Values validation, raise AssertionError on
+    first difference """
+    for _ in range(count):
+        val = ' '.join([rnd.choice(VALUE_TOKENS) for _ in range(rnd.randint(1, 4))])
+        try:
+            expected = reference_values(val)
+        except SDPException:
+            expected = 'error'
+        sdp = SDP()
+        try:
+            sdp.add_keyvalue('AAW', val)
+            got = sdp.get_data('AAW')
+        except SDPException:
+            got = 'error'
+        if expected != got:
+            raise AssertionError('values differ for %r: %s %s' % (val, expected, got))
+    return count
+
+def verify_many(datagrams, secret_key=None, nonce=None):
+    """ Compare batch decoder with SDP.decode(), raise AssertionError
+    on first difference """
+    (sdps, errors) = SDP.decode_many(datagrams, secret_key, nonce)
+    errors = dict(errors)
+    for (i, datagram) in enumerate(datagrams):
+        try:
+            sdp = SDP.decode(datagram, secret_key, nonce)
+            expected = ('ok', str(sdp.data), sdp.is_signed())
+        except SDPException as ex:
+            expected = ('error', ex.__class__.__name__, str(ex))
+        if i in errors:
+            got = ('error', errors[i].__class__.__name__, str(errors[i]))
+        else:
+            got = ('ok', str(sdps[i].data), sdps[i].is_signed())
+        if expected != got:
+            raise AssertionError('batch decoder differs for %r:\n%s\n%s' % (datagram, expected, got))
+    return len(datagrams)
+
+def verify_binary(datagrams):
+    """ Check binary format round trip, raise AssertionError on
+    first difference """
+    count = 0
+    for datagram in datagrams:
+        try:
+            sdp = SDP.decode(datagram)
+        except SDPException:
+            continue
+        binary = sdp.encode_binary()
+        if SDP.decode(binary).encode() != sdp.encode():
+            raise AssertionError('binary round trip differs for %r' % datagram)
+        count += 1
+    return count
+
+def verify(fuzz):
+    """ Compare decoders, raise AssertionError on first difference """
+    rnd = random.Random(1)
+    datagrams = list(DATAGRAMS.values())
+    for _ in range(fuzz):
+        datagrams.append(mutate(rnd, rnd.choice(list(DATAGRAMS.values()))))
+    for datagram in datagrams:
+        expected = result(reference_decode, datagram)
+        got = result(UnsecureSDP.decode, datagram)
+        if expected != got:
+            raise AssertionError('decoders differ for %r:\n%s\n%s' % (datagram, expected, got))
+    signed = [sign(datagram) for datagram in DATAGRAMS.values()]
+    for _ in range(fuzz):
+        datagrams.append(mutate(rnd, rnd.choice(signed)))
+    for datagram in signed + datagrams:
+        expected = signed_result(SignedSDP._decode_lines, datagram)
+        for got in [signed_result(SignedSDP.decode, datagram),
+                    signed_result(SignedSDP.decode, datagram.encode('UTF-8'))]:
+            if expected != got:
+                raise AssertionError('signed decoders differ for %r:\n%s\n%s' % (datagram, expected, got))
+    verify_many(datagrams)
+    verify_binary(datagrams)
+    verify_many(signed + datagrams, SECRET, NONCE)
+    return len(datagrams) + len(signed) + verify_values(rnd, fuzz)
+
+if __name__ == '__main__':
+    define("number", default=10000, help="decodes per datagram type", type=int)
+    define("fuzz", default=10000, help="random datagrams for verification", type=int)
+    parse_command_line()
+
+    results = {'verified': verify(options.fuzz)}
+    for (name, datagram) in DATAGRAMS.items():
+        old = timeit.timeit(lambda: reference_decode(datagram, SignedSDP()), number=options.number)
+        new = timeit.timeit(lambda: UnsecureSDP.decode(datagram, SignedSDP()), number=options.number)
+        full = timeit.timeit(lambda: SDP.decode(datagram), number=options.number)
+        results[name] = {
+            'reference_us': old / options.number * 1000000,
+            'decode_us': new / options.number * 1000000,
+            'sdp_decode_us': full / options.number * 1000000,
+            'speedup': old / new,
+        }
+        binary = SDP.decode(datagram).encode_binary()
+        results[name]['size'] = len(datagram)
+        results[name]['binary_size'] = len(binary)
+        results[name]['binary_decode_us'] = timeit.timeit(
+            lambda: SDP.decode(binary), number=options.number) / options.number * 1000000
+        batch = [datagram] * 100
+        old = timeit.timeit(lambda: [SDP.decode(x) for x in batch], number=options.number // 100)
+        new = timeit.timeit(lambda: SDP.decode_many(batch), number=options.number // 100)
+        results[name + '_batch'] = {
+            'decode_loop_us': old / (options.number // 100) / 100 * 1000000,
+            'decode_many_us': new / (options.number // 100) / 100 * 1000000,
+            'speedup': old / new,
+        }
+        signed = sign(datagram)
+        old = timeit.timeit(lambda: SignedSDP._decode_lines(signed, SECRET, NONCE), number=options.number)
+        new = timeit.timeit(lambda: SDP.decode(signed, SECRET, NONCE), number=options.number)
+        results[name + '_signed'] = {
+            'decode_lines_us': old / options.number * 1000000,
+            'sdp_decode_us': new / options.number * 1000000,
+            'speedup': old / new,
+        }
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+"""
+Compare UDP ingest engines: UDPComm (tornado IOLoop fd handler) and
+AsyncUDPComm (asyncio datagram endpoint, optionally on uvloop)
+
+Sender processes blast datagrams to the listener as fast as possible,
+the listener counts (and optionally decodes) them. Achieved receive
+rate and lost datagrams are reported for every engine. Kernel drops
+reported by SO_RXQ_OVFL lag behind (drops after the last received
+datagram are not counted), "lost" is the exact number.
+
+Example:
+
+    bench/udpbench.py --count=200000 --senders=2 --decode
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from tornado.options import define, options, parse_command_line
+import tornado.ioloop
+
+from hosts import Hosts
+from sdp import SDP
+from udpcomm import UDPComm
+from asyncudpcomm import AsyncUDPComm
+
+DATAGRAM = (
+    'id:000000000001\n'
+    'CUV:1234\nCUS:0\nMTV:1000000\nMAV:500000\nMPV:50.0\n'
+    'SRW:1 0 1 0\nSRS:1\nSFW:1 0 1 0\nSFS:0\n'
+    'in:%d,1450000000\n'
+)
+
+class BenchCore(object):
+    """ Minimal Core for UDPComm """
+    def __init__(self):
+        self._hosts = Hosts()
+
+    def hosts(self):
+        return self._hosts
+
+def sender(addr, count, start):
+    """ Send count datagrams to addr when start event is set """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    datagrams = [(DATAGRAM % i).encode() for i in range(100)]
+    start.wait()
+    for i in range(count):
+        while True:
+            try:
+                sock.sendto(datagrams[i % 100], addr)
+                break
+            except BlockingIOError:
+                time.sleep(0)
+    sock.close()
+
+def run(engine_class, count, senders, decode, recv_budget, rcvbuf):
+    """ Run one engine benchmark
+
+    :returns: result dict
+    """
+    io_loop = tornado.ioloop.IOLoop.current()
+    received = [0, None, None]
+
+    def handler(host, data):
+        if decode:
+            SDP.decode(data)
+        now = time.perf_counter()
+        if received[1] is None:
+            received[1] = now
+        received[2] = now
+        received[0] += 1
+
+    udpcomm = engine_class('127.0.0.1', 0, handler, BenchCore(), \
+        recv_budget=recv_budget, rcvbuf=rcvbuf)
+    addr = udpcomm._sock.getsockname()
+    start = multiprocessing.Event()
+    procs = [multiprocessing.Process(target=sender, \
+        args=(addr, count // senders, start)) for i in range(senders)]
+    for proc in procs:
+        proc.start()
+
+    async def wait():
+        await asyncio.sleep(0.1)
+        start.set()
+        last = -1
+        while received[0] != last or any(proc.is_alive() for proc in procs):
+            last = received[0]
+            await asyncio.sleep(0.5)
+
+    io_loop.run_sync(wait)
+    for proc in procs:
+        proc.join()
+    stats = udpcomm.get_stats()
+    udpcomm.close()
+    elapsed = (received[2] or 0) - (received[1] or 0)
+    return {
+        'engine': engine_class.__name__,
+        'sent': count // senders * senders,
+        'received': received[0],
+        'lost': count // senders * senders - received[0],
+        'elapsed': elapsed,
+        'rate': received[0] / elapsed if elapsed else 0,
+        'kernel_drops': stats['socket'].get('drops', None),
+        'wakeups': stats['rx'].get('wakeups', 0),
+    }
+
+if __name__ == '__main__':
+    define("count", default=100000, help="datagrams to send", type=int)
+    define("senders", default=2, help="number of sender processes", type=int)
+    define("decode", default=False, help="decode datagrams with SDP.decode", type=bool)
+    define("recv_budget", default=64, help="max datagrams per batch", type=int)
+    define("rcvbuf", default=4194304, help="socket receive buffer size", type=int)
+    define("engine", default="all", help="tornado, asyncio or all", type=str)
+    define("uvloop", default=False, help="run asyncio engine on uvloop", type=bool)
+    parse_command_line()
+
+    if options.uvloop:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+    engines = []
+    if options.engine in ['tornado', 'all']:
+        engines.append(UDPComm)
+    if options.engine in ['asyncio', 'all']:
+        engines.append(AsyncUDPComm)
+    results = [run(engine, options.count, options.senders, options.decode, \
+                   options.recv_budget, options.rcvbuf) for engine in engines]
+    print(json.dumps(results, indent=4))
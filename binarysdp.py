@@ -0,0 +1,483 @@
+""" Compact binary SDP wire format
+
+Binary datagram carries the same data model as the text SDP datagram
+in TLV (type, key, value) records:
+
+    MAGIC VERSION record* [SIGNATURE hmac]
+
+Every record starts with a type byte. Status, Value and List of Values
+records carry the key without the "S", "V" or "W" suffix (it is implied
+by the type), other records carry the full key. Key is prefixed with
+its length (one byte), strings with their length (varint), all strings
+are UTF-8 encoded. Integers are LEB128 varints, signed integers are
+zigzag encoded. Values which do not have a compact form (e.g. "V:abc")
+are carried as strings.
+
+MAGIC byte (0xb5) can not start a text (UTF-8), gzip or zlib datagram,
+so the receiver can detect the format from the first byte.
+
+Signature is calculated the same way as for the text datagram, but
+over the binary datagram up to the SIGNATURE record. HMAC itself is
+carried as raw 32 bytes.
+"""
+import re
+import base64
+
+from sdpitem import STATUS, VALUE, FLOAT, DATA, QUERY, WireValues, \
+    slot_tag, _encode_rank
+from unsecuresdp import IN_RE
+from sdpexception import SDPException, SDPDecodeException
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'MAGIC', 'VERSION',
+    'is_binary', 'encode', 'signature', 'decode', 'peek_id',
+]
+
+MAGIC = 0xb5
+VERSION = 1
+
+# record types
+ID = 0x01
+IN_SEQ = 0x02       # seq
+IN_SEQ_TS = 0x03    # seq, timestamp
+IN_STR = 0x04
+STATUS_0 = 0x10     # status value is in the type (0x10 .. 0x13)
+VALUE_INT = 0x20
+VALUE_STR = 0x21
+LIST = 0x30
+LIST_STR = 0x31
+FLOAT_HEX = 0x40    # 8 bytes
+FLOAT_STR = 0x41
+DATA_STR = 0x50
+QUERY_KEY = 0x60
+SIGNATURE = 0x7f    # 32 bytes
+
+HMAC_SIZE = 32
+
+# max varint length (64 bit values)
+VARINT_MAX_LEN = 10
+
+INT_RE = re.compile(r'0|-?[1-9][0-9]*')
+IN_INT_RE = re.compile(r'0|[1-9][0-9]*')
+FLOAT_HEX_RE = re.compile(r'[0-9A-F]{16}')
+
+# characters which can not be in the text datagram keys or values
+# (colon and str.splitlines() line boundaries)
+FORBIDDEN = ':\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+def is_binary(datagram):
+    """ Check if datagram is in binary format
+
+    :param datagram: datagram (str or bytes-like)
+
+    :returns: True if datagram starts with the MAGIC byte
+    """
+    return not isinstance(datagram, str) and len(datagram) > 1 and \
+        datagram[0] == MAGIC
+
+def _varint(val):
+    """ Return LEB128 encoded unsigned integer """
+    out = bytearray()
+    while val > 0x7f:
+        out.append((val & 0x7f) | 0x80)
+        val >>= 7
+    out.append(val)
+    return bytes(out)
+
+def _zigzag(val):
+    """ Map signed integer to unsigned one """
+    return val * 2 if val >= 0 else -val * 2 - 1
+
+def _fits(val):
+    """ Check if signed integer fits to the 64 bit zigzag varint """
+    return -(1 << 63) <= val < (1 << 63)
+
+def _key(key):
+    """ Return length prefixed key """
+    key = key.encode('UTF-8')
+    if len(key) > 0xff:
+        raise SDPException('key too long for binary SDP: %s' % key)
+    return bytes([len(key)]) + key
+
+def _pack_string(val):
+    """ Return length prefixed string """
+    val = val.encode('UTF-8')
+    return _varint(len(val)) + val
+
+def _encode_in(inn):
+    """ Return "in" record """
+    (seq, comma, ts) = inn.partition(',')
+    if IN_INT_RE.fullmatch(seq) and int(seq) < (1 << 64):
+        if not comma:
+            return bytes([IN_SEQ]) + _varint(int(seq))
+        if IN_INT_RE.fullmatch(ts) and int(ts) < (1 << 64):
+            return bytes([IN_SEQ_TS]) + _varint(int(seq)) + _varint(int(ts))
+    return bytes([IN_STR]) + _pack_string(inn)
+
+def _encode_value(name, val):
+    """ Return Value or List of Values record """
+    if isinstance(val, WireValues):
+        val = val.parse()
+    if isinstance(val, list):
+        if all(x is None or _fits(x) for x in val):
+            return bytes([LIST]) + _key(name) + _varint(len(val)) + \
+                b''.join([b'\x00' if x is None else _varint(_zigzag(x) + 1)
+                          for x in val])
+        return bytes([LIST_STR]) + _key(name) + _pack_string(
+            ' '.join(['null' if x is None else str(x) for x in val]))
+    if type(val) is int and _fits(val):
+        return bytes([VALUE_INT]) + _key(name) + _varint(_zigzag(val))
+    val = str(val)
+    if INT_RE.fullmatch(val) and _fits(int(val)):
+        return bytes([VALUE_INT]) + _key(name) + _varint(_zigzag(int(val)))
+    return bytes([VALUE_STR]) + _key(name) + _pack_string(val)
+
+def _encode_data(sdp):
+    """ Return records of one SDP piece (without "id") """
+    records = []
+    if sdp._in:
+        records.append(_encode_in(sdp._in))
+    for (slot, val) in sorted(sdp._table.items(), key=_encode_rank):
+        tag = slot_tag(slot)
+        if tag == QUERY:
+            records.append(bytes([QUERY_KEY]) + _key(slot[1:]))
+        elif tag == STATUS:
+            records.append(bytes([STATUS_0 + val]) + _key(slot[:-1]))
+        elif tag == VALUE:
+            records.append(_encode_value(slot[:-1], val))
+        elif tag == FLOAT:
+            if FLOAT_HEX_RE.fullmatch(val):
+                records.append(bytes([FLOAT_HEX]) + _key(slot) + \
+                    bytes.fromhex(val))
+            else:
+                records.append(bytes([FLOAT_STR]) + _key(slot) + _pack_string(val))
+        else:
+            records.append(bytes([DATA_STR]) + _key(slot) + _pack_string(str(val)))
+    return b''.join(records)
+
+def encode(sdp, controllerid=None):
+    """ Encodes SDP packet to binary datagram (without signature)
+
+    :param sdp: UnsecureSDP instance
+    :param controllerid: Optional paramater for id:<val> Data (str)
+
+    :returns: binary datagram (bytes)
+    """
+    if controllerid:
+        sdp.add_keyvalue('id', controllerid)
+    if not sdp._id:
+        log.error('id missing, cant encode')
+        raise SDPException("id missing")
+    datagram = bytes([MAGIC, VERSION, ID]) + _pack_string(str(sdp._id)) + \
+        _encode_data(sdp)
+    for piece in sdp._multipart_pieces:
+        datagram += _encode_data(piece)
+    return datagram
+
+def signature(sha256):
+    """ Return SIGNATURE record
+
+    :param sha256: BASE64 encoded HMAC
+
+    :returns: SIGNATURE record (bytes)
+    """
+    return bytes([SIGNATURE]) + base64.b64decode(sha256)
+
+def _truncated():
+    """ Raise error for truncated datagram """
+    raise SDPDecodeException('truncated binary datagram')
+
+def _text(raw):
+    """ Return string of UTF-8 encoded bytes, check for characters
+    which are not allowed in text datagram """
+    try:
+        val = str(raw, 'UTF-8')
+    except UnicodeDecodeError as ex:
+        raise SDPDecodeException('binary datagram string is not UTF-8: %s' % str(ex))
+    for char in FORBIDDEN:
+        if char in val:
+            raise SDPDecodeException('illegal character in binary datagram: %r' % val)
+    return val
+
+def _varint_tail(data, pos, val):
+    """ Read rest of the multi-byte varint
+
+    :param data: datagram (bytes)
+    :param pos: position after the first byte
+    :param val: first byte
+
+    :returns: (value, position after the varint) tuple
+    """
+    val &= 0x7f
+    shift = 7
+    while True:
+        if pos >= len(data):
+            _truncated()
+        byte = data[pos]
+        pos += 1
+        val |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return (val, pos)
+        shift += 7
+        if shift >= 7 * VARINT_MAX_LEN:
+            raise SDPDecodeException('too long varint in binary datagram')
+
+def _string(data, pos):
+    """ Read length prefixed string
+
+    :returns: (string, position after the string) tuple
+    """
+    if pos >= len(data):
+        _truncated()
+    size = data[pos]
+    pos += 1
+    if size & 0x80:
+        (size, pos) = _varint_tail(data, pos, size)
+    end = pos + size
+    if end > len(data):
+        _truncated()
+    return (_text(data[pos:end]), end)
+
+_RECORD_TAGS = {
+    VALUE_INT: VALUE, VALUE_STR: VALUE, LIST: VALUE, LIST_STR: VALUE,
+    FLOAT_HEX: FLOAT, FLOAT_STR: FLOAT, DATA_STR: DATA, QUERY_KEY: QUERY,
+}
+for _status in range(4):
+    _RECORD_TAGS[STATUS_0 + _status] = STATUS
+
+# max number of cached record headers
+SLOT_CACHE_SIZE = 10000
+
+# record header (type, key length, key) -> key table slot
+_slots = {}
+
+def _slot(head):
+    """ Return key table slot for the record header
+
+    Key is validated and the slot is cached, keys are the same in
+    every datagram of the controller.
+
+    :param head: record header (type, key length, key)
+
+    :returns: key table slot
+    """
+    rtype = head[0]
+    tag = _RECORD_TAGS.get(rtype, None)
+    if tag is None:
+        raise SDPDecodeException('unknown binary record type: 0x%02x' % rtype)
+    if len(head) != head[1] + 2:
+        _truncated()
+    key = _text(head[2:])
+    if tag == STATUS:
+        key += 'S'
+    elif rtype == LIST or rtype == LIST_STR:
+        key += 'W'
+    elif tag == VALUE:
+        key += 'V'
+    _check_key(key, tag)
+    if tag == QUERY:
+        slot = ':' + key
+    elif tag == VALUE:
+        slot = key[:-1] + 'W'
+    else:
+        slot = key
+    if len(_slots) >= SLOT_CACHE_SIZE:
+        del _slots[next(iter(_slots))]
+    _slots[head] = slot
+    return slot
+
+def _check_key(key, tag):
+    """ Check if full key is of the record type
+
+    :param key: full key
+    :param tag: type tag of the record
+    """
+    if key == '' or key == 'id' or key == 'in':
+        raise SDPDecodeException('illegal key in binary datagram: "%s"' % key)
+    if tag == QUERY:
+        return
+    last = key[-1]
+    if last == 'S':
+        key_tag = STATUS
+    elif last == 'F' or key == 'TOV':
+        key_tag = FLOAT
+    elif last == 'V' or last == 'W':
+        key_tag = VALUE
+    else:
+        key_tag = DATA
+    if key_tag != tag:
+        raise SDPDecodeException('key "%s" does not match the binary record type' % key)
+
+def _read_in(data, pos, rtype):
+    """ Read "in" record value
+
+    :returns: ("in" value, position after the record) tuple
+    """
+    if rtype == IN_STR:
+        (val, pos) = _string(data, pos)
+        if not IN_RE.match(val):
+            raise SDPDecodeException(SDPException('Illegal "in" format: %s' % val))
+        return (val, pos)
+    if pos >= len(data):
+        _truncated()
+    seq = data[pos]
+    pos += 1
+    if seq & 0x80:
+        (seq, pos) = _varint_tail(data, pos, seq)
+    if rtype == IN_SEQ:
+        return (str(seq), pos)
+    if pos >= len(data):
+        _truncated()
+    ts = data[pos]
+    pos += 1
+    if ts & 0x80:
+        (ts, pos) = _varint_tail(data, pos, ts)
+    return ('%d,%d' % (seq, ts), pos)
+
+def decode(data, sdp):    # pylint: disable=too-many-branches,too-many-statements
+    """ Decodes binary SDP datagram to packet
+
+    Multipart pieces are created the same way as with the text
+    datagram: every "in" record after the first one starts a new
+    piece.
+
+    :param data: binary datagram (bytes-like)
+    :param sdp: empty SDP instance for the result
+
+    :returns: (sdp, signed, hmac) tuple, signed is the signed part
+        of the datagram and hmac is BASE64 encoded HMAC (or None if
+        datagram is not signed)
+    """
+    data = bytes(data)
+    if len(data) < 2 or data[0] != MAGIC:
+        raise SDPDecodeException('not a binary datagram')
+    if data[1] != VERSION:
+        raise SDPDecodeException('unknown binary datagram version: %d' % data[1])
+    end = len(data)
+    pos = 2
+    controllerid = None
+    multipart_parent = None
+    sha256 = None
+    signed = data
+    table = sdp._table
+    slots = _slots
+    while pos < end:
+        rtype = data[pos]
+        if rtype < STATUS_0 or rtype == SIGNATURE:
+            pos += 1
+            if rtype == ID:
+                if controllerid:
+                    raise SDPDecodeException('ONLY ONE "id" is allowed')
+                (controllerid, pos) = _string(data, pos)
+                if controllerid == '':
+                    raise SDPDecodeException('"id:" _MUST_ exists in datagram')
+                sdp._id = controllerid
+            elif rtype == IN_SEQ or rtype == IN_SEQ_TS or rtype == IN_STR:
+                (inn, pos) = _read_in(data, pos, rtype)
+                if sdp._in:
+                    if not multipart_parent:
+                        if not controllerid:
+                            raise SDPDecodeException('in multipart SDP the "id" MUST BE before first "in"')
+                        multipart_parent = sdp.__class__()
+                        multipart_parent.add_keyvalue("id", controllerid)
+                    multipart_parent.add_sdp_multipart(sdp)
+                    sdp = sdp.__class__()
+                    table = sdp._table
+                sdp._in = inn
+            elif rtype == SIGNATURE:
+                if pos + HMAC_SIZE != end:
+                    if pos + HMAC_SIZE > end:
+                        _truncated()
+                    raise SDPDecodeException('no data is allowed after signature')
+                signed = data[:pos - 1]
+                sha256 = base64.b64encode(data[pos:]).decode()
+                break
+            else:
+                raise SDPDecodeException('unknown binary record type: 0x%02x' % rtype)
+            continue
+
+        if pos + 1 >= end:
+            _truncated()
+        head_end = pos + 2 + data[pos + 1]
+        head = data[pos:head_end]
+        slot = slots.get(head, None)
+        if slot is None:
+            slot = _slot(head)
+        pos = head_end
+        if slot in table:
+            raise SDPDecodeException('multiple "%s" fields' % slot)
+
+        if rtype <= STATUS_0 + 3:
+            table[slot] = rtype - STATUS_0
+        elif rtype == VALUE_INT or rtype == LIST:
+            if pos >= end:
+                _truncated()
+            val = data[pos]
+            pos += 1
+            if val & 0x80:
+                (val, pos) = _varint_tail(data, pos, val)
+            if rtype == VALUE_INT:
+                table[slot] = str(val >> 1 if not val & 1 else -((val + 1) >> 1))
+                continue
+            if val < 2:
+                raise SDPDecodeException('More than one list item expected: ' + slot)
+            lst = []
+            for _ in range(val):
+                if pos >= end:
+                    _truncated()
+                item = data[pos]
+                pos += 1
+                if item & 0x80:
+                    (item, pos) = _varint_tail(data, pos, item)
+                if item:
+                    item -= 1
+                    lst.append(item >> 1 if not item & 1 else -((item + 1) >> 1))
+                else:
+                    lst.append(None)
+            table[slot] = lst
+        elif rtype == FLOAT_HEX:
+            if pos + 8 > end:
+                _truncated()
+            table[slot] = data[pos:pos + 8].hex().upper()
+            pos += 8
+        elif rtype == QUERY_KEY:
+            table[slot] = '?'
+        else:
+            (val, pos) = _string(data, pos)
+            try:
+                if rtype == DATA_STR:
+                    sdp._add_keyvalue_string(slot, val)
+                elif rtype == LIST_STR:
+                    sdp._add_keyvalue_values(slot, val)
+                elif rtype == FLOAT_STR:
+                    sdp._add_keyvalue_floathex(slot, val)
+                else:
+                    table[slot] = val
+            except SDPException as ex:
+                raise SDPDecodeException(ex)
+    if not controllerid:
+        log.error('"id" missing in datagram')
+        raise SDPDecodeException('"id:" _MUST_ exists in datagram')
+    if multipart_parent:
+        multipart_parent.add_sdp_multipart(sdp)
+        sdp = multipart_parent
+    return (sdp, signed, sha256)
+
+def peek_id(data):
+    """ Find controller id from the binary datagram without decoding it
+
+    :param data: binary datagram (bytes-like)
+
+    :returns: controller id or None if datagram does not start with
+        the "id" record
+    """
+    if len(data) < 4 or data[1] != VERSION or data[2] != ID:
+        return None
+    try:
+        return _string(bytes(data), 3)[0]
+    except SDPDecodeException:
+        return None
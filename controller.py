@@ -3,13 +3,19 @@
 import time
 
 from sdp import SDP
+from sdppacker import SDPPacker
+from ackwriter import AckWriter
 from sdpexception import SDPException
 from stats import Stats
+from histogram import LatencyStats
 
 import logging
 log = logging.getLogger(__name__)   # pylint: disable=invalid-name
 log.addHandler(logging.NullHandler())
 
+# number of recently ACKed datagrams remembered for duplicate detection
+DUPLICATE_WINDOW = 8
+
 class Controller(object):
     """ One controller """
     def __init__(self, ctrid, listinstance=None):
@@ -26,11 +32,15 @@ class Controller(object):
         self._last_sdp = None
         self._last_sdp_ts = None
         self._send_queue = {}
+        self._acks = {}
+        self._ack_writer = None
         self._stats = Stats()
+        self._latency = LatencyStats()
         self._nonce = None
         self._servicegroups = None
         self._msgbus = None
         self._storage = None
+        self._shared = listinstance.is_shared() if listinstance else False
 
     def get_id(self):
         """ Get id of controller
@@ -83,6 +93,7 @@ class Controller(object):
         if not self._storage:
             log.exception('self._storage missing')
             return 0
+        self._forget_key()
         self._storage.hset_data('controllers/setup', self._id, setup)
 
     def get_setup(self):
@@ -119,8 +130,16 @@ class Controller(object):
     def get_nonce(self):
         """ Get controller nonce used for SHA256 HMAC signature
 
+        Nonce is kept in the storage to share it with other SDP ingest
+        processes if the storage is shared (see Controllers), otherwise
+        the local nonce is used without a storage round trip.
+
         :returns: nonce
         """
+        if self._shared and self._storage:
+            nonce = self._storage.hget('controllers/nonce', self._id)
+            if nonce != None:
+                return nonce
         return self._nonce
 
     def set_nonce(self, nonce):
@@ -128,7 +147,22 @@ class Controller(object):
 
         :param nonce: nonce
         """
+        self._forget_key()
         self._nonce = nonce
+        if self._shared and self._storage:
+            self._storage.hset('controllers/nonce', self._id, nonce)
+
+    def _forget_key(self):
+        """ Drop cached HMAC state and remembered ACKs before secret
+        key or nonce changes
+        """
+        self._acks = {}
+        if not self._storage:
+            return
+        secret_key = self.get_secret_key()
+        nonce = self.get_nonce()
+        if secret_key and nonce is not None:
+            SDP.forget_key(secret_key, nonce)
 
     def get_seq(self):
         """ Get sequence num for HMAC calculation
@@ -157,6 +191,29 @@ class Controller(object):
             return
         self._storage.hset('controllers/seq', self._id, seq)
 
+    def update_seq(self, seq):
+        """ Set controller packet sequence num if it is growing
+
+        Sequence num 0 (after a new nonce) accepts any value. With
+        shared storage (see Controllers) check and set is a single
+        atomic storage operation, so datagrams of the same controller
+        processed by different workers can not both pass the check.
+
+        :param seq: sequence num
+
+        :returns: True if seq was greater than the previous one
+        """
+        if not self._storage:
+            log.exception('self._storage missing')
+            return False
+        if self._shared:
+            return self._storage.hset_if_greater('controllers/seq', self._id, seq)
+        prev_seq = self.get_seq()
+        if prev_seq and not prev_seq < seq:
+            return False
+        self.set_seq(seq)
+        return True
+
     def set_host(self, host):
         """ Assign Host instance to the controller
 
@@ -247,6 +304,7 @@ class Controller(object):
             r['timestamp'] = self._last_sdp_ts
         if check_scope and check_scope('stats:controller'):
             r['stats'] = self._stats.get()
+            r['latency_us'] = self._latency.get()
         return r
 
     def get_service_data_v1(self, servicegroup):
@@ -327,11 +385,13 @@ class Controller(object):
             r['timestamp'] = self._last_sdp_ts
         return r
 
-    def set_last_sdp(self, sdp, ts=time.time()):
+    def set_last_sdp(self, sdp, ts=time.time(), digest=None):
         """ Remember last SDP packet and process it locally
 
         :param sdp: SDP instance
         :param ts: optional timestamp
+        :param digest: optional digest of the datagram for duplicate
+            detection (see ack_duplicate())
         """
         log.debug('set_last_sdp(%s)', str(self._id))
         self._stats.add('rx/datagram/total', 1)
@@ -354,9 +414,19 @@ class Controller(object):
             self._last_sdp_ts = ts
             self._stats.add('rx/sdp/ok', 1)
             self._stats.set('rx/sdp/last/timestamp', ts)
+            self._mark('state')
             self._publish()
+            self._mark('publish')
         self._stats.add('rx/datagram/ok', 1)
-        self.ack_sdp(sdp)
+        self.ack_sdp(sdp, digest=digest)
+
+    def _mark(self, stage):
+        """ Record latency of the processing stage
+
+        :param stage: stage name
+        """
+        if self._host:
+            self._host.mark(stage)
 
     def _process_incoming_sdp(self, sdp, ts=time.time()):
         """ Process SDP packet from controller:
@@ -460,14 +530,57 @@ class Controller(object):
         sdp = SDP(secret_key=self.get_secret_key(), nonce=nonce)
         sdp.add_keyvalue('id', self._id)
         sdp.add_keyvalue('nonce', nonce)
-        self._host.send(sdp.encode())
+        if self._host.is_binary():
+            self._host.send(sdp.encode_binary())
+        else:
+            self._host.send(sdp.encode())
         self._stats.add('tx/nonce', 1)
 
-    def ack_sdp(self, sdp):
+    def ack_duplicate(self, digest, host):
+        """ Resend ACK if the same datagram is already processed
+
+        Controller retransmits datagram if ACK is lost. Such duplicate
+        is answered with the remembered ACK without processing it again.
+        Only ACKs of signed datagrams with "in" are remembered (see
+        ack_sdp()). ACKs are forgotten if secret key, nonce or send
+        queue changes. Digest covers the signature made with the nonce,
+        so nonce is not checked here (no storage round trip).
+
+        :param digest: digest of the received datagram
+        :param host: Host instance of the sender
+
+        :returns: True if ACK was resent
+        """
+        ack = self._acks.get(digest, None)
+        if ack is None or host != self._host:
+            return False
+        log.debug('ack_duplicate(%s)', str(self._id))
+        self._stats.add('rx/datagram/duplicate', 1)
+        self._send_datagrams(ack)
+        return True
+
+    def ack_sdp(self, sdp, digest=None):
         """ Send ACK based on the SDP packet.
 
         ACK packet consists "id", "in" if it was defined in the
         SDP packet and register values from the send queue
+
+        ACK is compressed if the controller sends datagrams compressed
+        with a preset dictionary and it is binary if the controller
+        sends binary datagrams. Not yet sent older ACK to the same
+        controller is replaced by this one.
+
+        Register values which do not fit to the ACK datagram
+        (MAX_SDP_SIZE) are sent in follow-up datagrams.
+
+        Text ACK is written directly to bytes by AckWriter, register
+        lines are encoded once per send queue entry.
+
+        :param sdp: received SDP instance
+        :param digest: optional digest of the received datagram, ACK
+            is remembered for duplicates of the same datagram if it is
+            signed and has "in" (a retransmission, repeated status
+            report without "in" is processed again)
         """
         log.debug('ack_sdp(%s)', str(self._id))
         if not self._host:
@@ -476,57 +589,104 @@ class Controller(object):
         if not sdp:
             log.error('SDP is missing')
             return
-        ack = SDP()
-        ack.add_keyvalue('id', self._id)
-        part_ack = None
+        nonce = self.get_nonce()
+        ins = []
         for part in sdp.gen_get():
-            if part_ack:
-                ack += part_ack
-                part_ack = None
             inn = part.get_data('in')
             if inn:
-                part_ack = SDP()
-                part_ack.add_keyvalue('in', inn)
+                ins.append(inn)
             self._stats.add('tx/sdp/ack/parts', 1)
-        if part_ack:
-            self._stats.add('tx/sdp/ack/updates', self._add_send_queue_to_sdp(part_ack))
+        if self._host.is_binary():
+            packer = SDPPacker(self._id, secret_key=self.get_secret_key(), \
+                nonce=nonce)
+            for inn in ins:
+                packer.add_piece(inn)
+            self._stats.add('tx/sdp/ack/updates', self._add_send_queue_to_sdp(packer))
+            datagrams = packer.encode(binary=True)
         else:
-            self._stats.add('tx/sdp/ack/updates', self._add_send_queue_to_sdp(ack))
-        if part_ack:
-            ack += part_ack
-        ack.set_secret_key(self.get_secret_key())
-        ack.set_nonce(self.get_nonce())
-        self._host.send(ack.encode())
+            if self._ack_writer is None:
+                self._ack_writer = AckWriter(self._id)
+            registers = self._send_queue_registers()
+            self._stats.add('tx/sdp/ack/updates', len(registers))
+            datagrams = self._ack_writer.write(ins, registers, \
+                self.get_secret_key(), nonce)
+        if digest is not None and ins and sdp.is_signed():
+            if len(self._acks) >= DUPLICATE_WINDOW:
+                del self._acks[next(iter(self._acks))]
+            self._acks[digest] = datagrams
+        latency = self._send_datagrams(datagrams)
+        if latency is not None:
+            self._latency.record('ack', latency)
         self._stats.add('tx/sdp/ack/packets', 1)
+        if len(datagrams) > 1:
+            self._stats.add('tx/sdp/ack/followups', len(datagrams) - 1)
+
+    def _send_datagrams(self, datagrams):
+        """ Send ACK datagram and its follow-ups to the controller
+
+        Not yet sent older datagrams are replaced by these ones.
+
+        :param datagrams: list of datagrams
+
+        :returns: latency returned by Host.send() for the first datagram
+        """
+        latency = self._host.send(datagrams[0], compress=True, coalesce=self._id)
+        for (i, datagram) in enumerate(datagrams[1:], 1):
+            self._host.send(datagram, compress=True, coalesce=(self._id, i))
+        return latency
 
     def send_settings(self):
         """ Send SDP with register values from the send queue
+
+        Datagram is compressed if the controller sends datagrams
+        compressed with a preset dictionary
         """
         log.debug('send_settings(%s)', str(self._id))
         if not self._host:
             log.error('No host data for controller (%s)', str(self._id))
             return
-        sdp = SDP()
-        sdp.add_keyvalue('id', self._id)
-        self._stats.add('tx/sdp/conf/updates', self._add_send_queue_to_sdp(sdp))
-        self._host.send(sdp.encode())
-        self._stats.add('tx/sdp/conf/packets', 1)
+        packer = SDPPacker(self._id)
+        self._stats.add('tx/sdp/conf/updates', self._add_send_queue_to_sdp(packer))
+        for datagram in packer.encode(binary=self._host.is_binary()):
+            self._host.send(datagram, compress=True)
+            self._stats.add('tx/sdp/conf/packets', 1)
 
-    def _add_send_queue_to_sdp(self, sdp):
+    def _add_send_queue_to_sdp(self, packer):
         """ Add register values from the send queue
+
+        :param packer: SDPPacker instance
+
+        :returns: number of added registers
         """
         changes = 0
         for reg in self._send_queue.keys():
-            sdp.add_keyvalue(reg, self._send_queue[reg]['val'])
+            packer.add_keyvalue(reg, self._send_queue[reg]['val'])
             changes += 1
         self._stats.add('tx/sdp/confreg', changes)
         return changes
 
+    def _send_queue_registers(self):
+        """ Return encoded register lines of the send queue
+
+        Line is encoded on first use and kept in the send queue entry.
+
+        :returns: list of AckWriter.register() tuples
+        """
+        registers = []
+        for (reg, entry) in self._send_queue.items():
+            register = entry.get('ack', None)
+            if register is None:
+                register = entry['ack'] = AckWriter.register(reg, entry['val'])
+            registers.append(register)
+        self._stats.add('tx/sdp/confreg', len(registers))
+        return registers
+
     def send_queue_reset(self):
         """ Reset send queue
         """
         log.debug('send_queue_reset(%s)', str(self._id))
         self._send_queue = {}
+        self._acks = {}
 
     def send_queue_add_last_reg(self, reg):
         """ Add known register to the send queue
@@ -549,6 +709,7 @@ class Controller(object):
             self._send_queue[reg] = {}
             self._send_queue[reg]['val'] = val
             self._send_queue[reg]['tries'] = 0
+            self._acks = {}
 
     def send_queue_remove_reg(self, reg, val):
         """ Remove one register from send queue
@@ -572,11 +733,13 @@ class Controller(object):
                 log.warning('controller=%s reg=%s expired', str(self._id), str(reg))
                 self._stats.add('rx/sdp/updates/expired', 1)
                 self._send_queue.pop(reg)
+                self._acks = {}
             elif self._send_queue[reg]['tries'] > 1:
                 self._stats.add('rx/sdp/updates/retries', 1)
             return
         else:
             self._send_queue.pop(reg)
+            self._acks = {}
             self._stats.add('rx/sdp/updates/accepted', 1)
 
     def __getstate__(self):
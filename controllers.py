@@ -15,10 +15,70 @@ __all__ = [
 class Controllers(GlobalList):
     ''' List of all known controllers '''
 
-    def __init__(self, storage=None, key=None, core=None):
+    def __init__(self, storage=None, key=None, core=None, shared=False):
         self._core = core
+        self._shared = shared
         super(Controllers, self).__init__(storage=storage, key=key)
 
+    def is_shared(self):
+        ''' Return True if the storage is shared with other processes '''
+        return self._shared
+
+    def find_by_id(self, id):
+        ''' Return existing controller or create a new one
+
+        Creation of a new controller is published to the message bus
+        with subject "controllers/created".
+
+        :param id: controller id
+
+        :returns: controller instance
+        '''
+        created = super(Controllers, self).get_id(id) is None
+        controller = super(Controllers, self).find_by_id(id)
+        if created and self._core:
+            self._core.msgbus().publish('controllers/created', \
+                {'controller': id})
+        return controller
+
+    def get_id(self, id):
+        ''' Return existing controller or None
+
+        If the storage is shared with other processes, a controller
+        created by another process is picked up from the storage.
+
+        :param id: controller id
+
+        :returns: controller instance or None
+        '''
+        controller = super(Controllers, self).get_id(id)
+        if controller or not self._shared:
+            return controller
+        if not self._storage or not self._storage_key:
+            return None
+        if not self._storage.sismember(self._storage_key, id):
+            return None
+        log.info('controller %s found in shared storage', str(id))
+        controller = self.find_by_id(id)
+        controller.set_servicegroups(self._core.servicegroups())
+        controller.set_msgbus(self._core.msgbus())
+        return controller
+
+    def get_id_list(self):
+        ''' Generates a list of controller ids
+
+        If the storage is shared with other processes, controllers
+        created or picked up by any process are listed.
+
+        :returns: Generated id for each controller
+        '''
+        if not self._shared or not self._storage or not self._storage_key:
+            yield from super(Controllers, self).get_id_list()
+            return
+        ids = set(self._members.keys())
+        ids.update(self._storage.smembers(self._storage_key) or [])
+        yield from ids
+
     def restore(self):
         if self._storage and self._storage_key:
             if self._storage.exists(self._storage_key):
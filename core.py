@@ -9,6 +9,7 @@ that are needed for the whole system:
     WsClients - list of active WebSocket connections
     MsgBus - global message bus for webscoket client live updates
     Hosts - all known controller connections
+    UDPComm - SDP listener socket
     Redis - Redis DB helper
 
 In addition of these instances, it also reads configuration
@@ -38,8 +39,12 @@ __all__ = [
 ]
 
 class Core(object):
-    def __init__(self, configfile=None):
+    def __init__(self, configfile=None, worker=None):
         ''' Create new Core system instance
+
+        :param configfile: INI filename
+        :param worker: SDP ingest worker number if the storage is
+            shared with other worker processes
         '''
         log.debug('Create a new Core system instance')
         self._config = {}
@@ -54,9 +59,13 @@ class Core(object):
             )
         self._usersessions = UserSessions(storage=self._storage, key='usersessions')
         self._servicegroups = ServiceGroups(storage=self._storage, key='servicegroups').restore()
-        self._controllers = Controllers(storage=self._storage, key='controllers', core=self).restore()
-        self._hosts = Hosts(storage=self._storage, key='hosts')
+        self._controllers = Controllers(storage=self._storage, key='controllers', core=self, shared=worker != None).restore()
+        if worker == None:
+            self._hosts = Hosts(storage=self._storage, key='hosts')
+        else:
+            self._hosts = Hosts(storage=self._storage, key='hosts/' + str(worker))
         self._wsclients = WsClients()
+        self._udpcomm = None
         self._auth = Auth(self)
         self._config_auth()
 
@@ -114,6 +123,20 @@ class Core(object):
         '''
         return self._hosts
 
+    def set_udpcomm(self, udpcomm):
+        ''' Set UDPComm instance of the SDP listener
+
+        :param udpcomm: UDPComm instance
+        '''
+        self._udpcomm = udpcomm
+
+    def udpcomm(self):
+        ''' Get UDPComm instance
+
+        :returns: UDPComm instance or None if not listening
+        '''
+        return self._udpcomm
+
     def storage(self):
         ''' Get Storage instance
 
@@ -0,0 +1,146 @@
+""" Latency histograms
+
+Histogram keeps counts in logarithmic buckets with linear sub-buckets
+(like HdrHistogram), so it uses little memory and every recorded value
+is known with about 3% precision over the whole range.
+"""
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'Histogram', 'LatencyStats',
+]
+
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+SUB_HALF = SUB_COUNT >> 1
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+class Histogram(object):
+    """ Histogram of integer values (microseconds) """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Forget all recorded values """
+        self._counts = {}
+        self._count = 0
+        self._sum = 0
+        self._min = None
+        self._max = None
+
+    @staticmethod
+    def _index(value):
+        """ Return bucket index for value
+
+        Values below SUB_COUNT have their own bucket. Bigger values
+        are kept with SUB_BITS - 1 significant bits.
+        """
+        if value < SUB_COUNT:
+            return value
+        shift = value.bit_length() - SUB_BITS
+        return SUB_COUNT + (shift - 1) * SUB_HALF + (value >> shift) - SUB_HALF
+
+    @staticmethod
+    def _value(index):
+        """ Return highest value of the bucket """
+        if index < SUB_COUNT:
+            return index
+        (shift, sub) = divmod(index - SUB_COUNT, SUB_HALF)
+        shift += 1
+        return ((sub + SUB_HALF + 1) << shift) - 1
+
+    def record(self, value):
+        """ Record one value
+
+        :param value: value (int >= 0)
+        """
+        if value < 0:
+            value = 0
+        index = self._index(value)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self._count += 1
+        self._sum += value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def get_count(self):
+        """ Return number of recorded values """
+        return self._count
+
+    def percentile(self, percent):
+        """ Return value below which given percent of values fall
+
+        :param percent: percentile (0 .. 100)
+
+        :returns: value or None if histogram is empty
+        """
+        if not self._count:
+            return None
+        limit = max(1, int(round(self._count * percent / 100.0)))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= limit:
+                return min(self._value(index), self._max)
+        return self._max
+
+    def get(self):
+        """ Return histogram summary
+
+        :returns: dict with count, min, mean, max and percentiles
+        """
+        r = {'count': self._count}
+        if not self._count:
+            return r
+        r['min'] = self._min
+        r['max'] = self._max
+        r['mean'] = self._sum / self._count
+        for percent in PERCENTILES:
+            r['p' + str(percent).replace('.', '')] = self.percentile(percent)
+        return r
+
+class LatencyStats(object):
+    """ Latency histograms of named processing stages
+
+    Values are recorded in seconds and kept in microseconds. Values
+    are also recorded to the optional parent LatencyStats instance.
+    """
+    def __init__(self, parent=None):
+        """ Create latency statistics
+
+        :param parent: optional LatencyStats instance for aggregate
+        """
+        self._stages = {}
+        self._parent = parent
+
+    def record(self, stage, seconds):
+        """ Record latency of the stage
+
+        :param stage: stage name
+        :param seconds: latency in seconds
+        """
+        histogram = self._stages.get(stage, None)
+        if histogram is None:
+            histogram = self._stages[stage] = Histogram()
+        histogram.record(int(seconds * 1000000))
+        if self._parent is not None:
+            self._parent.record(stage, seconds)
+
+    def reset(self):
+        """ Forget all recorded values """
+        for histogram in self._stages.values():
+            histogram.reset()
+
+    def get(self):
+        """ Return summary of all stages in microseconds
+
+        :returns: dict of stage summaries
+        """
+        return dict((stage, histogram.get())
+                    for (stage, histogram) in self._stages.items())
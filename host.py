@@ -2,9 +2,13 @@
 """
 import zlib
 import gzip
+import time
 import base64
 
 from stats import Stats
+from histogram import LatencyStats
+import sdpzdict
+import binarysdp
 
 import logging
 log = logging.getLogger(__name__)   # pylint: disable=invalid-name
@@ -27,6 +31,14 @@ class Host(object):
         self._addr = None
         self._controllers = []
         self._stats = Stats()
+        self._zdict_version = None
+        self._binary = False
+        if listinstance:
+            self._latency = LatencyStats(listinstance.get_latency())
+        else:
+            self._latency = LatencyStats()
+        self._trace_start = None
+        self._trace_last = None
 
     def get_id(self):
         """ Get id of host/device (IP, port duple)
@@ -59,7 +71,21 @@ class Host(object):
         log.debug('set_addr(%s, %s)', str(self._id), str(addr))
         self._addr = addr
 
-    def receiver(self, receivedmessage):
+    def get_addr(self):
+        """ Get host/device address
+
+        :returns: host/device address
+        """
+        return self._addr
+
+    def is_binary(self):
+        """ Check if the host sends binary SDP datagrams
+
+        :returns: True if the last datagram was binary (see binarysdp)
+        """
+        return self._binary
+
+    def receiver(self, receivedmessage, ts=None):
         """ Process data received from the host/controller
 
         This method is a wrapper for keeping all host/controller
@@ -67,40 +93,55 @@ class Host(object):
 
         Data will be processed by self._receiver(self, receivedmessage)
 
+        Received data can be any bytes-like object (including a
+        memoryview of the receive buffer). It is not referenced after
+        this method returns.
+
+        If the receive time is known, latency of the processing stages
+        (see mark()) is recorded until the reply is sent.
+
         :param receivedmessage: data received from the host/controller
+        :param ts: optional receive time (time.perf_counter())
         """
         if not self._receiver:
             log.exception('receiver(%s): callback not set', str(self._id))
             return
+        if ts is not None:
+            self._trace_start = self._trace_last = ts
+            self.mark('queue')
+        try:
+            self._receive(receivedmessage)
+        finally:
+            self._trace_start = None
+
+    def _receive(self, receivedmessage):
+        """ Decompress and process received data
+
+        Binary SDP datagrams (see binarysdp) are detected by the magic
+        byte and passed to the receiver as bytes, all other data is
+        passed as str.
+
+        :param receivedmessage: data received from the host/controller
+        """
         rawlen = len(receivedmessage)
         self._stats.add('rx/bytes_raw', rawlen)
 
-        if receivedmessage[0] == 0x1f and receivedmessage[1] == 0x8b:
-            ''' gzip compressed data '''
-            try:
-                receivedmessage = gzip.decompress(receivedmessage)
-            except Exception as ex:
-                self._stats.add('rx/errors', 1)
-                self._stats.set('rx/last_error/datagram_raw_b64', \
-                        base64.b64encode(receivedmessage))
-                self._stats.set('rx/last_error/reason', \
-                        'gzip.decompress() exception: ' + str(ex))
-                self._stats.set_timestamp('rx/last_error/timestamp')
-                return
-            self._stats.add('rx/packets_compressed_gzip', 1)
-            self._stats.add('rx/compression_saved_bytes', len(receivedmessage) - rawlen)
-            log.debug('compressed data from %s', str(self._id))
+        if isinstance(receivedmessage, str) or rawlen < 2:
+            pass
+        elif receivedmessage[0] == binarysdp.MAGIC:
+            ''' binary SDP, not compressed '''
+            pass
         else:
-            ''' try zlib compressed data '''
-            try:
-                receivedmessage = zlib.decompress(receivedmessage)
-                self._stats.add('rx/packets_compressed_zlib', 1)
-                self._stats.add('rx/compression_saved_bytes', len(receivedmessage) - rawlen)
-            except zlib.error as ex:
-                pass
-        if not isinstance(receivedmessage, str):
+            receivedmessage = self._decompress(receivedmessage)
+            if receivedmessage is None:
+                return
+        self._binary = binarysdp.is_binary(receivedmessage)
+        if self._binary:
+            receivedmessage = bytes(receivedmessage)
+            self._stats.add('rx/packets_binary', 1)
+        elif not isinstance(receivedmessage, str):
             try:
-                receivedmessage = receivedmessage.decode("UTF-8")
+                receivedmessage = str(receivedmessage, "UTF-8")
             except UnicodeDecodeError as ex:
                 self._stats.add('rx/errors', 1)
                 self._stats.set('rx/last_error/datagram_raw_b64', \
@@ -109,6 +150,7 @@ class Host(object):
                     'decode("UTF-8") exception: ' + str(ex))
                 self._stats.set_timestamp('rx/last_error/timestamp')
                 return
+        self.mark('decompress')
         log.debug('receiver(%s, "%s")', \
             str(self._id), str(receivedmessage))
         self._stats.add('rx/bytes', len(receivedmessage))
@@ -116,14 +158,138 @@ class Host(object):
         self._stats.set_timestamp('rx/last/timestamp')
         try:
             self._receiver(self, receivedmessage)
-            self._stats.set('rx/last/datagram', receivedmessage)
+            self._set_datagram('rx/last/datagram', receivedmessage)
         except Exception as ex:
             self._stats.add('rx/errors', 1)
-            self._stats.set('rx/last_error/datagram', receivedmessage)
+            self._set_datagram('rx/last_error/datagram', receivedmessage)
             self._stats.set('rx/last_error/reason', str(ex))
             self._stats.set_timestamp('rx/last_error/timestamp')
 
-    def send(self, sendmessage):
+    def _set_datagram(self, name, datagram):
+        """ Store datagram to the statistics
+
+        Binary datagram (see binarysdp) is not valid UTF-8, it is stored
+        base64 encoded to name + "_raw_b64" instead.
+
+        :param name: statistics element name
+        :param datagram: datagram (str or bytes)
+        """
+        if binarysdp.is_binary(datagram):
+            self._stats.set(name, None)
+            self._stats.set(name + '_raw_b64', base64.b64encode(datagram))
+        else:
+            self._stats.set(name, datagram)
+
+    def drop(self, reason):
+        """ Count datagram dropped by the receiver without processing
+
+        :param reason: short reason used as a statistics key
+        """
+        log.debug('drop(%s, %s)', str(self._id), reason)
+        self._stats.add('rx/dropped/' + reason, 1)
+
+    def mark(self, stage):
+        """ Record latency of the processing stage of received data
+
+        Time since the previous mark (or receive time) is recorded.
+        Nothing is recorded if the receive time is not known.
+
+        :param stage: stage name
+        """
+        if self._trace_start is None:
+            return
+        now = time.perf_counter()
+        self._latency.record(stage, now - self._trace_last)
+        self._trace_last = now
+
+    def _decompress(self, receivedmessage):
+        """ Decompress gzip or zlib compressed data
+
+        Compression is detected by the gzip magic bytes or by a valid
+        zlib (RFC 1950) header, so plain text datagrams never pay for a
+        failed decompression attempt.
+
+        :param receivedmessage: data received from the host/controller
+
+        :returns: uncompressed data or None on error
+        """
+        rawlen = len(receivedmessage)
+        if receivedmessage[0] == 0x1f and receivedmessage[1] == 0x8b:
+            ''' gzip compressed data '''
+            try:
+                receivedmessage = gzip.decompress(receivedmessage)
+            except Exception as ex:
+                self._stats.add('rx/errors', 1)
+                self._stats.set('rx/last_error/datagram_raw_b64', \
+                        base64.b64encode(receivedmessage))
+                self._stats.set('rx/last_error/reason', \
+                        'gzip.decompress() exception: ' + str(ex))
+                self._stats.set_timestamp('rx/last_error/timestamp')
+                return None
+            self._stats.add('rx/packets_compressed_gzip', 1)
+            self._stats.add('rx/compression_saved_bytes', len(receivedmessage) - rawlen)
+            log.debug('compressed data from %s', str(self._id))
+            return receivedmessage
+        if Host._is_zlib_header(receivedmessage):
+            dictid = sdpzdict.get_dictid(receivedmessage)
+            if dictid is not None:
+                return self._decompress_zdict(receivedmessage, dictid)
+            ''' zlib compressed data '''
+            try:
+                receivedmessage = zlib.decompress(receivedmessage)
+            except zlib.error as ex:
+                self._stats.add('rx/compression_probe/zlib_false_positive', 1)
+                return receivedmessage
+            self._stats.add('rx/packets_compressed_zlib', 1)
+            self._stats.add('rx/compression_saved_bytes', len(receivedmessage) - rawlen)
+            return receivedmessage
+        self._stats.add('rx/compression_probe/zlib_avoided', 1)
+        return receivedmessage
+
+    def _decompress_zdict(self, receivedmessage, dictid):
+        """ Decompress zlib data compressed with a preset dictionary
+
+        Host that sends such data is known to support the dictionary
+        and data sent to it can be compressed with the same dictionary.
+
+        Plain text can start with a valid zlib header too, so data that
+        can not be decompressed (unknown dictionary or broken stream) is
+        returned as it is.
+
+        :param receivedmessage: data received from the host/controller
+        :param dictid: preset dictionary id from zlib header
+
+        :returns: uncompressed or original data
+        """
+        rawlen = len(receivedmessage)
+        try:
+            data = sdpzdict.decompress(receivedmessage, dictid)
+        except zlib.error as ex:
+            self._stats.add('rx/compression_probe/zdict_false_positive', 1)
+            log.debug('zdict decompress exception from %s: %s', \
+                str(self._id), str(ex))
+            return receivedmessage
+        self._zdict_version = sdpzdict.get_version(dictid)
+        self._stats.add('rx/packets_compressed_zdict', 1)
+        self._stats.add('rx/compression_saved_bytes', len(data) - rawlen)
+        return data
+
+    @staticmethod
+    def _is_zlib_header(data):
+        """ Check if data starts with a valid zlib stream header
+
+        CMF byte must declare deflate method with window size up to
+        32K and CMF*256+FLG must be a multiple of 31 (RFC 1950).
+
+        :param data: received data (at least 2 bytes)
+
+        :returns: True if header is valid
+        """
+        cmf = data[0]
+        return (cmf & 0x0f) == 8 and (cmf >> 4) <= 7 and \
+            ((cmf << 8) | data[1]) % 31 == 0
+
+    def send(self, sendmessage, compress=False, coalesce=None):
         """ Send data to the host/controller
 
         This method is a wrapper for keeping all host/controller
@@ -132,6 +298,13 @@ class Host(object):
         Data will sent by self._sender(self, addr, sendmessage)
 
         :param sendmessage: data to send to the host/controller
+        :param compress: compress data with the preset dictionary if
+            the host has used one and it makes data smaller
+        :param coalesce: optional key, not yet sent data with the same
+            key may be replaced by this data
+
+        :returns: seconds since the data was received if this is a
+            reply to the received data, otherwise None
         """
         if not self._sender:
             log.error('send(%s, "%s"): callback not set', \
@@ -141,11 +314,28 @@ class Host(object):
             str(self._id), str(self._addr), str(sendmessage))
         self._stats.add('tx/bytes', len(sendmessage))
         self._stats.add('tx/packets', 1)
-        self._stats.set('tx/last/datagram', sendmessage)
+        self._set_datagram('tx/last/datagram', sendmessage)
         self._stats.set_timestamp('tx/last/timestamp')
         if isinstance(sendmessage, str):
             sendmessage = sendmessage.encode("UTF-8")
-        self._sender(self, self._addr, sendmessage)
+        if compress and self._zdict_version:
+            compressed = sdpzdict.compress(sendmessage, self._zdict_version)
+            if len(compressed) < len(sendmessage):
+                self._stats.add('tx/packets_compressed_zdict', 1)
+                self._stats.add('tx/compression_saved_bytes', \
+                    len(sendmessage) - len(compressed))
+                sendmessage = compressed
+        if coalesce is None:
+            self._sender(self, self._addr, sendmessage)
+        else:
+            self._sender(self, self._addr, sendmessage, coalesce=coalesce)
+        if self._trace_start is None:
+            return None
+        self.mark('send')
+        latency = self._trace_last - self._trace_start
+        self._latency.record('total', latency)
+        self._trace_start = None
+        return latency
 
     def add_controller(self, controller):
         """ Associate a new Controller with this Host
@@ -208,7 +398,9 @@ class Host(object):
 
         :returns: statistics
         """
-        return self._stats.get()
+        stats = dict(self._stats.get())
+        stats['latency_us'] = self._latency.get()
+        return stats
 
     def __eq__(self, host):
         return self.get_id() == host.get_id()
@@ -3,6 +3,7 @@
 
 from globallist import GlobalList
 from host import Host
+from histogram import LatencyStats
 
 import logging
 log = logging.getLogger(__name__)
@@ -18,7 +19,41 @@ class Hosts(GlobalList):
     def __init__(self, storage=None, key=None):
         if storage and key:
             storage.delete(key)
+        self._latency = LatencyStats()
         super(Hosts, self).__init__(storage=storage, key=key)
+        self._by_addr = {}
 
     def getMemberClass(self):
         return Host
+
+    def get_latency(self):
+        ''' Return ingest latency statistics of all hosts
+
+        :returns: LatencyStats instance
+        '''
+        return self._latency
+
+    def get_by_addr(self, addr):
+        ''' Return host bound to the address
+
+        :param addr: host (addr, port) tuple
+
+        :returns: Host instance or None if not bound
+        '''
+        return self._by_addr.get(addr, None)
+
+    def bind_addr(self, addr, host):
+        ''' Bind address to the host for fast lookup by get_by_addr()
+
+        Binding is removed when the host is removed from the list
+
+        :param addr: host (addr, port) tuple
+        :param host: Host instance
+        '''
+        self._by_addr[addr] = host
+
+    def remove_by_id(self, id):
+        host = self.get_id(id)
+        if host:
+            self._by_addr.pop(host.get_addr(), None)
+        super(Hosts, self).remove_by_id(id)
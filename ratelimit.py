@@ -0,0 +1,75 @@
+""" Token bucket rate limiter
+"""
+import time
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'RateLimiter',
+]
+
+MAX_KEYS = 10000
+
+class RateLimiter(object):
+    """ Token bucket rate limiter with one bucket per key
+
+    Every key (source address, controller id etc) gets its own bucket
+    of ``burst`` tokens which is refilled with ``rate`` tokens per
+    second. Number of buckets is limited by ``maxkeys``, the least
+    recently created bucket is forgotten first.
+    """
+    def __init__(self, rate, burst=None, maxkeys=MAX_KEYS):
+        """ Create rate limiter
+
+        :param rate: allowed events per second (0 to disable limiting)
+        :param burst: bucket size (defaults to rate, at least 1)
+        :param maxkeys: max number of buckets to keep
+        """
+        self._rate = float(rate)
+        if burst is None:
+            burst = rate
+        self._burst = max(1.0, float(burst))
+        self._maxkeys = max(1, int(maxkeys))
+        self._buckets = {}
+
+    def enabled(self):
+        """ Check if rate limiting is enabled
+
+        :returns: True if limit is set
+        """
+        return self._rate > 0
+
+    def allow(self, key, now=None):
+        """ Take one token from the key bucket
+
+        :param key: bucket key
+        :param now: optional current time (time.time())
+
+        :returns: True if event is allowed, False if it should be dropped
+        """
+        if self._rate <= 0:
+            return True
+        if now is None:
+            now = time.time()
+        bucket = self._buckets.get(key, None)
+        if bucket is None:
+            if len(self._buckets) >= self._maxkeys:
+                del self._buckets[next(iter(self._buckets))]
+            self._buckets[key] = [self._burst - 1.0, now]
+            return True
+        tokens = min(self._burst, bucket[0] + (now - bucket[1]) * self._rate)
+        bucket[1] = now
+        if tokens < 1.0:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1.0
+        return True
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def __str__(self):
+        return 'RateLimiter(' + str(self._rate) + '/s, burst ' + \
+            str(self._burst) + ', ' + str(len(self._buckets)) + ' keys)'
@@ -11,3 +11,4 @@ log.addHandler(logging.NullHandler())
 
 class SDP(SignedSDP):
     """ This is a wrapper class for a real SDP class (SignedSDP) """
+    __slots__ = ()
@@ -11,8 +11,69 @@ import logging
 log = logging.getLogger(__name__)   # pylint: disable=invalid-name
 log.addHandler(logging.NullHandler())
 
+# type tags of the key table, in get_data_list() order
+STATUS = 0
+VALUE = 1
+FLOAT = 2
+DATA = 3
+QUERY = 4
+
+# List of Values in wire form, integers or "null" separated by spaces
+VALUES_RE = re.compile(r'(?:0|-?[1-9][0-9]*|null)(?: (?:0|-?[1-9][0-9]*|null))+')
+# longer values are validated by parsing them (int() digit limit)
+VALUES_RE_MAX_LEN = 4000
+
+# encode() order of the type tags
+ENCODE_RANK = {DATA: 0, FLOAT: 1, STATUS: 2, VALUE: 3, QUERY: 4}
+
+def slot_tag(slot):
+    """ Return type tag of the key table slot """
+    if slot[0] == ':':
+        return QUERY
+    last = slot[-1]
+    if last == 'S':
+        return STATUS
+    if last == 'W':
+        return VALUE
+    if last == 'F' or slot == 'TOV':
+        return FLOAT
+    return DATA
+
+class WireValues(str):
+    """ Validated List of Values in wire form, parsed on first access """
+    __slots__ = ()
+
+    def parse(self):
+        """ Return List of Values (list of int or None) """
+        return [None if x == 'null' else int(x) for x in self.split(' ')]
+
+def is_values(val):
+    """ Check if stored value is a List of Values """
+    return isinstance(val, (list, WireValues))
+
+def _tag(item):
+    return slot_tag(item[0])
+
+def _encode_rank(item):
+    return ENCODE_RANK[slot_tag(item[0])]
+
 class SDPItem(object):
-    """ Convert to and from SDP protocol datagram """
+    """ Convert to and from SDP protocol datagram
+
+    All keys except "id" and "in" are kept in one ordered key table
+    (slot -> value). Slot name is unique for every key type and it
+    also defines the type tag of the slot (see slot_tag()):
+
+    * Status: key with "S" suffix, value is int
+    * Value and List of Values: name with "W" suffix (both share
+      the same name), value is int, float, str, list or WireValues
+      (List of Values kept in wire form until it is needed as list)
+    * Float: key, value is hex str
+    * Data: key, value is str
+    * Query: key with ":" prefix, value is "?"
+    """
+    __slots__ = ('_id', '_in', '_table')
+
     def __init__(self, secret_key=None, nonce=None):
         """ Create a new empty in-memory ``SDP`` datagram
         """
@@ -21,14 +82,34 @@ class SDPItem(object):
     def _empty_sdp(self):
         """ Clear all data from this SDP instance
         """
-        self.data = {}
-        self.data['id'] = None
-        self.data['in'] = None
-        self.data['data'] = {}
-        self.data['float'] = {}
-        self.data['status'] = {}
-        self.data['value'] = {}
-        self.data['query'] = {}
+        self._id = None
+        self._in = None
+        self._table = {}
+
+    @property
+    def data(self):
+        """ Data dictionary (read only copy)
+
+        :returns: dict with "id", "in" and dicts of "data", "float",
+            "status", "value" and "query" keys
+        """
+        r = {'id': self._id, 'in': self._in, 'data': {}, 'float': {},
+             'status': {}, 'value': {}, 'query': {}}
+        for (slot, val) in self._table.items():
+            tag = slot_tag(slot)
+            if tag == STATUS:
+                r['status'][slot[:-1]] = val
+            elif tag == VALUE:
+                if isinstance(val, WireValues):
+                    val = val.parse()
+                r['value'][slot[:-1]] = val
+            elif tag == FLOAT:
+                r['float'][slot] = val
+            elif tag == DATA:
+                r['data'][slot] = val
+            else:
+                r['query'][slot[1:]] = val
+        return r
 
     def add_keyvalue(self, key, val):
         """ Add key:val pair to the packet
@@ -52,7 +133,7 @@ class SDPItem(object):
         :param val: data value
         """
         if key == 'id':
-            self.data['id'] = val
+            self._id = val
         elif key == 'in':
             self._add_keyvalue_in(val)
         elif val == '?':
@@ -79,14 +160,14 @@ class SDPItem(object):
             raise SDPException('Illegal "in" type: %s' % str(type(inn)))
         if not re.compile(r'^(\d+)(,\d+)?$').match(inn):
             raise SDPException('Illegal "in" format: %s' % inn)
-        self.data['in'] = inn
+        self._in = inn
 
     def _add_keyvalue_query(self, key):
         """ Add special query key to the packet
 
         :param key: data key
         """
-        self.data['query'][key] = '?'
+        self._table[':' + key] = '?'
 
     def _add_keyvalue_floathex(self, key, val):
         """ Add float key:val pair to the packet
@@ -98,7 +179,7 @@ class SDPItem(object):
             raise SDPException('Value _MUST_BE_ hex str type')
         if val == '':
             raise SDPException('Float value _MUST_ exist')
-        self.data['float'][key] = val
+        self._table[key] = val
 
     def _add_keyvalue_status(self, key, val):
         """ Add status key:val pair to the packet
@@ -132,9 +213,16 @@ class SDPItem(object):
     def _add_keyvalue_values(self, key, val):
         """ Add single value key:val pair to the packet
 
+        String value is validated in one pass and kept in wire form,
+        it is parsed only if the list is needed (see get_data()).
+
         :param key: data key
         :param val: data values as string or list of numbers
         """
+        if type(val) is str and len(val) <= VALUES_RE_MAX_LEN and \
+                VALUES_RE.fullmatch(val):
+            self._table[key[:-1] + 'W'] = WireValues(val)
+            return
         if not isinstance(val, str) and \
            not isinstance(val, list):
             raise SDPException('List of Values _MUST_BE_ string' \
@@ -163,7 +251,7 @@ class SDPItem(object):
         """
         if not isinstance(val, str):
             raise SDPException('Data _MUST_BE_ string')
-        self.data['data'][key] = val
+        self._table[key] = val
 
     def add_status(self, key, val):
         """ Add Status key:val pair to the packet
@@ -175,7 +263,7 @@ class SDPItem(object):
             raise SDPException('Status _MUST_BE_ int type')
         if val not in range(4):
             raise SDPException('Status _MUST_BE_ between 0 and 3')
-        self.data['status'][key] = int(val)
+        self._table[key + 'S'] = int(val)
 
     def add_value(self, key, val):
         """ Add Value or List of Values key:val pair to the packet
@@ -190,7 +278,7 @@ class SDPItem(object):
            not isinstance(val, str) and \
            not isinstance(val, list):
             raise SDPException('Value _MUST_BE_ str, int, float or list type')
-        self.data['value'][key] = val
+        self._table[key + 'W'] = val
 
     def get_data(self, key):    # pylint: disable=too-many-return-statements
         """ Get value of saved data
@@ -207,26 +295,27 @@ class SDPItem(object):
         :returns: Status, Value, List of Values, Data or
         None if key is missing
         """
-        if key in ['id', 'in']:
-            return self.data[key]
-        elif key in self.data['query']:
+        if key == 'id':
+            return self._id
+        elif key == 'in':
+            return self._in
+        table = self._table
+        if ':' + key in table:
             return '?'
-        elif key[-1] == 'F' or key == 'TOV':
-            return self.data['float'].get(key, None)
-        elif key[-1] == 'S':
-            return self.data['status'].get(key[:-1], None)
-        elif key[-1] == 'V':
-            val = self.data['value'].get(key[:-1], None)
-            if isinstance(val, list):
+        elif key[-1] == 'V' and key != 'TOV':
+            val = table.get(key[:-1] + 'W', None)
+            if is_values(val):
                 return None
             return val
         elif key[-1] == 'W':
-            val = self.data['value'].get(key[:-1], None)
+            val = table.get(key, None)
+            if isinstance(val, WireValues):
+                val = table[key] = val.parse()
             if isinstance(val, list):
                 return val
             return None
         else:
-            return self.data['data'].get(key, None)
+            return table.get(key, None)
 
     def get_data_list(self):
         """ Generates (key, val) duples for all variables in the packet
@@ -241,36 +330,36 @@ class SDPItem(object):
 
         Both key and value are always str type.
         """
-        if self.data['id']:
-            yield ('id', self.data['id'])
-        if self.data['in']:
-            yield ('in', self.data['in'])
-        for key in self.data['status'].keys():
-            yield (key + 'S', str(self.data['status'][key]))
-        for key in self.data['value'].keys():
-            if isinstance(self.data['value'][key], list):
-                yield (key + 'W', \
-                    ' '.join([SDPItem._list_value_to_str(x) for x in self.data['value'][key]]))
+        if self._id:
+            yield ('id', self._id)
+        if self._in:
+            yield ('in', self._in)
+        for (slot, val) in sorted(self._table.items(), key=_tag):
+            tag = slot_tag(slot)
+            if tag == QUERY:
+                yield (slot[1:], '?')
+            elif tag == VALUE:
+                if isinstance(val, WireValues):
+                    yield (slot, str(val))
+                elif isinstance(val, list):
+                    yield (slot, \
+                        ' '.join([SDPItem._list_value_to_str(x) for x in val]))
+                else:
+                    yield (slot[:-1] + 'V', str(val))
             else:
-                yield (key + 'V', str(self.data['value'][key]))
-        for key in self.data['float'].keys():
-            yield (key, self.data['float'][key])
-        for key in self.data['data'].keys():
-            yield (key, str(self.data['data'][key]))
-        for key in self.data['query'].keys():
-            yield (key, '?')
+                yield (slot, str(val))
 
     def get_in_seq(self):
         """ Read SDP sequence number from "in:<num>"
 
         :returns: sequence number or 'None' if not exists
         """
-        if not self.data['in']:
+        if not self._in:
             return None
         try:
-            (seq, ts) = self.data['in'].split(',', 1)
+            (seq, ts) = self._in.split(',', 1)
         except ValueError:
-            seq = self.data['in']
+            seq = self._in
         try:
             return int(seq)
         except ValueError:
@@ -281,10 +370,10 @@ class SDPItem(object):
 
         :returns: timestamp or 'None' if not exists
         """
-        if not self.data['in']:
+        if not self._in:
             return None
         try:
-            (seq, ts) = self.data['in'].split(',', 1)
+            (seq, ts) = self._in.split(',', 1)
         except:
             return None
         try:
@@ -297,25 +386,22 @@ class SDPItem(object):
 
         :param key: data key to remove
         """
-        if key in ['id', 'in']:
-            self.data[key] = None
+        if key == 'id':
+            self._id = None
+            return
+        if key == 'in':
+            self._in = None
             return
 
         if not self.get_data(key):
             raise SDPException('no such key exists')
 
-        if key in self.data['query']:
-            del self.data['query'][key]
-        elif key[-1] == 'F' or key == 'TOV':
-            del self.data['float'][key]
-        elif key[-1] == 'S':
-            del self.data['status'][key[:-1]]
-        elif key[-1] == 'V':
-            del self.data['value'][key[:-1]]
-        elif key[-1] == 'W':
-            del self.data['value'][key[:-1]]
+        if ':' + key in self._table:
+            del self._table[':' + key]
+        elif key[-1] == 'V' and key != 'TOV':
+            del self._table[key[:-1] + 'W']
         else:
-            del self.data['data'][key]
+            del self._table[key]
 
     def gen_get(self):
         """ Return this SDP
@@ -334,11 +420,10 @@ class SDPItem(object):
         datagram = ''
         if controllerid:
             self.add_keyvalue('id', controllerid)
-        if not self.data['id']:
+        if not self._id:
             log.error('id missing, cant encode')
             raise SDPException("id missing")
-        if self.data['id']:
-            datagram += 'id:' + str(self.data['id']) + '\n'
+        datagram += 'id:' + str(self._id) + '\n'
         datagram += self._encode_data()
         return datagram
 
@@ -347,25 +432,25 @@ class SDPItem(object):
 
         :returns: The string representation of SDP datagram data part
         """
-        datagram = ''
-        if self.data['in']:
-            datagram += 'in:' + self.data['in'] + '\n'
-        for key in self.data['data'].keys():
-            datagram += key + ':' + str(self.data['data'][key]) + '\n'
-        for key in self.data['float'].keys():
-            datagram += key + ':' + str(self.data['float'][key]) + '\n'
-        for key in self.data['status'].keys():
-            datagram += key + 'S:' + str(self.data['status'][key]) + '\n'
-        for key in self.data['value'].keys():
-            if isinstance(self.data['value'][key], list):
-                datagram += key + 'W:' + \
-                    ' '.join([SDPItem._list_value_to_str(x)
-                              for x in self.data['value'][key]]) + '\n'
+        lines = []
+        if self._in:
+            lines.append('in:' + self._in + '\n')
+        for (slot, val) in sorted(self._table.items(), key=_encode_rank):
+            tag = slot_tag(slot)
+            if tag == QUERY:
+                lines.append(slot[1:] + ':?\n')
+            elif tag == VALUE:
+                if isinstance(val, WireValues):
+                    lines.append(slot + ':' + val + '\n')
+                elif isinstance(val, list):
+                    lines.append(slot + ':' + \
+                        ' '.join([SDPItem._list_value_to_str(x)
+                                  for x in val]) + '\n')
+                else:
+                    lines.append(slot[:-1] + 'V:' + str(val) + '\n')
             else:
-                datagram += key + 'V:' + str(self.data['value'][key]) + '\n'
-        for key in self.data['query'].keys():
-            datagram += key + ':?\n'
-        return datagram
+                lines.append(slot + ':' + str(val) + '\n')
+        return ''.join(lines)
 
     @staticmethod
     def _decode_line(line):
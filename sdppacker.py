@@ -0,0 +1,258 @@
+""" Size aware SDP datagram packer
+
+Packs keys and multipart pieces into SDP datagrams without exceeding
+the datagram size limit. Encoded size is tracked incrementally, so
+nothing is encoded before the datagrams are ready. Text ACKs written
+by AckWriter use the same packing.
+"""
+from sdp import SDP
+from sdpexception import SDPException
+from udpcomm import MAX_SDP_SIZE
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'SDPPacker', 'line_size',
+]
+
+# "sha256:" + BASE64 encoded SHA256 + "\n"
+SIGNATURE_SIZE = len('sha256:') + 44 + 1
+
+def line_size(key, val):
+    """ Return encoded size of one key:val line
+
+    :param key: data key
+    :param val: data value (list for "W" keys)
+
+    :returns: size in bytes
+    """
+    if isinstance(val, list):
+        val = ' '.join([SDP._list_value_to_str(x) for x in val])
+    return len(key.encode('UTF-8')) + len(str(val).encode('UTF-8')) + 2
+
+class SDPPacker(object):
+    """ Pack keys and multipart pieces into SDP datagrams
+
+    Packer keeps only the layout of the datagrams: every datagram is a
+    list of pieces, piece is ["in" value, list of items]. First piece
+    holds keys of the datagram itself ("in" is None), following pieces
+    are multipart pieces. Items are (key, val) pairs when added with
+    add_keyvalue(), SDP instances are built by encode(). AckWriter uses
+    the same layout with pre-encoded register lines as items.
+
+    Datagram with a single piece is not multipart, so its "in" does
+    not need a timestamp. Pieces of a multipart datagram must have
+    growing timestamps (see UnsecureSDP.add_sdp_multipart()).
+    """
+    def __init__(self, controllerid, max_size=MAX_SDP_SIZE, \
+                 secret_key=None, nonce=None, max_datagrams=None):
+        """ Create packer for one controller
+
+        :param controllerid: controller id
+        :param max_size: max size of one datagram in bytes
+        :param secret_key: optional secret key for signed datagrams
+        :param nonce: nonce for signed datagrams
+        :param max_datagrams: optional max number of datagrams
+        """
+        self._id = controllerid
+        self._max_size = max_size
+        self._secret_key = secret_key
+        self._nonce = nonce
+        self._max_datagrams = max_datagrams
+        self._base_size = line_size('id', controllerid)
+        if secret_key:
+            self._base_size += SIGNATURE_SIZE
+        self._datagrams = []
+        self._new_datagram()
+
+    def _new_datagram(self):
+        """ Start next datagram """
+        self._pieces = [[None, []]]
+        self._size = self._base_size
+        self._empty = True
+        self._datagrams.append(self._pieces)
+
+    def _make_room(self, size, new=False):
+        """ Start next datagram if size bytes do not fit to the current one
+
+        :param size: size of the data to add
+        :param new: start next datagram anyway (if current is not empty)
+
+        :returns: False if data does not fit and no more datagrams
+            are allowed
+        """
+        if self._empty or (not new and self._size + size <= self._max_size):
+            return True
+        if self._max_datagrams and len(self._datagrams) >= self._max_datagrams:
+            return False
+        self._new_datagram()
+        return True
+
+    def add_item(self, item, size, name=None):
+        """ Add item to the last multipart piece (or to the datagram if
+        it is not multipart)
+
+        If it does not fit, it is added to the next datagram.
+
+        :param item: item to add
+        :param size: encoded size of the item
+        :param name: item name for the warning message
+
+        :returns: False if it does not fit and no more datagrams are
+            allowed
+        """
+        if not self._make_room(size):
+            return False
+        if self._size + size > self._max_size:
+            log.warning('key %s does not fit to the datagram', name)
+        self._pieces[-1][1].append(item)
+        self._size += size
+        self._empty = False
+        return True
+
+    def add_keyvalue(self, key, val):
+        """ Add key:val pair to the last multipart piece (or to the
+        datagram if it is not multipart)
+
+        Value is validated when datagrams are encoded.
+
+        :param key: data key
+        :param val: data value
+
+        :returns: False if it does not fit and no more datagrams are
+            allowed
+        """
+        return self.add_item((key, val), line_size(key, val), key)
+
+    def add_piece(self, inn, items=None, size=0):
+        """ Start a new multipart piece
+
+        If keys are already added to the datagram itself, piece is
+        added to the next datagram.
+
+        :param inn: "in" value of the piece
+        :param items: optional items of the piece
+        :param size: encoded size of the items
+
+        :returns: False if it does not fit and no more datagrams are
+            allowed
+        """
+        size += line_size('in', inn)
+        if not self._make_room(size, new=len(self._pieces) == 1):
+            return False
+        if self._size + size > self._max_size:
+            log.warning('multipart piece does not fit to the datagram')
+        self._pieces.append([inn, items or []])
+        self._size += size
+        self._empty = False
+        return True
+
+    def add_part(self, part):
+        """ Add copy of the SDP as a multipart piece
+
+        Part "id" (if any) must be the same as the packer controller id.
+        Part itself is not changed and it can be packed again.
+
+        :param part: SDP instance with "in"
+
+        :returns: False if it does not fit and no more datagrams are
+            allowed
+        """
+        inn = None
+        items = []
+        size = 0
+        for (key, val) in part.get_data_list():
+            if key == 'id':
+                if val != self._id:
+                    raise ValueError('part "id" is different')
+                continue
+            if key == 'in':
+                inn = val
+                continue
+            items.append((key, val))
+            size += line_size(key, val)
+        if inn is None:
+            raise SDPException('"in" is required for multipart piece')
+        return self.add_piece(inn, items, size)
+
+    def get_size(self):
+        """ Return encoded size of the current datagram """
+        return self._size
+
+    def get_count(self):
+        """ Return number of datagrams """
+        return len(self._datagrams)
+
+    def get_layout(self):
+        """ Return checked layout of all datagrams
+
+        :returns: list of datagrams, datagram is a list of
+            ["in" value, list of items] pieces
+
+        :raises SDPException: if multipart piece "in" has no timestamp
+            or timestamps are not growing
+        """
+        for pieces in self._datagrams:
+            if len(pieces) > 2:
+                _check_multipart(pieces)
+        return self._datagrams
+
+    def _build(self, pieces):
+        """ Build SDP instance of one datagram
+
+        :param pieces: datagram layout
+
+        :returns: SDP instance
+        """
+        sdp = SDP(secret_key=self._secret_key, nonce=self._nonce)
+        sdp.add_keyvalue('id', self._id)
+        for (key, val) in pieces[0][1]:
+            sdp.add_keyvalue(key, val)
+        if len(pieces) == 2:
+            sdp.add_keyvalue('in', pieces[1][0])
+            for (key, val) in pieces[1][1]:
+                sdp.add_keyvalue(key, val)
+            return sdp
+        for (inn, items) in pieces[1:]:
+            piece = SDP()
+            piece.add_keyvalue('in', inn)
+            for (key, val) in items:
+                piece.add_keyvalue(key, val)
+            sdp += piece
+        return sdp
+
+    def encode(self, binary=False):
+        """ Encode all datagrams
+
+        Size limit is tracked for the text format, binary encoding of
+        the same data is usually smaller.
+
+        :param binary: encode binary datagrams (see binarysdp)
+
+        :returns: list of datagrams (str or bytes if binary)
+        """
+        sdps = [self._build(pieces) for pieces in self.get_layout()]
+        if binary:
+            return [sdp.encode_binary() for sdp in sdps]
+        return [sdp.encode() for sdp in sdps]
+
+def _check_multipart(pieces):
+    """ Check "in" timestamps of multipart pieces
+
+    Same rules as UnsecureSDP.add_sdp_multipart() has.
+
+    :param pieces: datagram layout
+
+    :raises SDPException: if timestamp is missing or not growing
+    """
+    last = None
+    for (inn, _items) in pieces[1:]:
+        (_seq, _sep, ts) = str(inn).partition(',')
+        if not ts.isdigit():
+            raise SDPException('timestamp is required for multipart SDP')
+        ts = int(ts)
+        if last is not None and ts < last:
+            raise SDPException('timestamp is not growing')
+        last = ts
@@ -1,13 +1,19 @@
 """ Process datagrams from controllers
 """
 import time
+import hashlib
 
 from sdp import SDP
+from ratelimit import RateLimiter
 
 import logging
 log = logging.getLogger(__name__)   # pylint: disable=invalid-name
 log.addHandler(logging.NullHandler())
 
+# seconds to remember unknown controller id and max number of such ids
+UNKNOWN_TTL = 60
+UNKNOWN_CACHE_SIZE = 10000
+
 class SDPReceiver(object):
     """ Keep Controller instances updated with incoming data.
 
@@ -15,15 +21,22 @@ class SDPReceiver(object):
     convert it to the SDP structure, find out sender Controller and
     update its internal state. Finally send ACK back to the Controller.
     """
-    def __init__(self, core):
+    def __init__(self, core, rate_limit=0, rate_burst=None):
         """ SDP receiver instance.
 
         :param core: global Core instance
+        :param rate_limit: max datagrams per second from one controller
+            and source address (0 for unlimited)
+        :param rate_burst: max burst of datagrams from one controller
         """
         self._core = core
+        self._rate_limit = RateLimiter(rate_limit, rate_burst)
+        self._unknown = {}
         self._controllers = self._core.controllers()
         self._servicegroups = self._core.servicegroups()
         self._msgbus = self._core.msgbus()
+        self._msgbus.subscribe(None, 'controllers/created', self, \
+            self._on_controller_created)
 
     def new_nonce(self, controller):
         """ Set new nonce and send to the controller
@@ -39,32 +52,107 @@ class SDPReceiver(object):
     def datagram_from_controller(self, host, datagram):
         """ Process incoming datagram
 
+        Controller id is peeked from the datagram before decoding it,
+        so datagrams from unknown or rate limited controllers are
+        dropped without the full decode. Rate limit bucket is kept per
+        controller id and source address, the id is not verified yet
+        and datagrams spoofing the id must not drain the bucket of the
+        real controller. Retransmitted duplicate of
+        already processed datagram is answered with the same ACK.
+
         :param host: Host instance of the sender
-        :param datagram: datagram (str)
+        :param datagram: datagram (str or binary datagram as bytes)
         """
         log.info('datagram_from_controller(%s): %s', \
             str(host), str(datagram))
+        controller = None
+        ctrid = SDP.peek_id(datagram)
+        if ctrid:
+            if self._is_unknown(ctrid):
+                host.drop('unknown_controller')
+                return
+            if not self._rate_limit.allow((ctrid, host.get_id())):
+                log.debug('rate limit exceeded for controller: %s', ctrid)
+                host.drop('ratelimit_controller')
+                return
+            controller = self._find_controller(ctrid)
+        if isinstance(datagram, str):
+            encoded = datagram.encode('UTF-8')
+        else:
+            encoded = datagram
+        digest = hashlib.blake2b(encoded, digest_size=16).digest()
+        if controller and controller.ack_duplicate(digest, host):
+            return
+        host.mark('lookup')
         try:
-            sdp = SDP.decode(datagram)
+            sdp = SDP.decode(datagram, encoded=encoded)
         except Exception as ex:
             log.error('sdp.decode() exception: %s', str(ex))
             raise Exception('sdp.decode() exception: ' + str(ex))
 
-        ctrid = sdp.get_data('id')
+        if sdp.get_data('id') != ctrid:
+            ctrid = sdp.get_data('id')
 
-        if ctrid is None:
-            log.warning('invalid datagram, no id found!')
-            raise Exception('invalid datagram, no id found!')
+            if ctrid is None:
+                log.warning('invalid datagram, no id found!')
+                raise Exception('invalid datagram, no id found!')
 
-        controller = self._controllers.get_id(ctrid)
-        if not controller:
-            log.warning('Unknown controller: %s', ctrid)
-            raise Exception('Unknown controller')
+            controller = self._find_controller(ctrid)
+        host.mark('decode')
         log.debug('Controller: %s', str(controller))
         controller.set_host(host)
         self._check_signature(controller, sdp)
         log.debug('signature check passed')
-        controller.set_last_sdp(sdp, ts=time.time())
+        host.mark('signature')
+        controller.set_last_sdp(sdp, ts=time.time(), digest=digest)
+
+    def _is_unknown(self, ctrid):
+        """ Check if controller id is recently found to be unknown
+
+        Cached id is dropped when the controller is created in this
+        process (see _on_controller_created()), controller created by
+        another process is found after UNKNOWN_TTL.
+
+        :param ctrid: controller id
+
+        :returns: True if controller is in the negative cache
+        """
+        expires = self._unknown.get(ctrid, None)
+        if expires is None:
+            return False
+        if expires > time.time():
+            return True
+        del self._unknown[ctrid]
+        return False
+
+    def _on_controller_created(self, token, subject, message):
+        """ Drop created controller from the negative cache
+
+        :param token: message bus token
+        :param subject: message subject ("controllers/created")
+        :param message: message data with "controller" id
+        """
+        self._unknown.pop(message.get('controller', None), None)
+
+    def _find_controller(self, ctrid):
+        """ Find known controller
+
+        Unknown controller id is remembered for UNKNOWN_TTL seconds.
+
+        :param ctrid: controller id
+
+        :returns: Controller instance
+
+        :raises Exception: if controller is unknown
+        """
+        controller = self._controllers.get_id(ctrid)
+        if not controller:
+            if len(self._unknown) >= UNKNOWN_CACHE_SIZE:
+                del self._unknown[next(iter(self._unknown))]
+            self._unknown[ctrid] = time.time() + UNKNOWN_TTL
+            log.warning('Unknown controller: %s', ctrid)
+            raise Exception('Unknown controller')
+        return controller
 
     def _check_signature(self, controller, sdp):
         ctrid = controller.get_id()
@@ -107,10 +195,7 @@ class SDPReceiver(object):
             log.error('packet seq for %s is required for HMAC', ctrid)
             self.new_nonce(controller)
             raise Exception('packet seq is required for HMAC')
-        prev_seq = controller.get_seq()
-        if prev_seq:
-            if not prev_seq < seq:
-                log.error('seq is not growing for %s: needs to be > %d', ctrid, prev_seq)
-                self.new_nonce(controller)
-                raise Exception('seq is not growing')
-        controller.set_seq(seq)
+        if not controller.update_seq(seq):
+            log.error('seq is not growing for %s: %d', ctrid, seq)
+            self.new_nonce(controller)
+            raise Exception('seq is not growing')
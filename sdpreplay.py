@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+
+"""
+Replay recorded SDP datagrams against a local SDP listener
+
+Input is a capture file written by UDPCapture or a JSONL file with one
+datagram per line:
+
+    {"ts": 1450000000.123, "datagram": "id:...\\n..."}
+    {"ts": 1450000000.456, "datagram_b64": "eNo..."}
+
+Every recorded controller id is mapped to a test controller id
+(<id_prefix><number>) unless --keep_ids is given, "in" sequence numbers
+are rewritten and datagrams are signed with the test secret. Test
+controllers must exist in the server with the same secret key.
+
+Datagrams are sent with original timing (--speed=1), N times faster
+(--speed=N) or as fast as possible (--speed=0). Controllers are spread
+over --sockets source sockets. ACK round-trip time is measured for
+every acknowledged "in" sequence number.
+
+Example:
+
+    ./sdpreplay.py --input=/var/tmp/sdp.cap --speed=10 --sockets=4
+"""
+
+import sys
+import json
+import time
+import zlib
+import gzip
+import base64
+import socket
+import select
+
+from tornado.options import define, options, parse_command_line
+
+from sdp import SDP
+from udpcapture import read_capture, MAGIC
+import sdpzdict
+
+import logging
+log = logging.getLogger(__name__)
+log.addHandler(logging.NullHandler())
+
+class ReplayController(object):
+    """ State of one replayed controller """
+    def __init__(self, controllerid, sock):
+        self.id = controllerid
+        self.sock = sock
+        self.seq = 1
+        self.nonce = None
+
+def read_datagrams(filename):
+    """ Read recorded datagrams
+
+    :param filename: capture or JSONL file name
+
+    :returns: generator of (timestamp, datagram bytes) tuples
+    """
+    with open(filename, 'rb') as f:
+        is_capture = f.read(len(MAGIC)) == MAGIC
+    if is_capture:
+        for (ts, _addr, data) in read_capture(filename):
+            yield (ts, data)
+        return
+    with open(filename, 'r', encoding='UTF-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if 'datagram_b64' in record:
+                data = base64.b64decode(record['datagram_b64'])
+            else:
+                data = record['datagram'].encode('UTF-8')
+            yield (float(record.get('ts', 0)), data)
+
+def datagram_to_str(data):
+    """ Decompress datagram if needed and convert it to str
+
+    :param data: datagram (bytes)
+
+    :returns: datagram (str)
+    """
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    elif len(data) > 1 and (data[0] & 0x0f) == 8 and \
+            ((data[0] << 8) | data[1]) % 31 == 0:
+        dictid = sdpzdict.get_dictid(data)
+        if dictid is not None:
+            data = sdpzdict.decompress(data, dictid)
+        else:
+            try:
+                data = zlib.decompress(data)
+            except zlib.error:
+                pass
+    return str(data, 'UTF-8')
+
+class Replay(object):
+    """ Send datagrams to the listener and collect ACK statistics """
+    def __init__(self, addr, sockets, secret, id_prefix, keep_ids, compress):
+        """ Create replay instance
+
+        :param addr: listener (addr, port) tuple
+        :param sockets: number of source sockets
+        :param secret: secret key of test controllers
+        :param id_prefix: prefix of test controller ids
+        :param keep_ids: do not rewrite controller ids
+        :param compress: compress datagrams with the preset dictionary
+        """
+        self._addr = addr
+        self._secret = secret
+        self._id_prefix = id_prefix
+        self._keep_ids = keep_ids
+        self._compress = compress
+        self._sockets = []
+        for i in range(max(1, sockets)):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self._sockets.append(sock)
+        self._controllers = {}
+        self._by_id = {}
+        self._pending = {}
+        self._rtt = []
+        self.sent = 0
+        self.errors = 0
+        self.nonces = 0
+
+    def _get_controller(self, origid):
+        """ Return test controller for recorded controller id """
+        controller = self._controllers.get(origid, None)
+        if controller:
+            return controller
+        if self._keep_ids:
+            controllerid = origid
+        else:
+            controllerid = '%s%06d' % (self._id_prefix, len(self._controllers))
+        sock = self._sockets[len(self._controllers) % len(self._sockets)]
+        controller = ReplayController(controllerid, sock)
+        self._controllers[origid] = controller
+        self._by_id[controllerid] = controller
+        if self._secret:
+            self._bootstrap(controller)
+        return controller
+
+    def _bootstrap(self, controller):
+        """ Request nonce from the server and wait for it """
+        sdp = SDP(secret_key=self._secret, nonce='')
+        sdp += ('id', controller.id)
+        sdp += ('in', '%d,%d' % (controller.seq, int(time.time())))
+        controller.seq += 1
+        self._send(controller, sdp.encode())
+        deadline = time.time() + 2
+        while controller.nonce is None and time.time() < deadline:
+            self.poll(deadline - time.time())
+        if controller.nonce is None:
+            log.warning('no nonce for %s', controller.id)
+
+    def rewrite(self, datagram):
+        """ Rewrite recorded datagram for a test controller
+
+        :param datagram: recorded datagram (str)
+
+        :returns: (controller, datagram str, list of "in" seqs)
+        """
+        orig = SDP.decode(datagram)
+        controller = self._get_controller(orig.get_data('id'))
+        sdp = SDP(secret_key=self._secret, nonce=controller.nonce or '')
+        sdp += ('id', controller.id)
+        parts = list(orig.gen_get())
+        seqs = []
+        for part in parts:
+            if len(parts) > 1:
+                piece = SDP()
+            else:
+                piece = sdp
+            for (key, val) in part.get_data_list():
+                if key in ['id', 'in']:
+                    continue
+                piece += (key, val)
+            ts = part.get_timestamp() or int(time.time())
+            piece += ('in', '%d,%d' % (controller.seq, ts))
+            seqs.append(controller.seq)
+            controller.seq += 1
+            if piece is not sdp:
+                sdp += piece
+        return (controller, sdp.encode(), seqs)
+
+    def send(self, datagram):
+        """ Rewrite and send one recorded datagram
+
+        :param datagram: recorded datagram (bytes)
+        """
+        try:
+            (controller, data, seqs) = self.rewrite(datagram_to_str(datagram))
+        except Exception as ex:
+            log.warning('skip invalid datagram: %s', str(ex))
+            self.errors += 1
+            return
+        now = time.time()
+        for seq in seqs:
+            self._pending[(controller.id, seq)] = now
+        self._send(controller, data)
+
+    def _send(self, controller, data):
+        data = data.encode('UTF-8')
+        if self._compress:
+            compressed = sdpzdict.compress(data)
+            if len(compressed) < len(data):
+                data = compressed
+        while True:
+            try:
+                controller.sock.sendto(data, self._addr)
+                break
+            except BlockingIOError:
+                select.select([], [controller.sock], [], 1)
+        self.sent += 1
+
+    def poll(self, timeout=0):
+        """ Process received ACK and nonce datagrams
+
+        :param timeout: max seconds to wait for datagrams
+        """
+        (readable, _w, _x) = select.select(self._sockets, [], [], max(0, timeout))
+        for sock in readable:
+            while True:
+                try:
+                    (data, _addr) = sock.recvfrom(65536)
+                except BlockingIOError:
+                    break
+                self._received(data, time.time())
+
+    def _received(self, data, now):
+        try:
+            sdp = SDP.decode(datagram_to_str(data))
+        except Exception as ex:
+            log.warning('invalid datagram from server: %s', str(ex))
+            return
+        controller = self._by_id.get(sdp.get_data('id'), None)
+        if not controller:
+            return
+        nonce = sdp.get_data('nonce')
+        if nonce is not None:
+            controller.nonce = nonce
+            self.nonces += 1
+            return
+        for part in sdp.gen_get():
+            seq = part.get_in_seq()
+            sent = self._pending.pop((controller.id, seq), None)
+            if sent is not None:
+                self._rtt.append(now - sent)
+
+    def report(self, elapsed):
+        """ Return replay statistics
+
+        :param elapsed: replay duration in seconds
+
+        :returns: statistics dict
+        """
+        rtt = sorted(self._rtt)
+        r = {
+            'controllers': len(self._controllers),
+            'sent': self.sent,
+            'errors': self.errors,
+            'nonces': self.nonces,
+            'elapsed': elapsed,
+            'rate': self.sent / elapsed if elapsed else 0,
+            'acks': len(rtt),
+            'unacked': len(self._pending),
+        }
+        if rtt:
+            r['rtt_ms'] = {
+                'min': rtt[0] * 1000,
+                'avg': sum(rtt) / len(rtt) * 1000,
+                'p50': rtt[len(rtt) // 2] * 1000,
+                'p99': rtt[min(len(rtt) - 1, int(len(rtt) * 0.99))] * 1000,
+                'max': rtt[-1] * 1000,
+            }
+        return r
+
+def replay(replayer, records, speed):
+    """ Send recorded datagrams with original timing scaled by speed
+
+    :param replayer: Replay instance
+    :param records: iterable of (timestamp, datagram) tuples
+    :param speed: time scale (0 for max speed)
+
+    :returns: elapsed time in seconds
+    """
+    start = time.time()
+    first_ts = None
+    for (ts, datagram) in records:
+        if first_ts is None:
+            first_ts = ts
+        if speed > 0:
+            due = start + (ts - first_ts) / speed
+            while time.time() < due:
+                replayer.poll(due - time.time())
+        replayer.send(datagram)
+        replayer.poll()
+    return time.time() - start
+
+if __name__ == '__main__':
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO)
+    define("input", default="", help="capture or JSONL file to replay", type=str)
+    define("host", default="127.0.0.1", help="SDP listener address", type=str)
+    define("port", default=44444, help="SDP listener UDP port", type=int)
+    define("speed", default=1.0, help="time scale, 0 for max speed", type=float)
+    define("sockets", default=1, help="number of source sockets", type=int)
+    define("secret", default="secret", help="secret key of test controllers (empty for unsigned)", type=str)
+    define("id_prefix", default="replay", help="prefix of test controller ids", type=str)
+    define("keep_ids", default=False, help="keep recorded controller ids", type=bool)
+    define("compress", default=False, help="compress with the preset dictionary", type=bool)
+    define("linger", default=2.0, help="seconds to wait for ACKs after replay", type=float)
+    parse_command_line()
+    if not options.input:
+        print('--input is required', file=sys.stderr)
+        sys.exit(1)
+
+    replayer = Replay((options.host, options.port), options.sockets, \
+        options.secret, options.id_prefix, options.keep_ids, options.compress)
+    elapsed = replay(replayer, read_datagrams(options.input), options.speed)
+    deadline = time.time() + options.linger
+    while time.time() < deadline:
+        replayer.poll(deadline - time.time())
+    print(json.dumps(replayer.report(elapsed), indent=4, sort_keys=True))
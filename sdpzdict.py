@@ -0,0 +1,109 @@
+""" Preset dictionaries for zlib compressed SDP datagrams
+
+Small SDP datagrams compress poorly with plain zlib or gzip because
+there is no history to refer to. A preset dictionary with typical SDP
+content solves that.
+
+Dictionary is identified by its Adler-32 checksum which zlib writes
+into the stream header (FDICT flag and DICTID field, RFC 1950), so the
+receiver always knows which dictionary version was used. Dictionaries
+must never be changed once released, add a new version instead.
+"""
+import zlib
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'ZDICTS', 'DEFAULT_ZDICT_VERSION',
+    'get_dictid', 'get_version', 'compress', 'decompress',
+]
+
+# most frequent strings are at the end of the dictionary
+ZDICTS = {
+    1: b'psversion:emx:\n'
+       b'nonce:CUV:CUS:CSV:CSS:CIV:CIS:'
+       b'MTV:MAV:MPV:MUV:MFV:MBV:MCV:DRW:DRS:DWW:TTS:'
+       b'SFW:SFS:SRW:SRS:SWW:SWS:'
+       b'null 0 1 2 3 4 5 6 7 8 9 '
+       b'W:0 0 0 0\nW:1 0 1 0\nV:0\nV:1\nV:?\nW:?\n'
+       b'S:3\nS:2\nS:1\nS:0\n'
+       b'sha256:\nin:\nid:',
+}
+
+DEFAULT_ZDICT_VERSION = 1
+
+_DICTIDS = dict((zlib.adler32(zdict), version)
+                for (version, zdict) in ZDICTS.items())
+_DECOMPRESSORS = {}
+_COMPRESSORS = {}
+
+def get_dictid(data):
+    """ Return preset dictionary id from zlib stream header
+
+    Header must be a valid zlib stream header (deflate method, window
+    size up to 32K and CMF*256+FLG multiple of 31, RFC 1950), otherwise
+    plain text data with 0x20 bit in the second byte would look like a
+    preset dictionary stream.
+
+    :param data: received data (bytes-like)
+
+    :returns: Adler-32 of the dictionary or None if data is not a zlib
+        stream or the stream does not use a preset dictionary
+    """
+    if len(data) < 6:
+        return None
+    (cmf, flg) = (data[0], data[1])
+    if (cmf & 0x0f) != 8 or (cmf >> 4) > 7 or \
+            ((cmf << 8) | flg) % 31 != 0 or not flg & 0x20:
+        return None
+    return int.from_bytes(bytes(data[2:6]), 'big')
+
+def get_version(dictid):
+    """ Return dictionary version for dictionary id
+
+    :param dictid: Adler-32 of the dictionary
+
+    :returns: dictionary version or None if unknown
+    """
+    return _DICTIDS.get(dictid, None)
+
+def compress(data, version=DEFAULT_ZDICT_VERSION):
+    """ Compress data with the preset dictionary
+
+    :param data: data to compress (bytes-like)
+    :param version: dictionary version
+
+    :returns: compressed data (bytes)
+    """
+    if not version in _COMPRESSORS:
+        _COMPRESSORS[version] = zlib.compressobj(zlib.Z_BEST_COMPRESSION, \
+            zdict=ZDICTS[version])
+    compressor = _COMPRESSORS[version].copy()
+    return compressor.compress(data) + compressor.flush()
+
+def decompress(data, dictid):
+    """ Decompress data compressed with the preset dictionary
+
+    Decompressor is created once per dictionary and copied for every
+    datagram.
+
+    :param data: zlib compressed data (bytes-like)
+    :param dictid: dictionary id from the stream header
+
+    :returns: uncompressed data (bytes)
+
+    :raises zlib.error: if the dictionary is unknown or data is
+        corrupt
+    """
+    if not dictid in _DECOMPRESSORS:
+        version = get_version(dictid)
+        if version is None:
+            raise zlib.error('unknown preset dictionary %08x' % dictid)
+        _DECOMPRESSORS[dictid] = zlib.decompressobj(zdict=ZDICTS[version])
+    decompressor = _DECOMPRESSORS[dictid].copy()
+    data = decompressor.decompress(data)
+    if not decompressor.eof:
+        raise zlib.error('incomplete or truncated stream')
+    return data
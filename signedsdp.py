@@ -3,19 +3,39 @@
 Message datagram composition and decomposition
 according to the Uniscada Service Description Protocol.
 """
+import re
 import hmac
 import hashlib
 import base64
 
+from sdpitem import VALUES_RE
 from unsecuresdp import UnsecureSDP
+import binarysdp
 from sdpexception import SDPException, SDPDecodeException
 
 import logging
 log = logging.getLogger(__name__)   # pylint: disable=invalid-name
 log.addHandler(logging.NullHandler())
 
+SIGNATURE = 'sha256:'
+
+# str.splitlines() line boundaries other than "\n"
+LINE_BOUNDARIES = '\r\x0b\x0c\x1c\x1d\x1e'
+LINE_BOUNDARIES_UNICODE = '\x85\u2028\u2029'
+
+# max number of cached pre-keyed HMAC states
+HMAC_CACHE_SIZE = 10000
+
+# all List of Values of the batch, one per line
+VALUES_BATCH_RE = re.compile('%s(?:\n%s)*' % (VALUES_RE.pattern, VALUES_RE.pattern))
+
+# (secret_key, nonce) -> HMAC keyed with secret_key and fed with nonce
+_hmac_cache = {}
+
 class SignedSDP(UnsecureSDP):
     """ Convert to and from signed SDP protocol datagram """
+    __slots__ = ('_secret_key', '_nonce', '_csum', '_sha256', '_signed')
+
     def __init__(self, secret_key=None, nonce=None):
         """ Create a new empty in-memory ``SDP`` datagram
         """
@@ -23,6 +43,7 @@ class SignedSDP(UnsecureSDP):
         self._secret_key = secret_key
         self._nonce = nonce
         self._csum = None
+        self._sha256 = None
         if secret_key:
             self.set_secret_key(secret_key)
         if nonce:
@@ -74,10 +95,23 @@ class SignedSDP(UnsecureSDP):
             datagram += 'sha256:' + self._sha256 + '\n'
         return datagram
 
+    def encode_binary(self, controllerid=None):
+        """ Encodes SDP packet to binary datagram (see binarysdp)
+
+        :param controllerid: Optional paramater for id:<val> Data (str)
+
+        :returns: binary datagram (bytes)
+        """
+        datagram = binarysdp.encode(self, controllerid)
+        if self._secret_key:
+            self.add_signature(datagram)
+            datagram += binarysdp.signature(self._sha256)
+        return datagram
+
     def add_signature(self, datagram):
         """ Add signature to SDP instance based on datagram string
 
-        :param datagram: unsigned SDP datagram
+        :param datagram: unsigned SDP datagram (str or binary datagram)
         """
         if self._nonce == None:
             raise SDPDecodeException("nonce is required for HMAC")
@@ -88,9 +122,196 @@ class SignedSDP(UnsecureSDP):
         return
 
     @classmethod
-    def decode(cls, datagram, secret_key=None, nonce=None):
+    def decode(cls, datagram, secret_key=None, nonce=None, encoded=None, values=None):
         """ Decodes SDP datagram to packet
 
+        Signature is calculated over the original datagram up to the
+        "sha256:" line and the datagram is parsed only once. Datagrams
+        with other line endings than "\n" or with empty lines are
+        handled line by line (see _decode_lines()).
+
+        :param datagram: The string representation of SDP datagram,
+            UTF-8 encoded datagram (bytes) or binary datagram
+        :param secret_key: optional secret key for signature check
+        :param nonce: optional nonce for signature check
+        :param encoded: optional UTF-8 encoded datagram if it is
+            already known (saves encoding the signed part again)
+        :param values: optional list for deferred List of Values
+            validation (see UnsecureSDP.decode())
+        """
+        if binarysdp.is_binary(datagram):
+            return SignedSDP._decode_binary(datagram, secret_key, nonce)
+        if isinstance(datagram, bytes):
+            encoded = datagram
+            try:
+                datagram = str(encoded, 'UTF-8')
+            except UnicodeDecodeError as ex:
+                raise SDPDecodeException('datagram is not UTF-8: %s' % str(ex))
+        (signed, sha256) = SignedSDP._split_signature(datagram)
+        if signed is None:
+            return SignedSDP._decode_lines(datagram, secret_key, nonce)
+        csum = None
+        if sha256:
+            if encoded is not None and len(encoded) == len(datagram):
+                # ASCII only, str and bytes positions are the same
+                csum = SignedSDP._calculate_checksum(encoded[:len(signed)])
+            else:
+                csum = SignedSDP._calculate_checksum(signed)
+            if secret_key:
+                if not SignedSDP._check_signature(csum, sha256, secret_key, nonce):
+                    raise SDPDecodeException('signature check error')
+        sdp = UnsecureSDP.decode(signed, SignedSDP(), values)
+        if sha256:
+            sdp.set_secret_key(secret_key)
+            sdp.set_nonce(nonce)
+            sdp._sha256 = sha256
+            sdp._csum = csum
+            sdp._signed = True
+        return sdp
+
+    @staticmethod
+    def _decode_binary(datagram, secret_key=None, nonce=None):
+        """ Decodes binary SDP datagram to packet
+
+        :param datagram: binary datagram (bytes-like)
+        :param secret_key: optional secret key for signature check
+        :param nonce: optional nonce for signature check
+        """
+        (sdp, signed, sha256) = binarysdp.decode(datagram, SignedSDP())
+        if sha256:
+            csum = SignedSDP._calculate_checksum(signed)
+            if secret_key:
+                if not SignedSDP._check_signature(csum, sha256, secret_key, nonce):
+                    raise SDPDecodeException('signature check error')
+            sdp.set_secret_key(secret_key)
+            sdp.set_nonce(nonce)
+            sdp._sha256 = sha256
+            sdp._csum = csum
+            sdp._signed = True
+        return sdp
+
+    @staticmethod
+    def peek_id(datagram):
+        """ Find controller id from the datagram without decoding it
+
+        :param datagram: The string representation of SDP datagram
+            or binary datagram
+
+        :returns: controller id or None if it is not found
+        """
+        if binarysdp.is_binary(datagram):
+            return binarysdp.peek_id(datagram)
+        return UnsecureSDP.peek_id(datagram)
+
+    @classmethod
+    def decode_many(cls, datagrams, secret_key=None, nonce=None):
+        """ Decodes many SDP datagrams at once
+
+        List of Values of all datagrams are collected during decoding
+        and validated with one regular expression match over the whole
+        batch. Only if the batch check fails, datagrams with invalid
+        values are decoded again one by one to get the exact error.
+        Errors do not stop decoding of the other datagrams.
+
+        :param datagrams: sequence of datagrams (str or bytes)
+        :param secret_key: optional secret key for signature check
+        :param nonce: optional nonce for signature check
+
+        :returns: (sdps, errors) tuple, list of SDP instances (None for
+            failed datagram) in the same order as datagrams and list of
+            (index, SDPException) tuples
+        """
+        sdps = []
+        errors = []
+        values = []
+        owners = []
+        failed = []
+        for (i, datagram) in enumerate(datagrams):
+            start = len(values)
+            try:
+                sdps.append(cls.decode(datagram, secret_key, nonce, values=values))
+            except SDPException as ex:
+                sdps.append(None)
+                if len(values) > start:
+                    # unchecked values may hide the first error
+                    del values[start:]
+                    failed.append(i)
+                else:
+                    errors.append((i, ex))
+                continue
+            owners.extend([i] * (len(values) - start))
+        if values and not VALUES_BATCH_RE.fullmatch('\n'.join(values)):
+            failed += [owners[j] for (j, val) in enumerate(values)
+                       if not VALUES_RE.fullmatch(val)]
+        if failed:
+            for i in sorted(set(failed)):
+                try:
+                    sdps[i] = cls.decode(datagrams[i], secret_key, nonce)
+                except SDPException as ex:
+                    sdps[i] = None
+                    errors.append((i, ex))
+            errors.sort(key=lambda error: error[0])
+        return (sdps, errors)
+
+    @staticmethod
+    def _split_signature(datagram):
+        """ Split canonical datagram to signed part and signature
+
+        :param datagram: The string representation of SDP datagram
+
+        :returns: (signed part, signature) tuple, signature is None
+            if datagram is not signed and both are None if datagram
+            is not in canonical form
+        """
+        if not SignedSDP._is_canonical(datagram):
+            return (None, None)
+        if datagram.startswith(SIGNATURE):
+            pos = 0
+        else:
+            pos = datagram.find('\n' + SIGNATURE) + 1
+            if pos == 0:
+                if SIGNATURE in datagram:
+                    return (None, None)
+                return (datagram, None)
+        start = pos + len(SIGNATURE)
+        end = datagram.find('\n', start)
+        if end < 0:
+            end = len(datagram)
+        elif end + 1 != len(datagram):
+            # data after signature
+            return (None, None)
+        sha256 = datagram[start:end]
+        if not sha256 or ':' in sha256:
+            return (None, None)
+        return (datagram[:pos], sha256)
+
+    @staticmethod
+    def _is_canonical(datagram):
+        """ Check if datagram is exactly the same as the one rebuilt
+        from its non-empty lines
+
+        :param datagram: The string representation of SDP datagram
+
+        :returns: False if datagram has empty lines or other line
+            boundaries than "\n"
+        """
+        if datagram[:1] == '\n' or '\n\n' in datagram:
+            return False
+        for char in LINE_BOUNDARIES:
+            if char in datagram:
+                return False
+        if not datagram.isascii():
+            for char in LINE_BOUNDARIES_UNICODE:
+                if char in datagram:
+                    return False
+        return True
+
+    @staticmethod
+    def _decode_lines(datagram, secret_key=None, nonce=None):
+        """ Decodes SDP datagram to packet line by line
+
+        Signed part is rebuilt from non-empty lines.
+
         :param datagram: The string representation of SDP datagram
         """
         datagram_before_sig = ''
@@ -144,11 +365,13 @@ class SignedSDP(UnsecureSDP):
     def _calculate_checksum(datagram):
         """ Return checksum for given datagram
 
-        :param datagram: unsigned datagram
+        :param datagram: unsigned datagram (str or UTF-8 encoded bytes)
 
         :returns: BASE64 encoded checksum
         """
-        return base64.b64encode(hashlib.sha256(datagram.encode("UTF-8")).digest()).decode()
+        if isinstance(datagram, str):
+            datagram = datagram.encode("UTF-8")
+        return base64.b64encode(hashlib.sha256(datagram).digest()).decode()
 
     @staticmethod
     def _calculate_signature(checksum, secret_key, nonce):
@@ -168,10 +391,40 @@ class SignedSDP(UnsecureSDP):
             log.error('nonce is missing')
             raise SDPDecodeException('checksum exists but ' \
                 'nonce is missing')
-        return base64.b64encode( \
-            hmac.new(secret_key.encode("UTF-8"), \
-                msg=nonce.encode("UTF-8")+checksum.encode("UTF-8"), \
-                digestmod=hashlib.sha256).digest()).decode()
+        mac = SignedSDP._keyed_hmac(secret_key, nonce).copy()
+        mac.update(checksum.encode("UTF-8"))
+        return base64.b64encode(mac.digest()).decode()
+
+    @staticmethod
+    def _keyed_hmac(secret_key, nonce):
+        """ Return cached HMAC state for secret key and nonce
+
+        HMAC key pads are derived and the nonce is fed only once per
+        (secret_key, nonce) pair, callers must use a copy() of the
+        returned state.
+
+        :param secret_key: secret key
+        :param nonce: nonce
+
+        :returns: hmac.HMAC instance
+        """
+        mac = _hmac_cache.get((secret_key, nonce), None)
+        if mac is None:
+            if len(_hmac_cache) >= HMAC_CACHE_SIZE:
+                del _hmac_cache[next(iter(_hmac_cache))]
+            mac = hmac.new(secret_key.encode("UTF-8"), \
+                msg=nonce.encode("UTF-8"), digestmod=hashlib.sha256)
+            _hmac_cache[(secret_key, nonce)] = mac
+        return mac
+
+    @staticmethod
+    def forget_key(secret_key, nonce):
+        """ Remove cached HMAC state of rotated secret key or nonce
+
+        :param secret_key: secret key
+        :param nonce: nonce
+        """
+        _hmac_cache.pop((secret_key, nonce), None)
 
     def __str__(self):
         """ Returns data dictionary """
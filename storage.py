@@ -7,6 +7,16 @@ import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
+# set hash field only if the current value is missing, zero or smaller
+HSET_IF_GREATER = """
+local cur = tonumber(redis.call('HGET', KEYS[1], ARGV[1]))
+if cur and cur ~= 0 and cur >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+return 1
+"""
+
 class Storage(object):
     ''' Redis helper '''
     def __init__(self, host='localhost', port=6379, db=0, password=None):
@@ -46,6 +56,19 @@ class Storage(object):
         rval = json.dumps(data)
         self.hset(rhash, rfield, rval)
 
+    def hset_if_greater(self, rhash, rfield, rval):
+        """ Atomically set integer field if the new value is greater
+
+        Missing or zero field is always set.
+
+        :returns: True if the field was set
+        """
+        try:
+            return bool(self._redis.eval(HSET_IF_GREATER, 1, rhash, rfield, rval))
+        except Exception as ex:
+            log.warning('HSET_IF_GREATER(%s, %s, %s) error: %s', rhash, rfield, rval, str(ex))
+            return False
+
     def hget(self, rhash, rfield):
         try:
             rval = self._redis.hget(rhash, rfield)
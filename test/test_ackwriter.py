@@ -0,0 +1,88 @@
+import unittest
+import random
+
+from sdp import SDP
+from sdppacker import SDPPacker
+from ackwriter import AckWriter
+from sdpexception import SDPException
+
+def packer_ack(controllerid, ins, registers, max_size, secret_key, nonce):
+    ''' ACK built by SDPPacker '''
+    packer = SDPPacker(controllerid, max_size=max_size, \
+        secret_key=secret_key, nonce=nonce)
+    for inn in ins:
+        packer.add_piece(inn)
+    for (reg, val) in registers:
+        packer.add_keyvalue(reg, val)
+    return [datagram.encode('UTF-8') for datagram in packer.encode()]
+
+class AckWriterTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.ackwriter module
+    '''
+    def test_ack(self):
+        ''' Test simple ACK '''
+        writer = AckWriter('abc123')
+        registers = [AckWriter.register('ABV', 5), AckWriter.register('AAS', 1)]
+        self.assertEqual(writer.write(['1,1440871960'], registers), \
+            [b'id:abc123\nin:1,1440871960\nAAS:1\nABV:5\n'])
+        self.assertEqual(writer.write([], []), [b'id:abc123\n'])
+        datagram = writer.write(['1,1440871960'], registers, 'secret', '12345')[0]
+        sdp = SDP.decode(datagram, 'secret', '12345')
+        self.assertTrue(sdp.check_signature())
+
+    def test_register(self):
+        ''' Test register line encoding and validation '''
+        self.assertEqual(AckWriter.register('ABW', [1, None]), \
+            ('ABW', 3, len('ABW:1 null\n'), b'ABW:1 null\n'))
+        self.assertEqual(AckWriter.register('ABV', '?')[3], b'ABV:?\n')
+        with self.assertRaises(SDPException):
+            AckWriter.register('ABS', 5)
+        with self.assertRaises(SDPException):
+            AckWriter.register('sha256', 'x')
+
+    def test_same_as_packer(self):
+        ''' Test ACK is the same as built by SDPPacker '''
+        rnd = random.Random(1)
+        values = [('S', 0), ('S', 3), ('V', 1), ('V', 'abc'), ('V', 1.5),
+                  ('W', [1, 2, 3]), ('W', '4 null'), ('F', '4000D3349FEBBEAE'),
+                  ('', 'data'), ('V', '?'), ('W', '?')]
+        for _ in range(500):
+            ins = ['%d,%d' % (i, 1440871960 + i) for i in range(rnd.randint(0, 4))]
+            registers = []
+            for i in range(rnd.randint(0, 40)):
+                (suffix, val) = rnd.choice(values)
+                registers.append(('R%02d%s' % (rnd.randint(0, 20), suffix), val))
+            registers = list(dict(registers).items())
+            max_size = rnd.choice([60, 100, 200, 1000])
+            (secret_key, nonce) = rnd.choice([(None, None), ('secret', '12345')])
+            writer = AckWriter('abc123', max_size=max_size)
+            self.assertEqual(
+                writer.write(ins, [AckWriter.register(reg, val) for (reg, val) in registers],
+                             secret_key, nonce),
+                packer_ack('abc123', ins, registers, max_size, secret_key, nonce))
+
+    def test_in_without_timestamp(self):
+        ''' Test "in" without timestamp in text and binary ACK '''
+        registers = [('AAS', 1), ('ABV', 2)]
+        for ins in (['1,1440871960', '2,1440871961'], ['1'], ['1', '2'],
+                    ['1,1440871960', '2'], ['2,1440871961', '1,1440871960']):
+            writer = AckWriter('abc123')
+            try:
+                text = writer.write(ins, [AckWriter.register(reg, val) for (reg, val) in registers])
+            except SDPException:
+                text = None
+            packer = SDPPacker('abc123')
+            for inn in ins:
+                packer.add_piece(inn)
+            for (reg, val) in registers:
+                packer.add_keyvalue(reg, val)
+            try:
+                binary = [SDP.decode(datagram).encode().encode('UTF-8')
+                          for datagram in packer.encode(binary=True)]
+            except SDPException:
+                binary = None
+            self.assertEqual(text, binary, ins)
+        self.assertEqual(writer.write(['1'], []), [b'id:abc123\nin:1\n'])
+        with self.assertRaises(SDPException):
+            writer.write(['1', '2'], [])
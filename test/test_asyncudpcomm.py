@@ -0,0 +1,64 @@
+import unittest
+import socket
+import asyncio
+from mock import Mock
+
+import tornado.ioloop
+
+from hosts import Hosts
+from asyncudpcomm import AsyncUDPComm
+
+class AsyncUDPCommTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.asyncudpcomm module
+    '''
+    def setUp(self):
+        self.io_loop = tornado.ioloop.IOLoop.instance()
+        self.handler = Mock()
+        self.core = Mock()
+        self.core.hosts = Mock(return_value=Hosts())
+        self.udpcomm = AsyncUDPComm('127.0.0.1', 0, self.handler, self.core, recv_budget=3)
+        self.server = self.udpcomm._sock.getsockname()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(('127.0.0.1', 0))
+        self.client.settimeout(1)
+
+    def tearDown(self):
+        self.udpcomm.close()
+        self.client.close()
+
+    def _run(self, seconds=0.1):
+        self.io_loop.run_sync(lambda: asyncio.sleep(seconds))
+
+    def test_receive(self):
+        ''' Test receiving datagrams in batches '''
+        self._run(0)
+        for i in range(5):
+            self.client.sendto(('id:%d\n' % i).encode(), self.server)
+        self._run()
+        datagrams = [c[0][1] for c in self.handler.call_args_list]
+        self.assertListEqual(datagrams, ['id:%d\n' % i for i in range(5)])
+        stats = self.udpcomm.get_stats()
+        self.assertEqual(stats['rx']['datagrams'], 5)
+        self.assertTrue(stats['rx']['wakeups'] <= 5)
+
+    def test_send(self):
+        ''' Test sending reply via transport and queueing before it '''
+        addr = self.client.getsockname()
+        self.assertIsNone(self.udpcomm._send(Mock(), addr, 'id:1\n'))
+        self._run(0)
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:1\n')
+        self.assertEqual(self.udpcomm._send(Mock(), addr, 'id:2\n'), 5)
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:2\n')
+
+    def test_paused(self):
+        ''' Test queueing datagrams while transport is paused '''
+        self._run(0)
+        addr = self.client.getsockname()
+        self.udpcomm._pause_writing()
+        self.udpcomm._send(Mock(), addr, 'id:1\nin:1\n', coalesce='1')
+        self.udpcomm._send(Mock(), addr, 'id:1\nin:2\n', coalesce='1')
+        self.assertEqual(len(self.udpcomm._send_queue), 1)
+        self.udpcomm._resume_writing()
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:1\nin:2\n')
+        self.assertEqual(len(self.udpcomm._send_queue), 0)
@@ -1,7 +1,18 @@
 import unittest
 import time
+from mock import Mock
 
-from controller import Controller
+from controller import Controller, DUPLICATE_WINDOW
+from controllers import Controllers
+from sdp import SDP
+from udpcomm import MAX_SDP_SIZE
+
+def signed_sdp(datagram):
+    ''' Return decoded signed SDP '''
+    sdp = SDP.decode(datagram)
+    sdp.set_secret_key('secret')
+    sdp.set_nonce('1')
+    return SDP.decode(sdp.encode(), 'secret', '1')
 
 class ControllerTests(unittest.TestCase):
     '''
@@ -38,3 +49,165 @@ class ControllerTests(unittest.TestCase):
         self.controller.set_state_reg('DEF', 'abc', ts=200)
         self.controller.set_state_reg('GHI', [4, 5, 6], ts=300)
         self.assertListEqual(sorted(list(self.controller.get_state_register_list())), [('ABC', 123, 100), ('DEF', 'abc', 200), ('GHI', [4, 5, 6], 300)])
+
+    def test_ack_duplicate(self):
+        ''' Test resending remembered ACK for duplicate datagram '''
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=False)
+        self.controller._host = host
+        sdp = signed_sdp('id:123\nin:1,100\n')
+        self.assertFalse(self.controller.ack_duplicate(b'digest', host))
+        self.controller.ack_sdp(sdp, digest=b'digest')
+        ack = host.send.call_args[0][0]
+        self.assertFalse(self.controller.ack_duplicate(b'digest', Mock()))
+        self.assertTrue(self.controller.ack_duplicate(b'digest', host))
+        self.assertEqual(host.send.call_count, 2)
+        self.assertEqual(host.send.call_args[0][0], ack)
+        self.controller.set_nonce('1')
+        self.assertFalse(self.controller.ack_duplicate(b'digest', host))
+
+    def test_ack_duplicate_retransmission_only(self):
+        ''' Test ACK is not remembered for unsigned or "in"-less datagram '''
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=False)
+        self.controller._host = host
+        self.controller.ack_sdp(SDP.decode('id:123\nin:1,100\n'), digest=b'unsigned')
+        self.assertFalse(self.controller.ack_duplicate(b'unsigned', host))
+        self.controller.ack_sdp(signed_sdp('id:123\nAAS:1\n'), digest=b'report')
+        self.assertFalse(self.controller.ack_duplicate(b'report', host))
+
+    def test_set_nonce_forgets_hmac(self):
+        ''' Test cached HMAC state is dropped when nonce changes '''
+        storage = Mock()
+        storage.hget_data = Mock(return_value={'secret_key': 'secret'})
+        self.controller.set_storage(storage)
+        self.controller.set_nonce('1')
+        mac = SDP._keyed_hmac('secret', '1')
+        self.controller.set_nonce('2')
+        self.assertIsNot(SDP._keyed_hmac('secret', '1'), mac)
+
+    def test_nonce_storage(self):
+        ''' Test nonce is read from the storage only if it is shared '''
+        storage = Mock()
+        storage.hget = Mock(return_value='2')
+        self.controller.set_storage(storage)
+        self.controller.set_nonce('1')
+        self.assertEqual(self.controller.get_nonce(), '1')
+        storage.hget.assert_not_called()
+        storage.hset.assert_not_called()
+        controller = Controllers(storage=storage, shared=True).find_by_id('456')
+        controller.set_nonce('1')
+        storage.hset.assert_called_with('controllers/nonce', '456', '1')
+        self.assertEqual(controller.get_nonce(), '2')
+
+    def test_ack_duplicate_shared(self):
+        ''' Test duplicate is answered without storage round trip '''
+        storage = Mock()
+        storage.hget = Mock(return_value='1')
+        storage.hget_data = Mock(return_value={'secret_key': 'secret'})
+        controller = Controllers(storage=storage, shared=True).find_by_id('456')
+        controller._publish = Mock()
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=False)
+        controller._host = host
+        controller.ack_sdp(signed_sdp('id:456\nin:1,100\n'), digest=b'digest')
+        storage.reset_mock()
+        self.assertTrue(controller.ack_duplicate(b'digest', host))
+        self.assertEqual(storage.mock_calls, [])
+        controller.set_setup({'secret_key': 'other'})
+        self.assertFalse(controller.ack_duplicate(b'digest', host))
+
+    def test_update_seq(self):
+        ''' Test seq is set only if it is growing '''
+        storage = Mock()
+        storage.hget = Mock(return_value=None)
+        self.controller.set_storage(storage)
+        self.assertTrue(self.controller.update_seq(5))
+        storage.hset.assert_called_with('controllers/seq', '123', 5)
+        storage.hget = Mock(return_value='5')
+        self.assertFalse(self.controller.update_seq(5))
+        self.assertTrue(self.controller.update_seq(6))
+        storage.hset_if_greater.assert_not_called()
+
+    def test_update_seq_shared(self):
+        ''' Test seq check and set is atomic with shared storage '''
+        storage = Mock()
+        storage.hset_if_greater = Mock(side_effect=[True, False])
+        controller = Controllers(storage=storage, shared=True).find_by_id('456')
+        self.assertTrue(controller.update_seq(5))
+        self.assertFalse(controller.update_seq(5))
+        storage.hset_if_greater.assert_called_with('controllers/seq', '456', 5)
+        storage.hget.assert_not_called()
+
+    def test_ack_followups(self):
+        ''' Test send queue not fitting to ACK is sent in follow-ups '''
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=False)
+        self.controller._host = host
+        for i in range(200):
+            self.controller.send_queue_add_reg_val('R%03dV' % i, 100000 + i)
+        sdp = signed_sdp('id:123\nin:1,100\n')
+        self.controller.ack_sdp(sdp, digest=b'digest')
+        datagrams = [call[0][0] for call in host.send.call_args_list]
+        self.assertTrue(len(datagrams) > 1)
+        regs = []
+        for datagram in datagrams:
+            self.assertTrue(len(datagram) <= MAX_SDP_SIZE)
+            regs += [reg for (reg, val) in SDP.decode(datagram).get_data_list()
+                     if reg not in ['id', 'in']]
+        self.assertEqual(len(regs), 200)
+        self.assertEqual(SDP.decode(datagrams[0]).get_data('in'), '1,100')
+        self.assertEqual(host.send.call_args_list[0][1]['coalesce'], '123')
+        self.assertEqual(host.send.call_args_list[1][1]['coalesce'], ('123', 1))
+        self.assertTrue(self.controller.ack_duplicate(b'digest', host))
+        self.assertEqual(host.send.call_count, 2 * len(datagrams))
+
+    def test_ack_binary(self):
+        ''' Test ACK is binary if controller sends binary datagrams '''
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=True)
+        self.controller._host = host
+        self.controller.send_queue_add_reg_val('ABV', 1)
+        sdp = SDP.decode('id:123\nin:1,100\n')
+        self.controller.ack_sdp(sdp)
+        datagram = host.send.call_args[0][0]
+        self.assertTrue(isinstance(datagram, bytes))
+        ack = SDP.decode(datagram)
+        self.assertEqual(ack.get_data('in'), '1,100')
+        self.assertEqual(ack.get_data('ABV'), '1')
+
+    def test_ack_duplicate_window(self):
+        ''' Test only last ACKs are remembered '''
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=False)
+        self.controller._host = host
+        sdp = signed_sdp('id:123\nin:1,100\n')
+        for i in range(DUPLICATE_WINDOW + 1):
+            self.controller.ack_sdp(sdp, digest=i)
+        self.assertFalse(self.controller.ack_duplicate(0, host))
+        self.assertTrue(self.controller.ack_duplicate(1, host))
+        self.controller.send_queue_add_reg_val('ABC', 1)
+        self.assertFalse(self.controller.ack_duplicate(1, host))
+
+    def test_ack_duplicate_send_queue_remove(self):
+        ''' Test ACKs are forgotten when register leaves the send queue '''
+        host = Mock()
+        host.send = Mock(return_value=None)
+        host.is_binary = Mock(return_value=False)
+        self.controller._host = host
+        self.controller.send_queue_add_reg_val('ABV', 1)
+        self.controller.send_queue_add_reg_val('ACV', 2)
+        self.controller.ack_sdp(signed_sdp('id:123\nin:1,100\n'), digest=b'digest')
+        self.controller.send_queue_remove_reg('ABV', 1)
+        self.assertFalse(self.controller.ack_duplicate(b'digest', host))
+        self.controller.ack_sdp(signed_sdp('id:123\nin:2,101\n'), digest=b'digest')
+        for _ in range(11):
+            self.controller.send_queue_remove_reg('ACV', 3)
+        self.assertEqual(self.controller._send_queue, {})
+        self.assertFalse(self.controller.ack_duplicate(b'digest', host))
@@ -1,4 +1,5 @@
 import unittest
+from mock import Mock
 
 from controllers import Controllers
 from controller import Controller
@@ -27,3 +28,43 @@ class ControllersTests(unittest.TestCase):
         id2 = self.controllers.find_by_id('B')
         id3 = self.controllers.find_by_id('C')
         self.assertEqual(sorted(self.controllers.get_id_list()), ['A', 'B', 'C'])
+
+    def test_shared_storage_lookup(self):
+        ''' Test picking up controller created by another process '''
+        storage = Mock()
+        storage.sismember = Mock(side_effect=lambda key, id: id == 'A')
+        core = Mock()
+        controllers = Controllers(storage=storage, key='controllers', core=core, shared=True)
+        self.assertIsNone(controllers.get_id('B'))
+        controller = controllers.get_id('A')
+        self.assertTrue(isinstance(controller, Controller))
+        self.assertEqual(controller.get_id(), 'A')
+        self.assertEqual(controllers.get_id('A'), controller)
+
+    def test_not_shared_storage_lookup(self):
+        ''' Test storage is not used for lookup if not shared '''
+        storage = Mock()
+        storage.sismember = Mock(return_value=True)
+        controllers = Controllers(storage=storage, key='controllers')
+        self.assertIsNone(controllers.get_id('A'))
+        storage.sismember.assert_not_called()
+
+    def test_shared_storage_listing(self):
+        ''' Test listing controllers created by other processes '''
+        storage = Mock()
+        storage.smembers = Mock(return_value=iter(['A', 'B']))
+        controllers = Controllers(storage=storage, key='controllers', core=Mock(), shared=True)
+        controllers.find_by_id('C')
+        self.assertEqual(sorted(controllers.get_id_list()), ['A', 'B', 'C'])
+        storage.smembers.assert_called_once_with('controllers')
+        controllers = Controllers(storage=storage, key='controllers')
+        controllers.find_by_id('C')
+        self.assertEqual(list(controllers.get_id_list()), ['C'])
+
+    def test_created_published(self):
+        ''' Test creation of a new controller is published '''
+        core = Mock()
+        controllers = Controllers(core=core)
+        controllers.find_by_id('A')
+        controllers.find_by_id('A')
+        core.msgbus().publish.assert_called_once_with('controllers/created', {'controller': 'A'})
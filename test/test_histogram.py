@@ -0,0 +1,61 @@
+import unittest
+
+from histogram import Histogram, LatencyStats
+
+class HistogramTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.histogram module
+    '''
+    def setUp(self):
+        self.histogram = Histogram()
+
+    def test_empty(self):
+        ''' Test empty histogram '''
+        self.assertDictEqual(self.histogram.get(), {'count': 0})
+        self.assertIsNone(self.histogram.percentile(50))
+
+    def test_small_values(self):
+        ''' Test values with exact buckets '''
+        for value in range(1, 11):
+            self.histogram.record(value)
+        r = self.histogram.get()
+        self.assertEqual(r['count'], 10)
+        self.assertEqual(r['min'], 1)
+        self.assertEqual(r['max'], 10)
+        self.assertEqual(r['mean'], 5.5)
+        self.assertEqual(r['p50'], 5)
+        self.assertEqual(r['p90'], 9)
+        self.assertEqual(r['p99'], 10)
+
+    def test_precision(self):
+        ''' Test relative error of big values '''
+        for value in [33, 1000, 123456, 10**9]:
+            self.histogram.reset()
+            self.histogram.record(value)
+            self.histogram.record(value * 2)
+            p50 = self.histogram.percentile(50)
+            self.assertTrue(value <= p50 <= value * 1.07, (value, p50))
+            self.assertEqual(self.histogram.percentile(100), value * 2)
+
+    def test_buckets(self):
+        ''' Test bucket index and value are consistent '''
+        for value in range(0, 5000):
+            index = Histogram._index(value)
+            self.assertTrue(value <= Histogram._value(index))
+            if index:
+                self.assertTrue(value > Histogram._value(index - 1))
+
+    def test_latency_stats(self):
+        ''' Test recording latency to stage and parent histograms '''
+        parent = LatencyStats()
+        latency = LatencyStats(parent)
+        latency.record('decode', 0.000010)
+        latency.record('decode', 0.000020)
+        latency.record('total', 0.001)
+        r = latency.get()
+        self.assertEqual(r['decode']['count'], 2)
+        self.assertEqual(r['decode']['max'], 20)
+        self.assertEqual(r['total']['min'], 1000)
+        self.assertEqual(parent.get()['decode']['count'], 2)
+        latency.reset()
+        self.assertEqual(latency.get()['decode']['count'], 0)
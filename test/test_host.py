@@ -1,7 +1,14 @@
 import unittest
+import time
+import zlib
+import gzip
+import json
+import base64
 from mock import Mock
 
 from host import Host
+import sdpzdict
+from sdp import SDP
 
 class HostTests(unittest.TestCase):
     '''
@@ -23,6 +30,143 @@ class HostTests(unittest.TestCase):
         self.host.receiver(b'message')
         receiver.assert_called_once_with(self.host, 'message')
 
+    def test_receiver_gzip(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        self.host.receiver(gzip.compress(b'id:abc\n'))
+        receiver.assert_called_once_with(self.host, 'id:abc\n')
+        self.assertEqual(self.host.get_stats()['rx']['packets_compressed_gzip'], 1)
+
+    def test_receiver_zlib(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        for level in [1, 6, 9]:
+            self.host.receiver(zlib.compress(b'id:abc\n', level))
+        self.assertEqual(receiver.call_count, 3)
+        receiver.assert_called_with(self.host, 'id:abc\n')
+        self.assertEqual(self.host.get_stats()['rx']['packets_compressed_zlib'], 3)
+
+    def test_receiver_plain_no_zlib_probe(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        self.host.receiver(b'id:abc\n')
+        receiver.assert_called_once_with(self.host, 'id:abc\n')
+        stats = self.host.get_stats()['rx']
+        self.assertEqual(stats['compression_probe']['zlib_avoided'], 1)
+        self.assertFalse('packets_compressed_zlib' in stats)
+
+    def test_receiver_zlib_header_false_positive(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        self.host.receiver(b'x^abc')
+        receiver.assert_called_once_with(self.host, 'x^abc')
+        stats = self.host.get_stats()['rx']
+        self.assertEqual(stats['compression_probe']['zlib_false_positive'], 1)
+
+    def test_receiver_plain_then_zlib(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        for i in range(20):
+            self.host.receiver(b'id:abc\n')
+        stats = self.host.get_stats()['rx']
+        self.assertEqual(stats['compression_probe']['zlib_avoided'], 20)
+        self.host.receiver(zlib.compress(b'id:def\n'))
+        receiver.assert_called_with(self.host, 'id:def\n')
+
+    def test_receiver_zdict(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        self.host.receiver(sdpzdict.compress(b'id:abc\nin:1\nAAS:1\n'))
+        receiver.assert_called_once_with(self.host, 'id:abc\nin:1\nAAS:1\n')
+        self.assertEqual(self.host.get_stats()['rx']['packets_compressed_zdict'], 1)
+
+    def test_receiver_zdict_unknown(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        compressor = zlib.compressobj(zdict=b'unknown dictionary')
+        self.host.receiver(compressor.compress(b'id:abc\n') + compressor.flush())
+        receiver.assert_not_called()
+        self.assertEqual(self.host.get_stats()['rx']['errors'], 1)
+
+    def test_receiver_zdict_header_false_positive(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        # "hb" is a valid zlib header with FDICT flag set
+        self.assertTrue(sdpzdict.get_dictid(b'hb:123\nid:abc\n') is not None)
+        self.host.receiver(b'hb:123\nid:abc\n')
+        receiver.assert_called_once_with(self.host, 'hb:123\nid:abc\n')
+        stats = self.host.get_stats()['rx']
+        self.assertEqual(stats['compression_probe']['zdict_false_positive'], 1)
+        self.assertFalse('errors' in stats)
+
+    def test_receiver_binary(self):
+        receiver = Mock()
+        self.host.set_receiver(receiver)
+        datagram = SDP.decode('id:abc\nAAS:1\n').encode_binary()
+        self.host.receiver(memoryview(datagram))
+        receiver.assert_called_once_with(self.host, datagram)
+        self.assertTrue(isinstance(receiver.call_args[0][1], bytes))
+        self.assertTrue(self.host.is_binary())
+        self.host.receiver(sdpzdict.compress(datagram))
+        receiver.assert_called_with(self.host, datagram)
+        stats = self.host.get_stats()['rx']
+        self.assertEqual(stats['packets_binary'], 2)
+        self.assertFalse('compression_probe' in stats)
+        self.host.receiver(b'id:abc\n')
+        self.assertFalse(self.host.is_binary())
+
+    def test_stats_binary(self):
+        ''' Test statistics of binary host can be encoded to JSON '''
+        datagram = SDP.decode('id:abc\nAAS:1\n').encode_binary()
+        self.host.set_receiver(Mock())
+        self.host.set_sender(Mock())
+        self.host.receiver(datagram)
+        self.host.set_receiver(Mock(side_effect=Exception('error')))
+        self.host.receiver(datagram)
+        self.host.send(datagram)
+        stats = self.host.get_stats()
+        for direction in ['rx/last', 'rx/last_error', 'tx/last']:
+            (first, second) = direction.split('/')
+            self.assertEqual(base64.b64decode(stats[first][second]['datagram_raw_b64']), datagram)
+        def check(data):
+            for val in data.values():
+                if isinstance(val, dict):
+                    check(val)
+                elif isinstance(val, bytes):
+                    val.decode('UTF-8')
+        check(stats)
+        try:
+            from resthandler import JSONBinEncoder
+        except ImportError:
+            return
+        json.dumps(stats, cls=JSONBinEncoder)
+
+    def test_sender_zdict(self):
+        sender = Mock()
+        self.host.set_sender(sender)
+        self.host.set_addr('addr')
+        message = 'id:000000000001\nin:12,1440871960\nSFW:1 0 1 0\n' \
+            'SRW:1 0 1 0\nSWW:1 0 1 0\nsha256:Z/91VAs43GlbSHZVIzaqXSLKpunjLYPQfnhpHEvzYys=\n'
+        self.host.send(message, compress=True)
+        sender.assert_called_with(self.host, 'addr', message.encode())
+        self.host.set_receiver(Mock())
+        self.host.receiver(sdpzdict.compress(b'id:abc\n'))
+        self.host.send(message, compress=True)
+        data = sender.call_args[0][2]
+        self.assertTrue(len(data) < len(message))
+        self.assertEqual(sdpzdict.decompress(data, sdpzdict.get_dictid(data)), message.encode())
+        self.host.send(message)
+        sender.assert_called_with(self.host, 'addr', message.encode())
+
+    def test_get_dictid(self):
+        ''' Test preset dictionary id is found only from zlib header '''
+        data = sdpzdict.compress(b'id:abc\n')
+        self.assertEqual(sdpzdict.get_version(sdpzdict.get_dictid(data)), 1)
+        self.assertEqual(sdpzdict.get_dictid(zlib.compress(b'id:abc\n')), None)
+        self.assertEqual(sdpzdict.get_dictid(b'id:abc\nin:1,1\n'), None)
+        self.assertEqual(sdpzdict.get_dictid(b'nonce:12345\n'), None)
+        self.assertEqual(sdpzdict.get_dictid(b'\x78\x20'), None)
+
     def test_missing_sender(self):
         self.host.send('message')
 
@@ -33,6 +177,33 @@ class HostTests(unittest.TestCase):
         self.host.send('message')
         sender.assert_called_once_with(self.host, 'addr', b'message')
 
+    def test_sender_coalesce(self):
+        sender = Mock()
+        self.host.set_sender(sender)
+        self.host.set_addr('addr')
+        self.host.send('message', coalesce='id')
+        sender.assert_called_once_with(self.host, 'addr', b'message', coalesce='id')
+
+    def test_drop(self):
+        self.host.drop('reason')
+        self.host.drop('reason')
+        self.assertEqual(self.host.get_stats()['rx']['dropped']['reason'], 2)
+
+    def test_latency(self):
+        sender = Mock()
+        self.host.set_sender(sender)
+        def receiver(host, data):
+            host.mark('decode')
+            self.assertIsNotNone(host.send('ack'))
+        self.host.set_receiver(receiver)
+        self.host.receiver(b'id:abc\n', time.perf_counter())
+        latency = self.host.get_stats()['latency_us']
+        for stage in ['queue', 'decompress', 'decode', 'send', 'total']:
+            self.assertEqual(latency[stage]['count'], 1)
+        self.assertIsNone(self.host.send('message'))
+        self.host.receiver(b'id:abc\n')
+        self.assertEqual(self.host.get_stats()['latency_us']['total']['count'], 1)
+
     def test_remove_independent_instance(self):
         self.host._remove()
 
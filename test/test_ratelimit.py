@@ -0,0 +1,40 @@
+import unittest
+
+from ratelimit import RateLimiter
+
+class RateLimiterTests(unittest.TestCase):
+    '''
+    This is the unittest for the ratelimit module
+    '''
+    def test_disabled(self):
+        ''' Test unlimited rate '''
+        limiter = RateLimiter(0)
+        self.assertFalse(limiter.enabled())
+        for i in range(100):
+            self.assertTrue(limiter.allow('key', now=0))
+        self.assertEqual(len(limiter), 0)
+
+    def test_burst(self):
+        ''' Test bucket empties after burst and refills over time '''
+        limiter = RateLimiter(2, burst=3)
+        self.assertTrue(limiter.enabled())
+        for i in range(3):
+            self.assertTrue(limiter.allow('key', now=100))
+        self.assertFalse(limiter.allow('key', now=100))
+        self.assertFalse(limiter.allow('key', now=100.2))
+        self.assertTrue(limiter.allow('key', now=100.5))
+        self.assertFalse(limiter.allow('key', now=100.5))
+        self.assertTrue(limiter.allow('other', now=100.5))
+        for i in range(3):
+            self.assertTrue(limiter.allow('key', now=110))
+        self.assertFalse(limiter.allow('key', now=110))
+
+    def test_maxkeys(self):
+        ''' Test number of buckets is limited '''
+        limiter = RateLimiter(1, burst=1, maxkeys=2)
+        self.assertTrue(limiter.allow('a', now=0))
+        self.assertTrue(limiter.allow('b', now=0))
+        self.assertTrue(limiter.allow('c', now=0))
+        self.assertEqual(len(limiter), 2)
+        self.assertFalse(limiter.allow('c', now=0))
+        self.assertTrue(limiter.allow('a', now=0))
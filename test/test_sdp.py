@@ -185,6 +185,23 @@ class SDPTests(unittest.TestCase):
         with self.assertRaises(SDPException):
             self.sdp += ('AVW', [1.5])
 
+    def test_add_keyvalue_values_lazy(self):
+        ''' Test List of Values is kept in wire form until needed '''
+        self.sdp += ('id', 'abc123')
+        self.sdp += ('AAW', '1 null -3 0')
+        self.assertEqual(self.sdp._table['AAW'], '1 null -3 0')
+        self.assertEqual(self.sdp.get_data('AAV'), None)
+        self.assertEqual(list(self.sdp.get_data_list()), [
+            ('id', 'abc123'), ('AAW', '1 null -3 0')])
+        self.assertEqual(self.sdp.encode(), 'id:abc123\nAAW:1 null -3 0\n')
+        self.assertEqual(self.sdp.data['value']['AA'], [1, None, -3, 0])
+        self.assertEqual(self.sdp.get_data('AAW'), [1, None, -3, 0])
+        self.assertEqual(self.sdp._table['AAW'], [1, None, -3, 0])
+        self.assertEqual(self.sdp.encode(), 'id:abc123\nAAW:1 null -3 0\n')
+        for val in ['1 -0', '1 01', '1 +1', '1  2', '1 \u0661', '1 1_0']:
+            with self.assertRaises(SDPException):
+                self.sdp += ('ABW', val)
+
     def test_add_value(self):
         ''' Test setting/getting Value and List of Values key:val '''
         self.sdp.add_value('AA', 1234)
@@ -439,6 +456,38 @@ class SDPTests(unittest.TestCase):
         self.assertFalse(self.sdp.is_signed())
         self.assertFalse(self.sdp.check_signature())
 
+    def test_data_table(self):
+        ''' Test data dictionary built from the key table '''
+        self.assertFalse(hasattr(self.sdp, '__dict__'))
+        self.sdp += ('id', 'abc123')
+        self.sdp += ('ABV', 2)
+        self.sdp += ('AAS', 1)
+        self.sdp += ('ip', '10.0.0.10')
+        self.sdp += ('TOV', '4000D3349FEBBEAE')
+        self.sdp += ('ACW', [1, 2])
+        self.sdp += ('AAV', '?')
+        self.assertEqual(self.sdp.data, {
+            'id': 'abc123',
+            'in': None,
+            'data': {'ip': '10.0.0.10'},
+            'float': {'TOV': '4000D3349FEBBEAE'},
+            'status': {'AA': 1},
+            'value': {'AB': 2, 'AC': [1, 2]},
+            'query': {'AAV': '?'},
+            })
+        self.assertEqual(list(self.sdp.get_data_list()), [
+            ('id', 'abc123'), ('AAS', '1'), ('ABV', '2'), ('ACW', '1 2'),
+            ('TOV', '4000D3349FEBBEAE'), ('ip', '10.0.0.10'), ('AAV', '?')])
+        self.assertEqual(self.sdp.encode(),
+            'id:abc123\nip:10.0.0.10\nTOV:4000D3349FEBBEAE\nAAS:1\n'
+            'ABV:2\nACW:1 2\nAAV:?\n')
+        self.sdp.remove_data('ABV')
+        self.sdp.remove_data('AAV')
+        self.assertEqual(self.sdp.get_data('ABV'), None)
+        self.assertEqual(self.sdp.get_data('ACW'), [1, 2])
+        self.assertEqual(self.sdp.get_data('ACV'), None)
+        self.assertEqual(self.sdp.get_data('AAV'), None)
+
     def test_encode_without_id(self):
         ''' Test encoder without id'''
         with self.assertRaises(SDPException):
@@ -548,6 +597,16 @@ class SDPTests(unittest.TestCase):
         self.assertFalse(sdp.is_signed())
         self.assertFalse(sdp.check_signature())
 
+    def test_peek_id(self):
+        ''' Test finding id without decoding '''
+        self.assertEqual(SDP.peek_id('id:abc\nAAS:1\n'), 'abc')
+        self.assertEqual(SDP.peek_id('AAS:1\nid:abc\nABS:1\n'), 'abc')
+        self.assertEqual(SDP.peek_id('AAS:1\nid:abc'), 'abc')
+        self.assertEqual(SDP.peek_id('id:abc\r\nAAS:1\r\n'), 'abc')
+        self.assertEqual(SDP.peek_id('AAS:1\nxid:abc\n'), None)
+        self.assertEqual(SDP.peek_id('AAS:1\n'), None)
+        self.assertEqual(SDP.peek_id(''), None)
+
     def test_decode_invalid(self):
         ''' Test decoder with invalid datagram '''
         with self.assertRaises(SDPDecodeException):
@@ -572,6 +631,32 @@ class SDPTests(unittest.TestCase):
             SDP.decode('id:abc\nABW:\n')
         with self.assertRaises(SDPDecodeException):
             SDP.decode('id:abc\nAAS:1\nid:def\n')
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode('id:abc\n:123\n')
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode('id:abc\nin:x\n')
+
+    def test_decode_duplicates(self):
+        ''' Test decoder with repeated keys '''
+        for datagram in [
+                'id:abc\nAAS:1\nAAS:2\n',
+                'id:abc\nABV:1\nABV:2\n',
+                'id:abc\nACW:1 2\nACW:1 2\n',
+                'id:abc\nADF:4000D3349FEBBEAE\nADF:4000D3349FEBBEAE\n',
+                'id:abc\nip:1\nip:2\n',
+                'id:abc\nAES:?\nAES:1\n',
+                'id:abc\nAES:1\nAES:?\n',
+            ]:
+            with self.assertRaises(SDPDecodeException):
+                SDP.decode(datagram)
+        # empty earlier value is overwritten (same as get_data() check)
+        sdp = SDP.decode('id:abc\nAAS:0\nAAS:2\nABV:\nABV:3\n')
+        self.assertEqual(sdp.get_data('AAS'), 2)
+        self.assertEqual(sdp.get_data('ABV'), '3')
+        # "V" and "W" keys share the value but are checked separately
+        sdp = SDP.decode('id:abc\nACV:1\nACW:1 2\n')
+        self.assertEqual(sdp.get_data('ACW'), [1, 2])
+        self.assertEqual(sdp.get_data('ACV'), None)
 
     def test_encode_with_signature(self):
         ''' Test encoder for full packet with SHA1 HMAC signature'''
@@ -600,6 +685,114 @@ class SDPTests(unittest.TestCase):
             'sha256:Z/91VAs43GlbSHZVIzaqXSLKpunjLYPQfnhpHEvzYys=',
         ])
 
+    def test_decode_many(self):
+        ''' Test batch decoder results and errors '''
+        datagrams = [
+            'id:abc123\nAAW:1 null -3\nABW:4 5\n',
+            'id:abc123\nAAW:1 x\n',
+            'AAS:1\n',
+            b'id:abc124\nAAS:1\n',
+            'id:abc123\nAAW:1 -0\nABS:5\n',
+            'id:abc125\r\nAAW:0 0\r\n',
+            'id:abc123\nAAW:1 2\nAAW:3 4\n',
+        ]
+        (sdps, errors) = SDP.decode_many(datagrams)
+        self.assertEqual(len(sdps), len(datagrams))
+        self.assertEqual([i for (i, ex) in errors], [1, 2, 4, 6])
+        for (i, ex) in errors:
+            self.assertIsNone(sdps[i])
+            with self.assertRaises(SDPException) as cm:
+                SDP.decode(datagrams[i])
+            self.assertEqual(ex.__class__, cm.exception.__class__)
+            self.assertEqual(str(ex), str(cm.exception))
+        self.assertEqual(sdps[0].get_data('AAW'), [1, None, -3])
+        self.assertEqual(sdps[0].encode(), 'id:abc123\nAAW:1 null -3\nABW:4 5\n')
+        self.assertEqual(sdps[3].get_data('id'), 'abc124')
+        self.assertEqual(sdps[5].get_data('AAW'), [0, 0])
+        self.assertEqual(SDP.decode_many([]), ([], []))
+
+    def test_decode_many_signed(self):
+        ''' Test batch decoder with signatures '''
+        datagram = 'id:abc123\n'
+        signature = 'sha256:Z/91VAs43GlbSHZVIzaqXSLKpunjLYPQfnhpHEvzYys=\n'
+        (sdps, errors) = SDP.decode_many(
+            [datagram + signature, 'id:abc124\n' + signature],
+            'my-secret-key', '12345')
+        self.assertTrue(sdps[0].check_signature())
+        self.assertIsNone(sdps[1])
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 1)
+        self.assertTrue(isinstance(errors[0][1], SDPDecodeException))
+
+    def test_binary(self):
+        ''' Test binary datagram has the same data as the text one '''
+        datagram = \
+            'id:abc123\n' \
+            'ip:10.0.0.10\n' \
+            'ALF:4000D3349FEBBEAE\n' \
+            'TOV:4000d3349febbeae\n' \
+            'AAS:1\n' \
+            'BAS:3\n' \
+            'ABV:-2\n' \
+            'ACV:3.5\n' \
+            'ADV:0123\n' \
+            'AEV:98765432109876543210\n' \
+            'AFW:1 null -3\n' \
+            'AGW:1 98765432109876543210\n' \
+            'AHV:?\n'
+        sdp = SDP.decode(datagram)
+        binary = sdp.encode_binary()
+        self.assertTrue(isinstance(binary, bytes))
+        self.assertTrue(len(binary) < len(datagram))
+        self.assertEqual(SDP.peek_id(binary), 'abc123')
+        decoded = SDP.decode(binary)
+        self.assertEqual(decoded.data, sdp.data)
+        self.assertEqual(decoded.encode(), sdp.encode())
+        self.assertEqual(decoded.get_data('ABV'), '-2')
+        self.assertEqual(decoded.get_data('AFW'), [1, None, -3])
+        self.assertEqual(SDP.decode(memoryview(binary)).encode(), sdp.encode())
+
+    def test_binary_multipart_signed(self):
+        ''' Test signed binary multipart datagram '''
+        datagram = \
+            'id:abc123\n' \
+            'in:1,1440871960\n' \
+            'AAS:1\n' \
+            'in:2,1440871961\n' \
+            'AAS:2\n'
+        sdp = SDP.decode(datagram)
+        sdp.set_secret_key('my-secret-key')
+        sdp.set_nonce('12345')
+        binary = sdp.encode_binary()
+        decoded = SDP.decode(binary, 'my-secret-key', '12345')
+        self.assertTrue(decoded.is_signed())
+        self.assertTrue(decoded.check_signature())
+        self.assertEqual([part.get_in_seq() for part in decoded.gen_get()], [1, 2])
+        self.assertEqual(decoded.encode(), sdp.encode())
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode(binary, 'my-secret-key', '54321')
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode(binary + b'\x00')
+
+    def test_binary_invalid(self):
+        ''' Test decoder with invalid binary datagrams '''
+        binary = SDP.decode('id:abc123\nAAS:1\nABW:1 2\n').encode_binary()
+        for datagram in [
+                binary[:-1],                            # truncated
+                b'\xb5\x02' + binary[2:],              # unknown version
+                binary + b'\x11\x02AA',               # duplicate status
+                binary + b'\x20\x02AB\x02',           # value and list
+                binary + b'\x50\x03ABS\x01x',          # data record with status key
+                binary + b'\x20\x02TO\x02',           # "TOV" is float
+                binary + b'\x50\x02ip\x01:',           # colon in value
+                binary + b'\x30\x02AC\x01\x02',       # one list item
+                binary + b'\x20\x02AC' + b'\xff' * 11, # too long varint
+                binary + b'\x99',                      # unknown record
+                b'\xb5\x01\x11\x02AA',               # no "id"
+            ]:
+            with self.assertRaises(SDPDecodeException):
+                SDP.decode(datagram)
+
     def test_decode_with_valid_signature(self):
         ''' Test decoder with valid SHA1 HMAC signature '''
         datagram = 'id:abc123\n'
@@ -614,6 +807,44 @@ class SDPTests(unittest.TestCase):
 
         self.assertTrue(sdp.check_signature())
 
+    def test_decode_with_signature_forms(self):
+        ''' Test decoder with signature in bytes and non-canonical datagrams '''
+        signature = 'sha256:Z/91VAs43GlbSHZVIzaqXSLKpunjLYPQfnhpHEvzYys='
+        for datagram in [
+                'id:abc123\n' + signature + '\n',
+                'id:abc123\n' + signature,
+                ('id:abc123\n' + signature + '\n').encode('UTF-8'),
+                'id:abc123\r\n' + signature + '\r\n',
+                '\nid:abc123\n\n' + signature + '\n',
+            ]:
+            sdp = SDP.decode(datagram, 'my-secret-key', '12345')
+            self.assertTrue(sdp.is_signed())
+            self.assertEqual(sdp.get_data('id'), 'abc123')
+            self.assertTrue(sdp.check_signature())
+        datagram = 'id:abc123\n' + signature + '\n'
+        sdp = SDP.decode(datagram, 'my-secret-key', '12345', \
+            encoded=datagram.encode('UTF-8'))
+        self.assertTrue(sdp.check_signature())
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode(datagram + 'AAS:1\n')
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode(datagram + '\n')
+        with self.assertRaises(SDPDecodeException):
+            SDP.decode(b'id:abc\xff\n')
+
+    def test_signature_hmac_cache(self):
+        ''' Test cached HMAC state gives the same signature '''
+        checksum = SDP._calculate_checksum('id:abc123\n')
+        signature = 'Z/91VAs43GlbSHZVIzaqXSLKpunjLYPQfnhpHEvzYys='
+        SDP.forget_key('my-secret-key', '12345')
+        self.assertEqual(SDP._calculate_signature(checksum, 'my-secret-key', '12345'), signature)
+        mac = SDP._keyed_hmac('my-secret-key', '12345')
+        self.assertEqual(SDP._calculate_signature(checksum, 'my-secret-key', '12345'), signature)
+        self.assertIs(SDP._keyed_hmac('my-secret-key', '12345'), mac)
+        self.assertNotEqual(SDP._calculate_signature(checksum, 'my-secret-key', '54321'), signature)
+        SDP.forget_key('my-secret-key', '12345')
+        self.assertIsNot(SDP._keyed_hmac('my-secret-key', '12345'), mac)
+
     def test_decode_with_invalid_signature1(self):
         ''' Test decoder with invalid SHA1 HMAC signature (1) '''
         datagram = 'id:abc123\n'
@@ -0,0 +1,117 @@
+import unittest
+
+from sdp import SDP
+from sdppacker import SDPPacker, line_size
+from sdpexception import SDPException
+
+class SDPPackerTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.sdppacker module
+    '''
+    def test_size(self):
+        ''' Test tracked size is the same as encoded size '''
+        packer = SDPPacker('abc123', secret_key='secret', nonce='12345')
+        for (key, val) in [('in', '1,1440871960'), ('AAS', 1), ('ABV', 2.5),
+                           ('ACW', [1, None, 3]), ('ip', '10.0.0.10'),
+                           ('TOV', '4000D3349FEBBEAE'), ('ADV', '?')]:
+            packer.add_keyvalue(key, val)
+        datagrams = packer.encode()
+        self.assertEqual(len(datagrams), 1)
+        self.assertEqual(packer.get_size(), len(datagrams[0]))
+
+    def test_line_size(self):
+        ''' Test size of one line '''
+        self.assertEqual(line_size('AAW', [1, None]), len('AAW:1 null\n'))
+        self.assertEqual(line_size('ip', 'ä'), len('ip:ä\n'.encode('UTF-8')))
+
+    def test_spill(self):
+        ''' Test keys are spilled to follow-up datagrams '''
+        packer = SDPPacker('abc123', max_size=100)
+        for i in range(30):
+            self.assertTrue(packer.add_keyvalue('R%02dV' % i, 1000 + i))
+        datagrams = packer.encode()
+        self.assertEqual(packer.get_count(), len(datagrams))
+        self.assertTrue(len(datagrams) > 1)
+        keys = []
+        for datagram in datagrams:
+            self.assertTrue(len(datagram) <= 100)
+            sdp = SDP.decode(datagram)
+            self.assertEqual(sdp.get_data('id'), 'abc123')
+            keys += [key for (key, val) in sdp.get_data_list() if key != 'id']
+        self.assertEqual(sorted(keys), ['R%02dV' % i for i in range(30)])
+
+    def test_max_datagrams(self):
+        ''' Test packing stops when datagram count is limited '''
+        packer = SDPPacker('abc123', max_size=100, max_datagrams=1)
+        added = 0
+        while packer.add_keyvalue('R%02dV' % added, 1000):
+            added += 1
+        self.assertTrue(added > 0)
+        datagrams = packer.encode()
+        self.assertEqual(len(datagrams), 1)
+        self.assertEqual(len(list(SDP.decode(datagrams[0]).get_data_list())), added + 1)
+
+    def test_parts(self):
+        ''' Test multipart pieces and keys of the last piece '''
+        parts = []
+        for i in range(3):
+            part = SDP()
+            part.add_keyvalue('id', 'abc123')
+            part.add_keyvalue('in', '%d,%d' % (i, 1440871960 + i))
+            part.add_keyvalue('AAS', i)
+            parts.append(part)
+        packer = SDPPacker('abc123', secret_key='secret', nonce='12345')
+        for part in parts:
+            self.assertTrue(packer.add_part(part))
+        packer.add_keyvalue('ABV', 5)
+        datagrams = packer.encode()
+        self.assertEqual(len(datagrams), 1)
+        self.assertEqual(packer.get_size(), len(datagrams[0]))
+        sdp = SDP.decode(datagrams[0], 'secret', '12345')
+        pieces = list(sdp.gen_get())
+        self.assertEqual([piece.get_in_seq() for piece in pieces], [0, 1, 2])
+        self.assertEqual(pieces[2].get_data('ABV'), '5')
+        # original parts are not changed
+        self.assertEqual(parts[0].get_data('id'), 'abc123')
+        packer = SDPPacker('abc123')
+        self.assertTrue(packer.add_part(parts[0]))
+
+    def test_part_spill(self):
+        ''' Test multipart pieces are spilled to follow-up datagrams '''
+        packer = SDPPacker('abc123', max_size=80)
+        for i in range(5):
+            part = SDP()
+            part.add_keyvalue('in', '%d,%d' % (i, 1440871960 + i))
+            part.add_keyvalue('ip', '10.0.0.10')
+            packer.add_part(part)
+        seqs = []
+        for datagram in packer.encode():
+            self.assertTrue(len(datagram) <= 80)
+            seqs += [piece.get_in_seq() for piece in SDP.decode(datagram).gen_get()]
+        self.assertEqual(seqs, [0, 1, 2, 3, 4])
+
+    def test_part_after_keys(self):
+        ''' Test part is not added to datagram with its own keys '''
+        packer = SDPPacker('abc123')
+        packer.add_keyvalue('AAS', 1)
+        part = SDP()
+        part.add_keyvalue('in', '1,1440871960')
+        self.assertTrue(packer.add_part(part))
+        self.assertEqual(packer.get_count(), 2)
+        with self.assertRaises(ValueError):
+            part.add_keyvalue('id', 'xyz')
+            packer.add_part(part)
+
+    def test_part_in(self):
+        ''' Test "in" of single and multipart pieces '''
+        packer = SDPPacker('abc123')
+        packer.add_piece('1')
+        packer.add_keyvalue('AAS', 1)
+        self.assertEqual(packer.encode(), ['id:abc123\nin:1\nAAS:1\n'])
+        self.assertEqual(SDP.decode(packer.encode(binary=True)[0]).encode(), \
+            'id:abc123\nin:1\nAAS:1\n')
+        packer.add_piece('2')
+        with self.assertRaises(SDPException):
+            packer.encode()
+        with self.assertRaises(SDPException):
+            packer.add_part(SDP())
@@ -0,0 +1,153 @@
+import unittest
+from mock import Mock
+
+from sdp import SDP
+from sdpreceiver import SDPReceiver
+from controller import Controller
+from controllers import Controllers
+
+class SDPReceiverTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.sdpreceiver module
+    '''
+    def setUp(self):
+        self.core = Mock()
+        self.controllers = Mock()
+        self.core.controllers = Mock(return_value=self.controllers)
+        self.host = Mock()
+
+    def test_rate_limit(self):
+        ''' Test dropping datagrams from controller over the rate limit '''
+        controller = Mock()
+        controller.get_secret_key = Mock(return_value=None)
+        controller.ack_duplicate = Mock(return_value=False)
+        self.controllers.get_id = Mock(return_value=controller)
+        receiver = SDPReceiver(self.core, rate_limit=1, rate_burst=2)
+        for i in range(3):
+            receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.assertEqual(controller.set_last_sdp.call_count, 2)
+        self.host.drop.assert_called_once_with('ratelimit_controller')
+        receiver.datagram_from_controller(self.host, 'id:def\nAAS:1\n')
+        self.assertEqual(controller.set_last_sdp.call_count, 3)
+
+    def test_rate_limit_spoofed(self):
+        ''' Test datagrams spoofing controller id from other address '''
+        controller = Mock()
+        controller.get_secret_key = Mock(return_value=None)
+        controller.ack_duplicate = Mock(return_value=False)
+        self.controllers.get_id = Mock(return_value=controller)
+        self.host.get_id = Mock(return_value=('1.2.3.4', 12345))
+        spoofer = Mock()
+        spoofer.get_id = Mock(return_value=('6.6.6.6', 666))
+        receiver = SDPReceiver(self.core, rate_limit=1, rate_burst=2)
+        for i in range(5):
+            receiver.datagram_from_controller(spoofer, 'id:abc\nAAS:1\n')
+        spoofer.drop.assert_called_with('ratelimit_controller')
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.host.drop.assert_not_called()
+        self.assertEqual(controller.set_last_sdp.call_count, 3)
+
+    def test_unknown_controller(self):
+        ''' Test dropping datagrams from unknown controller without decode '''
+        self.controllers.get_id = Mock(return_value=None)
+        receiver = SDPReceiver(self.core)
+        with self.assertRaises(Exception):
+            receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        receiver.datagram_from_controller(self.host, 'id:abc\ninvalid\n')
+        # cached id is not looked up again, not decoded
+        self.assertEqual(self.controllers.get_id.call_count, 1)
+        self.assertEqual(self.host.drop.call_count, 2)
+        self.host.drop.assert_called_with('unknown_controller')
+
+    def test_unknown_controller_expire(self):
+        ''' Test unknown controller is checked again after TTL '''
+        self.controllers.get_id = Mock(return_value=None)
+        receiver = SDPReceiver(self.core)
+        with self.assertRaises(Exception):
+            receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        receiver._unknown['abc'] = 0
+        with self.assertRaises(Exception):
+            receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.assertEqual(self.controllers.get_id.call_count, 2)
+
+    def test_unknown_controller_created(self):
+        ''' Test controller created after it was found unknown is accepted '''
+        controllers = Controllers()
+        self.core.controllers = Mock(return_value=controllers)
+        self.host.send = Mock(return_value=None)
+        self.host.is_binary = Mock(return_value=False)
+        receiver = SDPReceiver(self.core)
+        with self.assertRaises(Exception):
+            receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.host.drop.assert_called_once_with('unknown_controller')
+        controller = controllers.find_by_id('abc')
+        controller._publish = Mock()
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.assertEqual(self.host.drop.call_count, 2)
+        # message bus delivers "controllers/created" to the receiver
+        self.core.msgbus().subscribe.assert_called_once_with(None, \
+            'controllers/created', receiver, receiver._on_controller_created)
+        receiver._on_controller_created(None, 'controllers/created', {'controller': 'abc'})
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.assertEqual(self.host.drop.call_count, 2)
+        self.assertEqual(controller._stats.get()['rx']['datagram']['ok'], 1)
+
+    def test_known_controller_single_lookup(self):
+        ''' Test known controller is looked up only once '''
+        controller = Mock()
+        controller.get_secret_key = Mock(return_value=None)
+        controller.ack_duplicate = Mock(return_value=False)
+        self.controllers.get_id = Mock(return_value=controller)
+        receiver = SDPReceiver(self.core)
+        receiver.datagram_from_controller(self.host, 'AAS:1\nid:abc\n')
+        self.controllers.get_id.assert_called_once_with('abc')
+        controller.set_host.assert_called_once_with(self.host)
+        self.assertEqual(controller.set_last_sdp.call_args[0][0].get_data('AAS'), 1)
+
+    def test_duplicate(self):
+        ''' Test duplicate datagram is answered without processing '''
+        controller = Mock()
+        controller.get_secret_key = Mock(return_value=None)
+        controller.ack_duplicate = Mock(return_value=True)
+        self.controllers.get_id = Mock(return_value=controller)
+        receiver = SDPReceiver(self.core)
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        (digest, host) = controller.ack_duplicate.call_args[0]
+        self.assertEqual(host, self.host)
+        controller.set_last_sdp.assert_not_called()
+        controller.ack_duplicate = Mock(return_value=False)
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        self.assertEqual(controller.set_last_sdp.call_args[1]['digest'], digest)
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:2\n')
+        self.assertNotEqual(controller.set_last_sdp.call_args[1]['digest'], digest)
+
+    def test_repeated_report(self):
+        ''' Test repeated status report without "in" is processed again '''
+        controller = Controller('abc')
+        controller._publish = Mock()
+        self.controllers.get_id = Mock(return_value=controller)
+        self.host.send = Mock(return_value=None)
+        self.host.is_binary = Mock(return_value=False)
+        receiver = SDPReceiver(self.core)
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        receiver.datagram_from_controller(self.host, 'id:abc\nAAS:1\n')
+        stats = controller._stats.get()['rx']
+        self.assertEqual(stats['datagram']['ok'], 2)
+        self.assertFalse('duplicate' in stats['datagram'])
+        self.assertEqual(self.host.send.call_count, 2)
+
+    def test_binary(self):
+        ''' Test binary datagram is decoded '''
+        controller = Mock()
+        controller.get_secret_key = Mock(return_value=None)
+        controller.ack_duplicate = Mock(return_value=False)
+        self.controllers.get_id = Mock(return_value=controller)
+        receiver = SDPReceiver(self.core)
+        datagram = SDP.decode('id:abc\nAAS:1\nABW:1 2\n').encode_binary()
+        receiver.datagram_from_controller(self.host, datagram)
+        self.controllers.get_id.assert_called_once_with('abc')
+        sdp = controller.set_last_sdp.call_args[0][0]
+        self.assertEqual(sdp.get_data('AAS'), 1)
+        self.assertEqual(sdp.get_data('ABW'), [1, 2])
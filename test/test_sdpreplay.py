@@ -0,0 +1,93 @@
+import unittest
+import os
+import json
+import zlib
+import gzip
+import base64
+import tempfile
+
+from sdp import SDP
+from sdpreplay import Replay, read_datagrams, datagram_to_str
+from udpcapture import UDPCapture
+import sdpzdict
+
+class SDPReplayTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.sdpreplay module
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.replay = Replay(('127.0.0.1', 9), 1, 'secret', 'test', False, False)
+        # no server to ask the nonce from
+        self.replay._bootstrap = lambda controller: setattr(controller, 'nonce', '12345')
+
+    def tearDown(self):
+        for sock in self.replay._sockets:
+            sock.close()
+        self.tmpdir.cleanup()
+
+    def test_rewrite(self):
+        ''' Test rewriting single datagram '''
+        (controller, datagram, seqs) = self.replay.rewrite('id:abc\nin:7,1440871960\nAAS:1\nABV:2\n')
+        self.assertEqual(controller.id, 'test000000')
+        self.assertListEqual(seqs, [1])
+        sdp = SDP.decode(datagram, 'secret', '12345')
+        self.assertTrue(sdp.check_signature())
+        self.assertEqual(sdp.get_data('id'), 'test000000')
+        self.assertEqual(sdp.get_data('in'), '1,1440871960')
+        self.assertEqual(sdp.get_data('AAS'), 1)
+        self.assertEqual(sdp.get_data('ABV'), '2')
+        (controller2, datagram, seqs) = self.replay.rewrite('id:abc\nin:8,1440871961\nAAS:2\n')
+        self.assertIs(controller2, controller)
+        self.assertListEqual(seqs, [2])
+        (controller3, datagram, seqs) = self.replay.rewrite('id:def\nin:8,1440871961\nAAS:2\n')
+        self.assertEqual(controller3.id, 'test000001')
+        self.assertListEqual(seqs, [1])
+
+    def test_rewrite_multipart(self):
+        ''' Test rewriting multipart datagram '''
+        (controller, datagram, seqs) = self.replay.rewrite(
+            'id:abc\nin:5,1440871960\nAAS:1\nin:6,1440871962\nABV:2\n')
+        self.assertListEqual(seqs, [1, 2])
+        sdp = SDP.decode(datagram, 'secret', '12345')
+        self.assertTrue(sdp.check_signature())
+        self.assertEqual(sdp.get_data('id'), 'test000000')
+        parts = list(sdp.gen_get())
+        self.assertEqual(len(parts), 2)
+        self.assertEqual(parts[0].get_data('in'), '1,1440871960')
+        self.assertEqual(parts[0].get_data('AAS'), 1)
+        self.assertEqual(parts[1].get_data('in'), '2,1440871962')
+        self.assertEqual(parts[1].get_data('ABV'), '2')
+
+    def test_read_capture(self):
+        ''' Test reading datagrams from capture file '''
+        filename = os.path.join(self.tmpdir.name, 'sdp.cap')
+        capture = UDPCapture(filename)
+        capture.start()
+        capture.write_batch([(b'id:abc\n', ('1.2.3.4', 1234)),
+                             (b'\x78\xda\x00', ('1.2.3.4', 1234))], ts=1234.5)
+        capture.stop()
+        self.assertListEqual(list(read_datagrams(filename)), [
+            (1234.5, b'id:abc\n'),
+            (1234.5, b'\x78\xda\x00'),
+        ])
+
+    def test_read_jsonl(self):
+        ''' Test reading datagrams from JSONL file '''
+        filename = os.path.join(self.tmpdir.name, 'sdp.jsonl')
+        with open(filename, 'w', encoding='UTF-8') as f:
+            f.write(json.dumps({'ts': 1234.5, 'datagram': 'id:abc\n'}) + '\n')
+            f.write('\n')
+            f.write(json.dumps({'datagram_b64': base64.b64encode(b'\x78\xda\x00').decode()}) + '\n')
+        self.assertListEqual(list(read_datagrams(filename)), [
+            (1234.5, b'id:abc\n'),
+            (0.0, b'\x78\xda\x00'),
+        ])
+
+    def test_datagram_to_str(self):
+        ''' Test converting plain and compressed datagrams to str '''
+        datagram = b'id:abc\nin:1,1440871960\nAAS:1\n'
+        self.assertEqual(datagram_to_str(datagram), datagram.decode())
+        self.assertEqual(datagram_to_str(zlib.compress(datagram)), datagram.decode())
+        self.assertEqual(datagram_to_str(gzip.compress(datagram)), datagram.decode())
+        self.assertEqual(datagram_to_str(sdpzdict.compress(datagram)), datagram.decode())
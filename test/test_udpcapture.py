@@ -0,0 +1,66 @@
+import unittest
+import os
+import tempfile
+
+from udpcapture import UDPCapture, read_capture, MAGIC
+
+class UDPCaptureTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.udpcapture module
+    '''
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'sdp.cap')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stopped(self):
+        ''' Test capture does nothing if not started '''
+        capture = UDPCapture(self.filename)
+        self.assertFalse(capture.is_active())
+        capture.write_batch([(b'id:abc\n', ('1.2.3.4', 1234))])
+        capture.flush()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_write_read(self):
+        ''' Test writing datagrams and reading them back '''
+        capture = UDPCapture(self.filename)
+        self.assertTrue(capture.toggle())
+        batch = [
+            (memoryview(b'id:abc\n'), ('1.2.3.4', 1234)),
+            (b'\x78\xda\x00', ('10.0.0.1', 44444)),
+        ]
+        capture.write_batch(batch, ts=1234.5)
+        capture.write_batch([(b'', ('1.2.3.4', 1))], ts=1235.5)
+        self.assertFalse(capture.toggle())
+        records = list(read_capture(self.filename))
+        self.assertListEqual(records, [
+            (1234.5, ('1.2.3.4', 1234), b'id:abc\n'),
+            (1234.5, ('10.0.0.1', 44444), b'\x78\xda\x00'),
+            (1235.5, ('1.2.3.4', 1), b''),
+        ])
+        stats = capture.get_stats()
+        self.assertEqual(stats['records'], 3)
+        self.assertFalse(stats['active'])
+
+    def test_rotate(self):
+        ''' Test rotating capture file '''
+        capture = UDPCapture(self.filename, maxbytes=100, backups=2)
+        capture.start()
+        for i in range(4):
+            capture.write_batch([(b'x' * 100, ('1.2.3.4', i))], ts=i)
+            capture.flush()
+        capture.stop()
+        self.assertFalse(os.path.exists(self.filename + '.3'))
+        self.assertEqual(list(read_capture(self.filename + '.2'))[0][1][1], 2)
+        self.assertEqual(list(read_capture(self.filename + '.1'))[0][1][1], 3)
+        self.assertEqual(list(read_capture(self.filename)), [])
+        self.assertEqual(capture.get_stats()['rotated'], 4)
+
+    def test_read_invalid(self):
+        ''' Test reading a file that is not a capture file '''
+        with open(self.filename, 'wb') as f:
+            f.write(b'id:abc\n')
+        with self.assertRaises(ValueError):
+            list(read_capture(self.filename))
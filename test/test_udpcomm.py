@@ -0,0 +1,234 @@
+import os
+import sys
+import unittest
+import socket
+from mock import Mock
+
+from hosts import Hosts
+import udpcomm
+from udpcomm import UDPComm
+from ratelimit import RateLimiter
+
+class UDPCommTests(unittest.TestCase):
+    '''
+    This is the unittest for the uniscada.udpcomm module
+    '''
+    def setUp(self):
+        self.handler = Mock()
+        self.core = Mock()
+        self.core.hosts = Mock(return_value=Hosts())
+        self.udpcomm = UDPComm('127.0.0.1', 0, self.handler, self.core, recv_budget=3)
+        self.sock = self.udpcomm._sock
+        self.server = self.sock.getsockname()
+        self.client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.client.bind(('127.0.0.1', 0))
+        self.client.settimeout(1)
+
+    def tearDown(self):
+        self.udpcomm._io_loop.remove_handler(self.udpcomm._sock.fileno())
+        self.sock.close()
+        self.client.close()
+
+    def _wait_readable(self):
+        import select
+        select.select([self.udpcomm._sock], [], [], 1)
+
+    def test_drain_budget(self):
+        ''' Test reading datagrams in batches limited by budget '''
+        for i in range(5):
+            self.client.sendto(('id:%d\n' % i).encode(), self.server)
+        self._wait_readable()
+        self.udpcomm._callback_read(self.udpcomm._sock)
+        self.assertEqual(self.handler.call_count, 3)
+        self.udpcomm._callback_read(self.udpcomm._sock)
+        self.assertEqual(self.handler.call_count, 5)
+        self.udpcomm._callback_read(self.udpcomm._sock)
+        self.assertEqual(self.handler.call_count, 5)
+        datagrams = [c[0][1] for c in self.handler.call_args_list]
+        self.assertListEqual(datagrams, ['id:%d\n' % i for i in range(5)])
+        stats = self.udpcomm.get_stats()
+        self.assertEqual(stats['rx']['wakeups'], 3)
+        self.assertEqual(stats['rx']['datagrams'], 5)
+        self.assertEqual(stats['rx']['budget_exhausted'], 1)
+
+    def test_send(self):
+        ''' Test sending datagram back to the host '''
+        host = Mock()
+        self.udpcomm._send(host, self.client.getsockname(), 'id:abc\n')
+        (data, addr) = self.client.recvfrom(1000)
+        self.assertEqual(data, b'id:abc\n')
+        self.assertEqual(addr, self.server)
+
+    def _full_send_buffer(self):
+        ''' Replace socket with a mock that behaves like the one with full
+        send buffer '''
+        sock = Mock()
+        sock.fileno = self.udpcomm._sock.fileno
+        sock.sendto = Mock(side_effect=BlockingIOError)
+        self.udpcomm._sock = sock
+        return sock
+
+    def test_send_queue(self):
+        ''' Test queueing datagrams when socket send buffer is full '''
+        realsock = self.udpcomm._sock
+        sock = self._full_send_buffer()
+        addr = self.client.getsockname()
+        self.assertIsNone(self.udpcomm._send(Mock(), addr, 'id:1\n'))
+        self.assertIsNone(self.udpcomm._send(Mock(), addr, 'id:2\n'))
+        self.assertEqual(sock.sendto.call_count, 1)
+        self.udpcomm._callback_write(sock)
+        self.assertEqual(len(self.udpcomm._send_queue), 2)
+        self.udpcomm._sock = realsock
+        self.udpcomm._callback_write(realsock)
+        self.assertEqual(len(self.udpcomm._send_queue), 0)
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:1\n')
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:2\n')
+        stats = self.udpcomm.get_stats()
+        self.assertEqual(stats['tx']['queue']['queued'], 2)
+        self.assertEqual(stats['tx']['queue']['depth'], 0)
+
+    def test_send_queue_coalesce(self):
+        ''' Test replacing queued datagram with the same coalesce key '''
+        realsock = self.udpcomm._sock
+        self._full_send_buffer()
+        addr = self.client.getsockname()
+        self.udpcomm._send(Mock(), addr, 'id:1\nin:1\n', coalesce='1')
+        self.udpcomm._send(Mock(), addr, 'id:2\nin:1\n', coalesce='2')
+        self.udpcomm._send(Mock(), addr, 'id:1\nin:2\n', coalesce='1')
+        self.assertEqual(len(self.udpcomm._send_queue), 2)
+        self.udpcomm._sock = realsock
+        self.udpcomm._callback_write(realsock)
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:1\nin:2\n')
+        self.assertEqual(self.client.recvfrom(1000)[0], b'id:2\nin:1\n')
+        self.assertDictEqual(self.udpcomm._send_pending, {})
+        self.assertEqual(self.udpcomm.get_stats()['tx']['queue']['coalesced'], 1)
+
+    def test_send_queue_overflow(self):
+        ''' Test dropping the oldest datagram when send queue is full '''
+        self.udpcomm._send_queue_size = 2
+        self._full_send_buffer()
+        addr = self.client.getsockname()
+        for i in range(3):
+            self.udpcomm._send(Mock(), addr, 'id:%d\n' % i, coalesce=str(i))
+        self.assertListEqual([e[1] for e in self.udpcomm._send_queue], [b'id:1\n', b'id:2\n'])
+        self.assertEqual(len(self.udpcomm._send_pending), 2)
+        self.assertEqual(self.udpcomm.get_stats()['tx']['queue']['dropped'], 1)
+
+    def test_receive_buffer_reuse(self):
+        ''' Test batch processing when receive buffer fills up '''
+        self.udpcomm._recv_budget = 10
+        datagrams = [('id:%d\n' % i) + 'x' * 60000 for i in range(3)]
+        for datagram in datagrams:
+            self.client.sendto(datagram.encode(), self.server)
+        self._wait_readable()
+        self.udpcomm._callback_read(self.udpcomm._sock)
+        received = [c[0][1] for c in self.handler.call_args_list]
+        self.assertListEqual(received, datagrams)
+
+    def test_host_wiring_cache(self):
+        ''' Test Host is looked up and wired only once per address '''
+        hosts = self.core.hosts()
+        addr = self.client.getsockname()
+        self.udpcomm._process_datagram(b'id:1\n', addr)
+        host = hosts.get_by_addr(addr)
+        self.assertEqual(host.get_id(), 'udp://%s:%d' % addr)
+        self.assertEqual(host.get_addr(), addr)
+        hosts.find_by_id = Mock()
+        self.udpcomm._process_datagram(b'id:2\n', addr)
+        hosts.find_by_id.assert_not_called()
+        self.assertEqual(self.handler.call_count, 2)
+        self.assertEqual(self.handler.call_args[0][0], host)
+
+    def test_host_wiring_cache_remove(self):
+        ''' Test removed Host is not found by address '''
+        hosts = self.core.hosts()
+        addr = self.client.getsockname()
+        self.udpcomm._process_datagram(b'id:1\n', addr)
+        host = hosts.get_by_addr(addr)
+        hosts.remove_by_id(host.get_id())
+        self.assertIsNone(hosts.get_by_addr(addr))
+        self.udpcomm._process_datagram(b'id:2\n', addr)
+        self.assertNotEqual(id(hosts.get_by_addr(addr)), id(host))
+
+    def test_addr_rate_limit(self):
+        ''' Test dropping datagrams from address over the rate limit '''
+        hosts = self.core.hosts()
+        self.udpcomm._addr_limit = RateLimiter(1, burst=2)
+        addr = ('127.0.0.2', 1234)
+        for i in range(3):
+            self.udpcomm._process_datagram(b'id:1\n', addr)
+        self.assertEqual(self.handler.call_count, 2)
+        host = hosts.get_by_addr(addr)
+        self.assertEqual(host.get_stats()['rx']['dropped']['ratelimit_addr'], 1)
+        self.udpcomm._process_datagram(b'id:1\n', ('127.0.0.3', 1234))
+        self.assertEqual(self.handler.call_count, 3)
+        self.assertEqual(self.udpcomm.get_stats()['rx']['dropped']['ratelimit_addr'], 1)
+
+    def test_capture(self):
+        ''' Test recording received datagrams '''
+        capture = Mock()
+        capture.is_active = Mock(return_value=True)
+        self.udpcomm._capture = capture
+        self.assertEqual(self.udpcomm.get_capture(), capture)
+        self.client.sendto(b'id:1\n', self.server)
+        self._wait_readable()
+        self.udpcomm._callback_read(self.udpcomm._sock)
+        batch = capture.write_batch.call_args[0][0]
+        self.assertEqual(bytes(batch[0][0]), b'id:1\n')
+        self.assertEqual(batch[0][1], self.client.getsockname())
+        self.assertEqual(self.handler.call_count, 1)
+
+    def test_socket_buffers(self):
+        ''' Test setting socket buffer sizes '''
+        udpcomm = UDPComm('127.0.0.1', 0, self.handler, self.core, rcvbuf=65536, sndbuf=32768)
+        stats = udpcomm.get_stats()['socket']
+        udpcomm._io_loop.remove_handler(udpcomm._sock.fileno())
+        udpcomm._sock.close()
+        self.assertTrue(stats['rcvbuf'] >= 65536)
+        self.assertTrue(stats['sndbuf'] >= 32768)
+
+    def test_kernel_drops(self):
+        ''' Test reading kernel receive queue drop counter '''
+        self.udpcomm._ancbufsize = socket.CMSG_SPACE(4)
+        self.udpcomm._read_ancdata([(socket.SOL_SOCKET, udpcomm.SO_RXQ_OVFL, (123).to_bytes(4, sys.byteorder))])
+        stats = self.udpcomm.get_socket_stats()
+        self.assertEqual(stats['drops'], 123)
+        self.assertEqual(stats['drops_source'], 'SO_RXQ_OVFL')
+
+    def test_kernel_drops_proc(self):
+        ''' Test reading drop counter from /proc/net/udp '''
+        if not os.path.exists(udpcomm.PROC_NET_UDP):
+            self.skipTest('no ' + udpcomm.PROC_NET_UDP)
+        self.udpcomm._ancbufsize = 0
+        stats = self.udpcomm.get_socket_stats()
+        self.assertEqual(stats['drops'], 0)
+        self.assertEqual(stats['drops_source'], udpcomm.PROC_NET_UDP)
+
+    def test_kernel_drops_proc_missing(self):
+        ''' Test socket statistics without /proc/net/udp '''
+        self.udpcomm._ancbufsize = 0
+        proc_net_udp = udpcomm.PROC_NET_UDP
+        udpcomm.PROC_NET_UDP = '/nonexistent/proc/net/udp'
+        try:
+            stats = self.udpcomm.get_socket_stats()
+        finally:
+            udpcomm.PROC_NET_UDP = proc_net_udp
+        self.assertTrue('rcvbuf' in stats)
+        self.assertFalse('drops' in stats)
+        self.assertFalse('rx_queue' in stats)
+        self.assertFalse(self.udpcomm._proc_net_udp)
+
+    def test_kernel_drops_not_linux(self):
+        ''' Test SO_RXQ_OVFL and /proc/net/udp are not used on other platforms '''
+        linux = udpcomm.LINUX
+        udpcomm.LINUX = False
+        try:
+            udp = UDPComm('127.0.0.1', 0, self.handler, self.core)
+        finally:
+            udpcomm.LINUX = linux
+        stats = udp.get_socket_stats()
+        udp._io_loop.remove_handler(udp._sock.fileno())
+        udp._sock.close()
+        self.assertEqual(udp._ancbufsize, 0)
+        self.assertFalse('drops' in stats)
+        self.assertFalse('rx_queue' in stats)
@@ -11,6 +11,9 @@ MAXQUEUELEN = 100
 MAXQUEUEAGE = 600
 MAXSDPLEN = 1200
 
+# send binary datagrams (see binarysdp)
+BINARY = False
+
 """
                       +--------------------+
                       |                    |
@@ -96,7 +99,10 @@ import zlib
 import gzip
 
 from sdp import SDP
+from sdppacker import SDPPacker
 from msgbus import MsgBus
+import sdpzdict
+import binarysdp
 
 from collections import deque
 
@@ -115,7 +121,8 @@ class UDPSocket(object):
     def _cb_udp_out(self, _token, _subject, message):
         datagram = message['value']
         log.debug('send to %s:%d:\n%s', self._host, self._port, str(datagram))
-        datagram = datagram.encode('utf-8')
+        if isinstance(datagram, str):
+            datagram = datagram.encode('utf-8')
         datagram_zlib = zlib.compress(datagram, zlib.Z_BEST_COMPRESSION)
         datagram_gzip = gzip.compress(datagram)
         datagram_zlib2 = UDPSocket.compress(datagram)
@@ -124,7 +131,10 @@ class UDPSocket(object):
             len(datagram_zlib), \
             len(datagram_gzip), \
             len(datagram_zlib2))
-        if len(datagram) > len(datagram_gzip):
+        if len(datagram) > len(datagram_zlib2):
+            log.info('send ZDICT')
+            self._socket.sendto(datagram_zlib2, (self._host, self._port))
+        elif len(datagram) > len(datagram_gzip):
             log.info('send ZIP')
             self._socket.sendto(datagram_gzip, (self._host, self._port))
             # self._socket.sendto(datagram_zlib, (self._host, self._port))
@@ -140,17 +150,18 @@ class UDPSocket(object):
 
     def _callback_read(self, sock):
         (data, addr) = sock.recvfrom(4096)
-        data = data.decode('utf-8')
+        dictid = sdpzdict.get_dictid(data)
+        if dictid is not None:
+            data = sdpzdict.decompress(data, dictid)
+        if not binarysdp.is_binary(data):
+            data = data.decode('utf-8')
         log.debug("got UDP datagram from %s @%.1f:\n%s", \
             str(addr), time.time(), str(data))
         self._msgbus.publish("udp/in", {"value": data})
 
     @staticmethod
     def compress(buf):
-        zdict = str.encode(u'\'}, {\', \': \'{}\', \'psversion\': \'\npsversion inid\', \'sha256\': \'SVW\n')
-        compressor = zlib.compressobj(level=zlib.Z_BEST_COMPRESSION, zdict=zdict)
-        result = compressor.compress(buf)
-        return result + compressor.flush()
+        return sdpzdict.compress(buf)
 
 
 class SDPClient(object):
@@ -191,7 +202,7 @@ class SDPClient(object):
         sdp = SDP(secret_key=self._secretkey, nonce='')
         sdp += ('id', self._controllerid)
         sdp += ('in', str(self._inn) + ',' + str(int(time.time())))
-        datagram = sdp.encode()
+        datagram = sdp.encode_binary() if BINARY else sdp.encode()
         self._msgbus.publish("sdp/out", {"value": datagram})
 
 
@@ -265,23 +276,19 @@ class SDPQueue(object):
             log.warning('nonce missing')
             self._msgbus.publish("sdp/bootstrap", None)
             return
-        sdp = SDP(secret_key=self._secretkey, nonce=self._nonce)
+        if not len(self._queue):
+            return
+        controllerid = self._queue[0][0].get_data('id')
+        packer = SDPPacker(controllerid, max_size=MAXSDPLEN, \
+            secret_key=self._secretkey, nonce=self._nonce, max_datagrams=1)
         pos = 0
-        datagram = None
         while pos < len(self._queue):
             [sdp_part, inn, tm] = self._queue[pos]
-            controllerid = sdp_part.get_data('id')
-            sdp += ('id', controllerid)
-            sdp += sdp_part
-            new_datagram = sdp.encode()
-            if len(new_datagram) > MAXSDPLEN:
+            if not packer.add_part(sdp_part):
                 log.info('more data than MAXSDPLEN, will send %d of %d items', pos, len(self._queue))
-                self._msgbus.publish("sdp/out", {"value": datagram})
-                return
-            datagram = new_datagram
+                break
             pos += 1
-        if datagram:
-            self._msgbus.publish("sdp/out", {"value": datagram})
+        self._msgbus.publish("sdp/out", {"value": packer.encode(binary=BINARY)[0]})
 
     def _cb_sdp_ack(self, _token, _subject, message):
         sdp = message['value']
@@ -372,7 +379,7 @@ class SensorSimulator(object):
         for key in updated_keys.keys():
             sdp += (key, list(r['val'] for r in self._registers[key]))
         # send immediately without queue
-        datagram = sdp.encode()
+        datagram = sdp.encode_binary() if BINARY else sdp.encode()
         log.debug('send immediately: %s', str(datagram))
         self._msgbus.publish("sdp/out", {"value": datagram})
 
@@ -0,0 +1,197 @@
+""" Raw UDP datagram capture
+
+Received datagrams are appended to a binary capture file with their
+arrival timestamp and source address, so real traffic can be analysed
+and replayed offline.
+
+File format (all numbers in network byte order):
+
+    file header: MAGIC (8 bytes)
+    record: timestamp (double), IPv4 address (4 bytes),
+            port (unsigned short), length (unsigned short), datagram
+
+Capture file is rotated when it grows over maxbytes, old files are
+renamed to filename.1 ... filename.<backups>.
+"""
+import os
+import time
+import socket
+import struct
+import tornado.ioloop
+
+from stats import Stats
+
+import logging
+log = logging.getLogger(__name__)   # pylint: disable=invalid-name
+log.addHandler(logging.NullHandler())
+
+__all__ = [
+    'UDPCapture', 'read_capture',
+    'MAGIC',
+]
+
+MAGIC = b'UDPCAP\x00\x01'
+RECORD = struct.Struct('!d4sHH')
+MAX_BYTES = 64 * 1024 * 1024
+BACKUPS = 5
+FLUSH_SIZE = 256 * 1024
+
+class UDPCapture(object):
+    """ Rotating binary capture file writer
+
+    Records are collected into a memory buffer and written to the file
+    by an IOLoop callback after the current batch of datagrams is
+    processed (or when the buffer grows over FLUSH_SIZE).
+    """
+    def __init__(self, filename, maxbytes=MAX_BYTES, backups=BACKUPS):
+        """ Create capture writer, capture is not started
+
+        :param filename: capture file name
+        :param maxbytes: rotate file when it grows over this size
+        :param backups: number of rotated files to keep
+        """
+        self._filename = filename
+        self._maxbytes = max(len(MAGIC) + RECORD.size, int(maxbytes))
+        self._backups = max(0, int(backups))
+        self._file = None
+        self._size = 0
+        self._buf = bytearray()
+        self._flush_pending = False
+        self._stats = Stats()
+        self._io_loop = tornado.ioloop.IOLoop.instance()
+
+    def start(self):
+        """ Start capture, new records are appended to the file """
+        if self._file:
+            return
+        log.info('start capture to %s', self._filename)
+        self._open()
+        self._stats.set_timestamp('started')
+
+    def stop(self):
+        """ Stop capture and close the file """
+        if not self._file:
+            return
+        log.info('stop capture to %s', self._filename)
+        self.flush()
+        self._file.close()
+        self._file = None
+        self._stats.set_timestamp('stopped')
+
+    def toggle(self):
+        """ Start capture if stopped, stop if started
+
+        :returns: True if capture is active now
+        """
+        if self._file:
+            self.stop()
+        else:
+            self.start()
+        return self.is_active()
+
+    def is_active(self):
+        """ Check if capture is running
+
+        :returns: True if capture is active
+        """
+        return self._file is not None
+
+    def write_batch(self, batch, ts=None):
+        """ Add datagrams to the capture buffer
+
+        :param batch: list of (data, addr) tuples, data can be any
+            bytes-like object
+        :param ts: arrival timestamp (default is current time)
+        """
+        if not self._file:
+            return
+        if ts is None:
+            ts = time.time()
+        buf = self._buf
+        for (data, addr) in batch:
+            try:
+                ip = socket.inet_aton(addr[0])
+            except OSError:
+                self._stats.add('skipped', 1)
+                continue
+            buf += RECORD.pack(ts, ip, addr[1], len(data))
+            buf += data
+        self._stats.add('records', len(batch))
+        if len(buf) >= FLUSH_SIZE:
+            self.flush()
+        elif not self._flush_pending and buf:
+            self._flush_pending = True
+            self._io_loop.add_callback(self.flush)
+
+    def flush(self):
+        """ Write buffered records to the file """
+        self._flush_pending = False
+        if not self._file or not self._buf:
+            return
+        try:
+            self._file.write(self._buf)
+            self._file.flush()
+        except OSError as ex:
+            log.error('capture write error: %s', str(ex))
+            self._stats.add('errors', 1)
+            self._buf = bytearray()
+            self.stop()
+            return
+        self._size += len(self._buf)
+        self._stats.add('bytes', len(self._buf))
+        self._buf = bytearray()
+        if self._size >= self._maxbytes:
+            self._rotate()
+
+    def _open(self):
+        """ Open new capture file and write the file header """
+        self._file = open(self._filename, 'wb')
+        self._file.write(MAGIC)
+        self._size = len(MAGIC)
+
+    def _rotate(self):
+        """ Rename current file to filename.1 and open a new one """
+        self._file.close()
+        for i in range(self._backups - 1, 0, -1):
+            src = '%s.%d' % (self._filename, i)
+            if os.path.exists(src):
+                os.replace(src, '%s.%d' % (self._filename, i + 1))
+        if self._backups:
+            os.replace(self._filename, self._filename + '.1')
+        self._stats.add('rotated', 1)
+        self._open()
+
+    def get_stats(self):
+        """ Return capture status and statistics
+
+        :returns: statistics
+        """
+        self._stats.set('active', self.is_active())
+        self._stats.set('filename', self._filename)
+        return self._stats.get()
+
+    def __str__(self):
+        return 'UDPCapture(' + str(self._filename) + ', ' + \
+            ('active' if self.is_active() else 'stopped') + ')'
+
+def read_capture(filename):
+    """ Read datagrams from the capture file
+
+    :param filename: capture file name
+
+    :returns: generator of (timestamp, (addr, port), data) tuples
+
+    :raises ValueError: if the file is not a capture file
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a capture file: %s' % filename)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            (ts, ip, port, length) = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield (ts, (socket.inet_ntoa(ip), port), data)
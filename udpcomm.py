@@ -1,20 +1,34 @@
+import os
+import sys
 import time
 import socket
+import logging
 import tornado.ioloop
 from functools import partial
+from collections import deque
 
 from hosts import Hosts
+from stats import Stats
+from ratelimit import RateLimiter
 
-import logging
 log = logging.getLogger(__name__)
 log.addHandler(logging.NullHandler())
 
 MAX_RECV_BUF = 100000
 MAX_SDP_SIZE = 1200
+RECV_BUDGET = 64
+SEND_QUEUE_SIZE = 1024
+LINUX = sys.platform.startswith('linux')
+# Linux socket option for kernel receive queue drop counter
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if LINUX else None)
+PROC_NET_UDP = '/proc/net/udp'
 
 class UDPComm(object):
     ''' UDP socket listener '''
-    def __init__(self, addr, port, handler, core):
+    def __init__(self, addr, port, handler, core, recv_budget=RECV_BUDGET,
+                 reuseport=False, send_queue_size=SEND_QUEUE_SIZE,
+                 rate_limit=0, rate_burst=None, capture=None,
+                 rcvbuf=0, sndbuf=0):
         ''' Listen UDP socket and forward all incoming datagrams to
         the handler(host, data)
 
@@ -22,6 +36,20 @@ class UDPComm(object):
         :param port: UDP listen port number
         :param handler: handler function for incoming data
         :param core: Core instance
+        :param recv_budget: max number of datagrams to read per
+            IOLoop wakeup
+        :param reuseport: set SO_REUSEPORT to share the port with
+            other ingest worker processes
+        :param send_queue_size: max number of datagrams waiting for
+            the socket to become writable
+        :param rate_limit: max datagrams per second from one source
+            address (0 for unlimited)
+        :param rate_burst: max burst of datagrams from one source
+            address
+        :param capture: optional UDPCapture instance for recording
+            received datagrams
+        :param rcvbuf: socket receive buffer size (0 for system default)
+        :param sndbuf: socket send buffer size (0 for system default)
         '''
         log.info('Initialise UDPComm(%s, %s, %s)', str(addr), str(port), str(handler))
         self.addr = addr
@@ -29,19 +57,60 @@ class UDPComm(object):
         self._handler = handler
         self._core = core
         self._hosts = self._core.hosts()
+        self._recv_budget = max(1, int(recv_budget))
+        self._stats = Stats()
+        self._addr_limit = RateLimiter(rate_limit, rate_burst)
+        self._capture = capture
+        # datagrams are received directly into this preallocated buffer,
+        # there is always at least MAX_RECV_BUF bytes of free space for
+        # the next datagram
+        self._recv_buf = bytearray(2 * MAX_RECV_BUF)
+        self._recv_view = memoryview(self._recv_buf)
+        # datagrams that could not be sent immediately, entries are
+        # [addr, data, coalesce key] lists
+        self._send_queue = deque()
+        self._send_queue_size = max(1, int(send_queue_size))
+        self._send_pending = {}
 
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self._sock.setblocking(False)
+        if reuseport:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        if rcvbuf:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, int(rcvbuf))
+        if sndbuf:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, int(sndbuf))
+        # kernel reports receive queue drops as ancillary data if supported
+        self._kernel_drops = 0
+        self._ancbufsize = 0
+        self._proc_net_udp = LINUX
+        if LINUX and SO_RXQ_OVFL is not None:
+            try:
+                self._sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                self._ancbufsize = socket.CMSG_SPACE(4)
+            except (OSError, AttributeError):
+                log.info('SO_RXQ_OVFL not supported, using %s for drops', PROC_NET_UDP)
         self._sock.bind((self.addr, self.port))
 
         self._io_loop = tornado.ioloop.IOLoop.instance()
+        self._start()
+
+    def _start(self):
+        ''' Start listening the socket in IOLoop '''
         self._io_loop.add_handler(self._sock.fileno(), partial(self._callback, self._sock), self._io_loop.READ)
 
+    def close(self):
+        ''' Stop listening and close the socket '''
+        self._io_loop.remove_handler(self._sock.fileno())
+        self._sock.close()
+
     def _callback(self, sock, fd, events):
         ''' UDP socket event handler
         '''
         if events & self._io_loop.READ:
             self._callback_read(sock)
+        if events & self._io_loop.WRITE:
+            self._callback_write(sock)
         if events & self._io_loop.ERROR:
             log.critical("IOLoop error")
             sys.exit(1)
@@ -49,44 +118,279 @@ class UDPComm(object):
     def _callback_read(self, sock):
         ''' UDP socket read event handler
 
-        This method reads incoming UDP datagram, finds sender Host
-        instance and calls self._handler with Host and datagram
-        string (in UTF-8 encoding)
+        This method drains up to self._recv_budget datagrams from the
+        socket and processes them as one batch.
+
+        Datagrams are received with recvfrom_into() into the reusable
+        receive buffer and are passed on as memoryview slices of it,
+        so they are valid only during the processing of the batch.
+        If the buffer fills up before the budget is exhausted, the
+        batch collected so far is processed and the buffer is reused.
+
+        If the budget is exhausted, remaining datagrams are left in the
+        socket buffer. The socket stays readable and IOLoop calls this
+        handler again after serving other pending events, so HTTP and
+        WebSocket traffic is not starved by a UDP burst.
 
         :param sock: receiving socket instance
 
         '''
-        (data, addr) = sock.recvfrom(MAX_RECV_BUF)
+        ts = time.perf_counter()
+        batch = []
+        count = 0
+        offset = 0
+        while count < self._recv_budget:
+            if len(self._recv_buf) - offset < MAX_RECV_BUF:
+                self._process_batch(batch, ts)
+                batch = []
+                offset = 0
+            view = self._recv_view[offset:offset + MAX_RECV_BUF]
+            try:
+                if self._ancbufsize:
+                    (nbytes, ancdata, _flags, addr) = \
+                        sock.recvmsg_into([view], self._ancbufsize)
+                    if ancdata:
+                        self._read_ancdata(ancdata)
+                else:
+                    (nbytes, addr) = sock.recvfrom_into(view)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as ex:
+                log.warning('recvfrom_into() error: %s', str(ex))
+                self._stats.add('rx/errors', 1)
+                break
+            batch.append((view[:nbytes], addr))
+            offset += nbytes
+            count += 1
+        self._stats.add('rx/wakeups', 1)
+        if count >= self._recv_budget:
+            self._stats.add('rx/budget_exhausted', 1)
+        self._process_batch(batch, ts)
+
+    def _read_ancdata(self, ancdata):
+        ''' Read kernel drop counter from recvmsg() ancillary data
+
+        :param ancdata: list of (level, type, data) tuples
+        '''
+        for (level, ctype, data) in ancdata:
+            if level == socket.SOL_SOCKET and ctype == SO_RXQ_OVFL and \
+                    len(data) >= 4:
+                self._kernel_drops = int.from_bytes(data[:4], sys.byteorder)
+
+    def _process_batch(self, batch, ts=None):
+        ''' Process datagrams read during one IOLoop wakeup
+
+        :param batch: list of (data, addr) tuples
+        :param ts: optional wakeup time (time.perf_counter())
+        '''
+        if not batch:
+            return
+        self._stats.add('rx/datagrams', len(batch))
+        if self._capture is not None and self._capture.is_active():
+            self._capture.write_batch(batch)
+        for (data, addr) in batch:
+            self._process_datagram(data, addr, ts)
+
+    def _process_datagram(self, data, addr, ts=None):
+        ''' Find sender Host instance and call self._handler with
+        Host and datagram string (in UTF-8 encoding)
+
+        :param data: datagram (bytes-like, may be a memoryview of the
+            receive buffer)
+        :param addr: sender (addr, port) tuple
+        :param ts: optional wakeup time (time.perf_counter())
+        '''
         if len(data) > MAX_SDP_SIZE:
             log.warning("datagram from %s is too big: %d", str(addr), len(data))
-        log.debug("got UDP datagram from %s @%.1f: %s", str(addr), time.time(), str(data))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("got UDP datagram from %s @%.1f: %s", str(addr), time.time(), str(bytes(data)))
+        host = self._hosts.get_by_addr(addr)
+        if not self._addr_limit.allow(addr):
+            self._stats.add('rx/dropped/ratelimit_addr', 1)
+            if host is not None:
+                host.drop('ratelimit_addr')
+            return
+        if host is None:
+            host = self._wire_host(addr)
+        host.receiver(data, ts)
+
+    def _wire_host(self, addr):
+        ''' Find or create Host instance for the address and set it up
+        for sending and receiving via this UDPComm
+
+        :param addr: sender (addr, port) tuple
+
+        :returns: Host instance
+        '''
         hosturi = 'udp://' + str(addr[0]) + ':' + str(addr[1])
         host = self._hosts.find_by_id(hosturi)
-        host.set_receiver(self._handler)  # FIXME set it only once
-        host.set_sender(self._send)  # FIXME set it only once
-        host.set_addr(addr) # FIXME set it only once
-        host.receiver(data)
+        host.set_receiver(self._handler)
+        host.set_sender(self._send)
+        host.set_addr(addr)
+        self._hosts.bind_addr(addr, host)
+        return host
 
-    def _send(self, host, addr, sendstring):
+    def _send(self, host, addr, sendstring, coalesce=None):
         ''' Send UDP datagramm to the host
 
         id of host is (addr, port) duple. data can be binary data
         or string in UTF-8 encoding
 
+        If the socket send buffer is full, datagram is put into the
+        send queue and sent when the socket becomes writable. If the
+        queue is full, the oldest datagram is dropped.
+
+        Queued datagram with the same address and coalesce key is
+        replaced with the newer one (newer ACK acknowledges everything
+        the older one did).
+
         :param host: Host instance of controller
         :param addr: host (addr, port) tuple
         :param sendstring: string data to send
+        :param coalesce: optional key for replacing queued datagram
+
+        :returns: number of bytes sent or None if datagram was queued
+            or dropped
         '''
         if isinstance(sendstring, str):
             sendstring = sendstring.encode(encoding='UTF-8')
         log.info('send(%s, "%s")', str(host), sendstring)
-        try:
-            sendlen = self._sock.sendto(sendstring, addr)
-            return sendlen
-        except:
-            import traceback
-            traceback.print_exc() # debug
+        if not self._send_queue:
+            try:
+                return self._sock.sendto(sendstring, addr)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except OSError as ex:
+                log.warning('sendto(%s) error: %s', str(addr), str(ex))
+                self._stats.add('tx/errors', 1)
+                return None
+        self._enqueue(addr, sendstring, coalesce)
+        return None
+
+    def _enqueue(self, addr, data, coalesce):
+        ''' Put datagram into the send queue and wait for the socket
+        to become writable
+
+        :param addr: host (addr, port) tuple
+        :param data: datagram (bytes)
+        :param coalesce: optional key for replacing queued datagram
+        '''
+        if coalesce is not None:
+            entry = self._send_pending.get((addr, coalesce), None)
+            if entry:
+                entry[1] = data
+                self._stats.add('tx/queue/coalesced', 1)
+                return
+        if len(self._send_queue) >= self._send_queue_size:
+            self._forget(self._send_queue.popleft())
+            self._stats.add('tx/queue/dropped', 1)
+        elif not self._send_queue:
+            self._start_writing()
+        entry = [addr, data, coalesce]
+        self._send_queue.append(entry)
+        if coalesce is not None:
+            self._send_pending[(addr, coalesce)] = entry
+        self._stats.add('tx/queue/queued', 1)
+        self._stats.set('tx/queue/depth', len(self._send_queue))
+
+    def _start_writing(self):
+        ''' Wait for the socket to become writable '''
+        self._io_loop.update_handler(self._sock.fileno(), \
+            self._io_loop.READ | self._io_loop.WRITE)
+
+    def _forget(self, entry):
+        ''' Remove send queue entry from the coalesce index
+
+        :param entry: send queue entry
+        '''
+        if entry[2] is not None and \
+                self._send_pending.get((entry[0], entry[2])) is entry:
+            del self._send_pending[(entry[0], entry[2])]
+
+    def _callback_write(self, sock):
+        ''' UDP socket write event handler
+
+        Send queued datagrams until the queue is empty or the socket
+        send buffer is full again.
+
+        :param sock: sending socket instance
+        '''
+        while self._send_queue:
+            (addr, data, coalesce) = self._send_queue[0]
+            try:
+                sock.sendto(data, addr)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError as ex:
+                log.warning('sendto(%s) error: %s', str(addr), str(ex))
+                self._stats.add('tx/errors', 1)
+            self._forget(self._send_queue.popleft())
+        self._stats.set('tx/queue/depth', len(self._send_queue))
+        if not self._send_queue:
+            self._io_loop.update_handler(sock.fileno(), self._io_loop.READ)
+
+    def get_capture(self):
+        """ Return datagram capture instance
+
+        :returns: UDPCapture instance or None if not configured
+        """
+        return self._capture
+
+    def get_socket_stats(self):
+        """ Return socket buffer sizes and kernel drop counters
+
+        Drops are read from SO_RXQ_OVFL ancillary data if supported,
+        otherwise from /proc/net/udp. Queue sizes are read from
+        /proc/net/udp if available (Linux only, not retried once it
+        is found missing).
+
+        :returns: socket statistics
+        """
+        r = {
+            'rcvbuf': self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF),
+            'sndbuf': self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF),
+        }
+        if self._ancbufsize:
+            r['drops'] = self._kernel_drops
+            r['drops_source'] = 'SO_RXQ_OVFL'
+        proc = self._read_proc_net_udp()
+        if proc:
+            (r['tx_queue'], r['rx_queue'], drops) = proc
+            if not self._ancbufsize:
+                r['drops'] = drops
+                r['drops_source'] = PROC_NET_UDP
+        return r
+
+    def _read_proc_net_udp(self):
+        ''' Find this socket from /proc/net/udp
+
+        :returns: (tx_queue, rx_queue, drops) tuple or None if not found
+        '''
+        if not self._proc_net_udp:
             return None
+        try:
+            inode = str(os.fstat(self._sock.fileno()).st_ino)
+            with open(PROC_NET_UDP, 'r') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        (tx_queue, rx_queue) = fields[4].split(':')
+                        return (int(tx_queue, 16), int(rx_queue, 16), int(fields[12]))
+        except OSError as ex:
+            log.info('%s not available: %s', PROC_NET_UDP, str(ex))
+            self._proc_net_udp = False
+        except ValueError as ex:
+            log.debug('%s read error: %s', PROC_NET_UDP, str(ex))
+        return None
+
+    def get_stats(self):
+        """ Return some statistics
+
+        :returns: statistics
+        """
+        stats = dict(self._stats.get())
+        stats['socket'] = self.get_socket_stats()
+        return stats
 
     def __str__(self):
-        return('UDPComm(' + str(self.addr) + ':' + str(self.port) + '), known hosts:' + str(self._hosts))
+        return('UDPComm(' + str(self.addr) + ':' + str(self.port) + '), stats: ' + str(self._stats) + ', known hosts:' + str(self._hosts))
@@ -6,15 +6,19 @@ according to the Uniscada Service Description Protocol.
 import re
 import copy
 
-from sdpitem import SDPItem
+from sdpitem import SDPItem, WireValues, is_values, VALUES_RE_MAX_LEN
 from sdpexception import SDPException, SDPDecodeException
 
 import logging
 log = logging.getLogger(__name__)   # pylint: disable=invalid-name
 log.addHandler(logging.NullHandler())
 
+IN_RE = re.compile(r'^(\d+)(,\d+)?$')
+STATUS_VALUES = {'0': 0, '1': 1, '2': 2, '3': 3}
+
 class UnsecureSDP(SDPItem):
     """ Convert to and from SDP protocol datagram """
+    __slots__ = ('_multipart_pieces', '_multipart_parent')
 
     def __init__(self, secret_key=None, nonce=None):
         """ Create a new empty in-memory ``SDP`` datagram
@@ -78,7 +82,7 @@ class UnsecureSDP(SDPItem):
         None if key is missing
         """
         if key == 'id' and self._multipart_parent:
-            return self._multipart_parent.data.get('id', None)
+            return self._multipart_parent._id
         return super(UnsecureSDP, self).get_data(key)
 
     def add_sdp_multipart(self, sdp):
@@ -148,10 +152,43 @@ class UnsecureSDP(SDPItem):
         return datagram
 
     @staticmethod
-    def decode(datagram, sdp=None):
+    def peek_id(datagram):
+        """ Find controller id from the datagram without decoding it
+
+        Datagram is not validated, full decode may still fail.
+
+        :param datagram: The string representation of SDP datagram
+
+        :returns: controller id or None if "id:" line is not found
+        """
+        if datagram.startswith('id:'):
+            start = 3
+        else:
+            start = datagram.find('\nid:')
+            if start < 0:
+                return None
+            start += 4
+        end = datagram.find('\n', start)
+        if end < 0:
+            end = len(datagram)
+        ctrid = datagram[start:end]
+        if '\r' in ctrid:
+            ctrid = ctrid[:ctrid.index('\r')]
+        return ctrid
+
+    @staticmethod
+    def decode(datagram, sdp=None, values=None):
         """ Decodes SDP datagram to packet
 
+        Every line is split and classified only once. Duplicate keys
+        are detected the same way as get_data() would do it: a key is
+        a duplicate only if its earlier value is not empty (e.g. status
+        0 may be repeated).
+
         :param datagram: The string representation of SDP datagram
+        :param values: optional list for deferred validation, List of
+            Values strings are stored unchecked and appended to it
+            (caller MUST validate them, see SignedSDP.decode_many())
         """
 
         log.debug("decode: %s", str(datagram))
@@ -159,17 +196,33 @@ class UnsecureSDP(SDPItem):
         multipart_parent = None
         if not sdp:
             sdp = UnsecureSDP()
+        table = sdp._table
         for line in datagram.splitlines():
             if line == '':
                 log.warning('empty line in datagram')
                 continue
-            (key, val) = SDPItem._decode_line(line)
+            (key, colon, val) = line.partition(':')
+            if not colon:
+                log.error('datagram line format error: no colon')
+                raise SDPDecodeException('datagram line error: \"' + \
+                    line + '\"')
+            if ':' in val:
+                log.error('datagram line format error: more than one colon')
+                raise SDPDecodeException('colon in value: \"' + val + '\"')
+            if key == '':
+                log.error('datagram line format error: empty key')
+                raise SDPDecodeException('empty key in line: \"' + line + '\"')
+
             if key == 'id':
                 if controllerid:
                     raise SDPDecodeException('ONLY ONE "id" is allowed')
                 controllerid = val
-            if sdp.get_data(key):
-                if key == "in":
+                if sdp._id:
+                    raise SDPDecodeException('multiple "%s" fields' % key)
+                sdp._id = val
+                continue
+            if key == 'in':
+                if sdp._in:
                     if not multipart_parent:
                         if not controllerid:
                             raise SDPDecodeException('in multipart SDP the "id" MUST BE before first "in"')
@@ -177,12 +230,56 @@ class UnsecureSDP(SDPItem):
                         multipart_parent.add_keyvalue("id", controllerid)
                     multipart_parent.add_sdp_multipart(sdp)
                     sdp = sdp.__class__()
-                else:
-                    raise SDPDecodeException('multiple "%s" fields' % key)
-            try:
-                sdp.add_keyvalue(key, val)
-            except SDPException as ex:
-                raise SDPDecodeException(ex)
+                    table = sdp._table
+                if not IN_RE.match(val):
+                    raise SDPDecodeException(SDPException('Illegal "in" format: %s' % val))
+                sdp._in = val
+                continue
+
+            if ':' + key in table:
+                raise SDPDecodeException('multiple "%s" fields' % key)
+            suffix = key[-1]
+            if suffix == 'V' and key != 'TOV':
+                # "V" and "W" keys share the same slot
+                slot = key[:-1] + 'W'
+                dup = table.get(slot, None)
+                if is_values(dup):
+                    dup = None
+            else:
+                slot = key
+                dup = table.get(slot, None)
+                if suffix == 'W' and not is_values(dup):
+                    dup = None
+            if dup:
+                raise SDPDecodeException('multiple "%s" fields' % key)
+
+            if val == '?':
+                table[':' + key] = '?'
+            elif suffix == 'S':
+                if not val in STATUS_VALUES:
+                    raise SDPDecodeException(SDPException('Illegal Status value: ' + val))
+                table[slot] = STATUS_VALUES[val]
+            elif suffix == 'W':
+                if values is not None and type(val) is str and \
+                        len(val) <= VALUES_RE_MAX_LEN:
+                    table[slot] = WireValues(val)
+                    values.append(val)
+                    continue
+                try:
+                    sdp._add_keyvalue_values(key, val)
+                except SDPException as ex:
+                    raise SDPDecodeException(ex)
+            elif suffix == 'F' or key == 'TOV':
+                if val == '':
+                    raise SDPDecodeException(SDPException('Float value _MUST_ exist'))
+                table[slot] = val
+            elif suffix == 'V':
+                table[slot] = val
+            else:
+                try:
+                    sdp._add_keyvalue_string(key, val)
+                except SDPException as ex:
+                    raise SDPDecodeException(ex)
         if not controllerid:
             log.error('"id" missing in datagram')
             raise SDPDecodeException('"id:" _MUST_ exists in datagram')